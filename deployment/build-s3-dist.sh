@@ -273,6 +273,15 @@ echo "Building Glue ETL script"
 cd "$source_dir/glue" || exit 1
 echo "cp *_transformations.py $regional_dist_dir/"
 cp *_transformations.py "$regional_dist_dir"
+echo "Building Glue ETL helpers library"
+[ -e dist ] && rm -r dist
+mkdir -p dist
+zip -q -r ./dist/etl_helpers.zip etl_helpers -x "*__pycache__*"
+# the memory profiler is shared with the uploader lambdas, its single source is in the upload_engine package
+echo "Adding upload_engine.profiling to the Glue ETL helpers library"
+(cd "$source_dir/aws_lambda" && zip -q -g "$source_dir/glue/dist/etl_helpers.zip" upload_engine/__init__.py upload_engine/profiling.py)
+cp "./dist/etl_helpers.zip" "$regional_dist_dir/etl_helpers.zip"
+rm -rf ./dist
 
 echo "------------------------------------------------------------------------------"
 echo "Build vue website"
@@ -2,15 +2,19 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from chalice import Chalice, IAMAuthorizer
-import boto3
 import json
 import os
+from chalicelib.batch_runs import parse_pii_fields, start_batch, start_queued
+from chalicelib.clients import get_service_client, patch_xray
+from chalicelib.job_runs import JobRunsCache, list_job_runs, parse_job_runs_query
+from chalicelib.progress import read_audience_progress
+from chalicelib.schema_sniffer import FILE_FORMATS, sniff_columns
+from chalicelib.size_estimator import SAMPLE_BYTES, estimate_size
 from chalicelib.snap_api import snap_routes
 from chalicelib.tiktok_api import tiktok_routes
 
-from aws_xray_sdk.core import xray_recorder
-from aws_xray_sdk.core import patch_all
-patch_all()
+# instruments the AWS SDK calls, see XRAY_PATCH_MODULES
+patch_xray()
 
 import logging
 
@@ -28,32 +32,205 @@ authorizer = IAMAuthorizer()
 # Environment variables
 VERSION = os.environ['VERSION']
 AMC_GLUE_JOB_NAME = os.environ['AMC_GLUE_JOB_NAME']
+ARTIFACT_BUCKET_NAME = os.environ['ARTIFACT_BUCKET_NAME']
+BATCH_QUEUE_URL = os.environ['BATCH_QUEUE_URL']
+
+# largest page of a single S3 ListObjectsV2 request
+LIST_BUCKET_MAX_KEYS = 1000
+# largest preview returned by read_file, well below the Lambda response size limit
+READ_FILE_MAX_PREVIEW_BYTES = 1024 * 1024
+
+# runs of the transformation job, shared by the requests served by this container
+job_runs_cache = JobRunsCache(AMC_GLUE_JOB_NAME)
 
 
 @app.route('/get_etl_jobs', cors=True, methods=['GET'], authorizer=authorizer)
 def get_etl_jobs():
     """
-    Retrieves metadata for all runs of a given Glue ETL job definition.
+    Retrieves metadata for the runs of a given Glue ETL job definition, newest first,
+    one page at a time.
+
+    Query string parameters (all optional):
+
+    .. code-block:: python
+
+        {
+            "max_results": integer (from 1 to 200, default 200),
+            "next_token": string (NextToken of the previous page),
+            "segment_name": string,
+            "state": string (comma-separated JobRunState values, e.g. RUNNING,FAILED),
+            "started_after": string (ISO 8601 timestamp),
+            "started_before": string (ISO 8601 timestamp),
+            "since": string (ISO 8601 timestamp, e.g. the PolledAt of the previous poll,
+                             to only get the runs started or updated since)
+        }
 
     Returns:
 
     .. code-block:: python
 
-        {'JobRuns': [...]}
+        {'JobRuns': [...], 'NextToken': string, 'PolledAt': string}
     """
     try:
         log_request_parameters()
-        client = boto3.client('glue', region_name=os.environ['AWS_REGION'])
-        response = client.get_job_runs(JobName=AMC_GLUE_JOB_NAME)
-        for i in range(len(response['JobRuns'])):
-            if 'Arguments' in response['JobRuns'][i]:
-                response['JobRuns'][i]['SegmentName'] = response['JobRuns'][i]['Arguments']['--segment_name']
+        query = parse_job_runs_query(app.current_request.query_params)
+        client = get_service_client('glue')
+        runs, next_token = list_job_runs(job_runs_cache, client, **query)
+        job_runs = []
+        for run in runs:
+            run = dict(run)
+            if 'Arguments' in run:
+                run['SegmentName'] = run['Arguments'].get('--segment_name')
+            job_runs.append(run)
+        response = {'JobRuns': job_runs, 'NextToken': next_token, 'PolledAt': job_runs_cache.polled_at}
+        # only the runs of the page are serialized
         return json.loads(json.dumps(response, default=str))
     except Exception as e:
         logger.error("Something went wrong while getting ETL jobs - ERROR: {}".format(e))
         raise Exception("Something went wrong while getting ETL jobs")
 
 
+@app.route('/get_audience_progress', cors=True, methods=['GET'], authorizer=authorizer)
+def get_audience_progress():
+    """
+    Get the progress of the latest transformation of an audience and of its upload.
+
+    Query string parameters:
+
+    .. code-block:: python
+
+        {
+            "platform": string (snap or tiktok),
+            "segment_name": string
+        }
+
+    Returns:
+        The phase of the audience (TRANSFORMING, TRANSFORMATION_FAILED, TRANSFORMED,
+        UPLOADING or UPLOADED), the parts written by the Glue job and its throughput per
+        stage, and, once the manifest is written, the parts uploaded, the users accepted
+        by the platform, the upload throughput and the estimated seconds left.
+
+        .. code-block:: python
+
+            {
+                "platform": string,
+                "segment_name": string,
+                "phase": string,
+                "job_run": {"Id": string, "JobRunState": string, "StartedOn": string, "CompletedOn": string},
+                "transformation": {
+                    "rows_read": integer,
+                    "parts_produced": integer,
+                    "rows_produced": integer,
+                    "seconds": number,
+                    "rows_per_second": number,
+                    "stages": {...}
+                },
+                "upload": {
+                    "parts_total": integer,
+                    "parts_uploaded": integer,
+                    "rows_uploaded": integer,
+                    "users_uploaded": integer,
+                    "seconds": number,
+                    "rows_per_second": number,
+                    "eta_seconds": number
+                }
+            }
+
+    Raises:
+        500: ChaliceViewError - internal server error
+    """
+    try:
+        log_request_parameters()
+        query_params = app.current_request.query_params or {}
+        if not query_params.get('platform') or not query_params.get('segment_name'):
+            raise TypeError('platform and segment_name are required')
+        return read_audience_progress(get_service_client('s3'), get_service_client('glue'), job_runs_cache,
+                                     ARTIFACT_BUCKET_NAME, query_params['platform'], query_params['segment_name'])
+    except Exception as e:
+        logger.error("Something went wrong while getting the audience progress - ERROR: {}".format(e))
+        raise Exception("Something went wrong while getting the audience progress")
+
+
+@app.route('/start_transformations', cors=True, methods=['POST'], content_types=['application/json'], authorizer=authorizer)
+def start_transformations():
+    """ Start the transformation Glue job for a batch of audiences
+
+    Body:
+
+    .. code-block:: python
+
+        {
+            "entries": [{
+                "sourceBucket": string,
+                "sourceKey": string,
+                "outputBucket": string,
+                "piiFields": string (JSON list of {"column_name": string, "pii_type": string}),
+                "segmentName": string
+                },
+                ...
+            ] (at most 100 entries)
+        }
+
+
+    Returns:
+        Every entry is validated before any run is started. The entries are queued behind
+        the entries of the earlier batches, and the queued entries that fit in the free
+        concurrent runs of the job are started right away. The entries left in the queue are
+        returned in "queued", in the format of the request, and are started in order as runs
+        of the job finish, they must not be submitted again. The entries whose run could not
+        be started (e.g. invalid job arguments) are returned in "failed".
+
+        .. code-block:: python
+
+            {
+                "started": [{
+                    "segmentName": string,
+                    "sourceKey": string,
+                    "JobRunId": string
+                    },
+                    ...
+                ],
+                "queued": [{...}, ...],
+                "failed": [{
+                    "segmentName": string,
+                    "sourceKey": string,
+                    "error": string
+                    },
+                    ...
+                ]
+            }
+
+    Raises:
+        500: ChaliceViewError - internal server error
+    """
+    try:
+        log_request_parameters()
+        request = json.loads(app.current_request.raw_body.decode())
+        started, queued, failed = start_batch(get_service_client('glue'), get_service_client('sqs'), BATCH_QUEUE_URL,
+                                              AMC_GLUE_JOB_NAME, request.get('entries'))
+        return {'started': started, 'queued': queued, 'failed': failed}
+    except Exception as e:
+        logger.error("Something went wrong while starting the transformations - ERROR: {}".format(e))
+        raise Exception("Something went wrong while starting the transformations")
+
+
+@app.on_cw_event({
+    "source": ["aws.glue"],
+    "detail-type": ["Glue Job State Change"],
+    "detail": {"state": ["SUCCEEDED", "FAILED", "TIMEOUT", "STOPPED"]}
+})
+def start_queued_transformations(event):
+    """
+    Start the queued entries of the batches of /start_transformations when a run of the
+    transformation job finishes and frees one of its concurrent runs.
+    """
+    if event.detail.get('jobName') != AMC_GLUE_JOB_NAME:
+        return
+    started, _ = start_queued(get_service_client('glue'), get_service_client('sqs'), BATCH_QUEUE_URL, AMC_GLUE_JOB_NAME)
+    for run in started:
+        logger.info("Started queued transformation of {} ({})".format(run['segmentName'], run['JobRunId']))
+
+
 @app.route('/version', cors=True, methods=['GET'], authorizer=authorizer)
 def version():
     """
@@ -71,27 +248,38 @@ def version():
 
 @app.route('/list_bucket', cors=True, methods=['POST'], content_types=['application/json'], authorizer=authorizer)
 def list_bucket():
-    """ List the contents of a user-specified S3 bucket
+    """ List the contents of a user-specified S3 bucket, one page at a time
 
     Body:
 
     .. code-block:: python
 
         {
-            "s3bucket": string
+            "s3bucket": string,
+            "prefix": string (optional),
+            "delimiter": string (optional, e.g. "/" to list a single folder),
+            "max_keys": integer (optional, from 1 to 1000, default 1000),
+            "continuation_token": string (optional, next_continuation_token of the previous page)
         }
 
 
     Returns:
-        A list of S3 keys (i.e. paths and file names) for all objects in the bucket.
+        The S3 keys (i.e. paths and file names) of one page of the objects under the prefix,
+        the folders under the prefix when a delimiter is given, and the token of the next page,
+        null on the last page.
 
         .. code-block:: python
 
             {
                 "objects": [{
-                    "key": string
+                    "key": string,
+                    "last_modified": string,
+                    "size": integer
                     },
                     ...
+                ],
+                "prefixes": [string, ...],
+                "next_continuation_token": string
             }
 
     Raises:
@@ -99,12 +287,25 @@ def list_bucket():
     """
     log_request_parameters()
     try:
-        s3 = boto3.resource('s3')
-        bucket = json.loads(app.current_request.raw_body.decode())['s3bucket']
-        results = []
-        for s3object in s3.Bucket(bucket).objects.all():
-            results.append({"key": s3object.key, "last_modified": s3object.last_modified.isoformat(
-            ), "size": s3object.size})
+        s3 = get_service_client('s3')
+        request = json.loads(app.current_request.raw_body.decode())
+        max_keys = request.get('max_keys', LIST_BUCKET_MAX_KEYS)
+        if not isinstance(max_keys, int) or not 1 <= max_keys <= LIST_BUCKET_MAX_KEYS:
+            raise TypeError('max_keys must be an integer from 1 to ' + str(LIST_BUCKET_MAX_KEYS))
+        params = {'Bucket': request['s3bucket'], 'MaxKeys': max_keys, 'Prefix': request.get('prefix', '')}
+        if request.get('delimiter'):
+            params['Delimiter'] = request['delimiter']
+        if request.get('continuation_token'):
+            params['ContinuationToken'] = request['continuation_token']
+        response = s3.list_objects_v2(**params)
+        results = {
+            "objects": [
+                {"key": s3object['Key'], "last_modified": s3object['LastModified'].isoformat(), "size": s3object['Size']}
+                for s3object in response.get('Contents', [])
+            ],
+            "prefixes": [prefix['Prefix'] for prefix in response.get('CommonPrefixes', [])],
+            "next_continuation_token": response.get('NextContinuationToken'),
+        }
         return json.dumps(results)
     except Exception as e:
         logger.error("Something went wrong while listing the contents of S3 bucket - ERROR: {}".format(e))
@@ -113,7 +314,7 @@ def list_bucket():
 
 @app.route('/get_data_columns', cors=True, methods=['POST'], content_types=['application/json'], authorizer=authorizer)
 def get_data_columns():
-    """ Get the column names of a user-specified JSON or CSV file
+    """ Get the column names of a user-specified JSON lines, CSV or Parquet file
 
     Body:
 
@@ -122,52 +323,115 @@ def get_data_columns():
         {
             "s3bucket": string,
             "s3key": string
-            "file_format": ['CSV', 'JSON']
+            "file_format": ['CSV', 'JSON', 'PARQUET']
         }
 
 
     Returns:
-        List of column names and data types found in the first row of
-        the user-specified data file.
+        List of column names found in the header or first row of the
+        user-specified data file, or in the footer of a Parquet file.
 
         .. code-block:: python
 
             {
-                "object": {
-                }
+                "columns": [string, ...]
             }
 
     Raises:
         500: ChaliceViewError - internal server error
     """
     try:
-        import awswrangler as wr
         log_request_parameters()
-        bucket = json.loads(app.current_request.raw_body.decode())['s3bucket']
-        key = json.loads(app.current_request.raw_body.decode())['s3key']
-        file_format = json.loads(app.current_request.raw_body.decode())[
-            'file_format']
-        if file_format != 'CSV' and file_format != 'JSON':
-            raise TypeError('File format must be CSV or JSON')
-
-        # Read first row
+        request = json.loads(app.current_request.raw_body.decode())
+        bucket = request['s3bucket']
+        key = request['s3key']
+        file_format = request['file_format']
+        if file_format not in FILE_FORMATS:
+            raise TypeError('File format must be CSV, JSON or PARQUET')
+
+        # Only the first kilobytes, or the Parquet footer, are read
         logger.info("Reading " + 's3://'+bucket+'/'+key)
-        if file_format == 'JSON':
-            dfs = wr.s3.read_json(
-                path=['s3://'+bucket+'/'+key], chunksize=1, lines=True)
-        elif file_format == 'CSV':
-            dfs = wr.s3.read_csv(path=['s3://'+bucket+'/'+key], chunksize=1)
-        chunk = next(dfs)
-        columns = list(chunk.columns.values)
+        columns = sniff_columns(get_service_client('s3'), bucket, key, file_format)
         result = json.dumps({'columns': columns})
         return result
     except Exception as e:
         logger.error("Something went wrong while getting the column names - ERROR: {}".format(e))
         raise Exception("Something went wrong while getting the column names")
 
+
+@app.route('/estimate_audience_size', cors=True, methods=['POST'], content_types=['application/json'], authorizer=authorizer)
+def estimate_audience_size():
+    """ Estimate the size of the audience of a JSON lines input before starting its transformation
+
+    Body:
+
+    .. code-block:: python
+
+        {
+            "s3bucket": string,
+            "s3key": string,
+            "pii_fields": [{"column_name": string, "pii_type": string}, ...],
+            "platform": ['snap', 'tiktok'],
+            "sample_bytes": integer (optional, at most 8388608, default 1048576),
+            "scan": boolean (optional, read the whole object of at most 64 MB instead of a sample),
+            "upload_rows_per_second": number (optional, e.g. the upload rows_per_second of get_audience_progress)
+        }
+
+
+    Returns:
+        The estimated rows of the input, the non-null rate and distinct values of each PII
+        column, and the output rows, parts and upload seconds they lead to. A sample reads
+        evenly spaced ranges of the object, a scan reads all of it and counts the distinct
+        values with HyperLogLog. The sample of a gzip or bzip2 input is decompressed from the
+        beginning of the object, zstd inputs cannot be estimated.
+
+        .. code-block:: python
+
+            {
+                "method": string,
+                "content_length": integer,
+                "sampled_bytes": integer,
+                "sampled_rows": integer,
+                "estimated_rows": integer,
+                "columns": {
+                    string: {
+                        "pii_type": string,
+                        "non_null_rate": number,
+                        "estimated_non_null_rows": integer,
+                        "estimated_distinct": integer
+                    },
+                    ...
+                },
+                "estimated_output_rows": integer,
+                "estimated_parts": integer,
+                "upload_rows_per_second": number,
+                "estimated_upload_seconds": number
+            }
+
+    Raises:
+        500: ChaliceViewError - internal server error
+    """
+    try:
+        log_request_parameters()
+        request = json.loads(app.current_request.raw_body.decode())
+        sample_bytes = request.get('sample_bytes', SAMPLE_BYTES)
+        if not isinstance(sample_bytes, int):
+            raise TypeError('sample_bytes must be an integer')
+        upload_rows_per_second = request.get('upload_rows_per_second')
+        if upload_rows_per_second is not None and (not isinstance(upload_rows_per_second, (int, float)) or upload_rows_per_second <= 0):
+            raise TypeError('upload_rows_per_second must be a positive number')
+        estimate = estimate_size(get_service_client('s3'), request['s3bucket'], request['s3key'],
+                                 parse_pii_fields(request['pii_fields']), request['platform'],
+                                 sample_bytes, bool(request.get('scan')), upload_rows_per_second)
+        return json.dumps(estimate)
+    except Exception as e:
+        logger.error("Something went wrong while estimating the audience size - ERROR: {}".format(e))
+        raise Exception("Something went wrong while estimating the audience size")
+
+
 @app.route('/read_file', cors=True, methods=['POST'], content_types=['application/json'], authorizer=authorizer)
 def read_file():
-    """ Read the contents of a user-specified S3 object
+    """ Read the metadata of a user-specified S3 object, and optionally preview its beginning
 
     Body:
 
@@ -175,18 +439,26 @@ def read_file():
 
         {
             "s3bucket": string,
-            "s3key": string
+            "s3key": string,
+            "preview_bytes": integer (optional, at most 1048576),
+            "preview_rows": integer (optional)
         }
 
 
     Returns:
-        The body of the use-specified S3 object.
+        The metadata of the user-specified S3 object, read with a HEAD request. When
+        preview_bytes or preview_rows is given, the beginning of the object is read with a
+        single ranged GET: "preview" holds its first preview_bytes bytes, or its first
+        preview_rows complete lines found in them.
 
         .. code-block:: python
 
             {
-                "object": {
-                }
+                "HTTPStatusCode": integer,
+                "HTTPHeaders": {
+                },
+                ...
+                "preview": string
             }
 
     Raises:
@@ -194,15 +466,49 @@ def read_file():
     """
     try:
         log_request_parameters()
-        s3 = boto3.client('s3')
-        bucket = json.loads(app.current_request.raw_body.decode())['s3bucket']
-        key = json.loads(app.current_request.raw_body.decode())['s3key']
-        results = s3.get_object(Bucket=bucket, Key=key)
-        return json.dumps(results['ResponseMetadata'])
+        s3 = get_service_client('s3')
+        request = json.loads(app.current_request.raw_body.decode())
+        bucket = request['s3bucket']
+        key = request['s3key']
+        preview_rows = request.get('preview_rows')
+        preview_bytes = request.get('preview_bytes', READ_FILE_MAX_PREVIEW_BYTES if preview_rows else None)
+        for name, value in (('preview_bytes', preview_bytes), ('preview_rows', preview_rows)):
+            if value is not None and (not isinstance(value, int) or value < 1):
+                raise TypeError(name + ' must be a positive integer')
+        if preview_bytes is not None and preview_bytes > READ_FILE_MAX_PREVIEW_BYTES:
+            raise TypeError('preview_bytes must be at most ' + str(READ_FILE_MAX_PREVIEW_BYTES))
+
+        results = s3.head_object(Bucket=bucket, Key=key)
+        metadata = results['ResponseMetadata']
+        if preview_bytes:
+            metadata['preview'] = read_preview(s3, bucket, key, results['ContentLength'], preview_bytes, preview_rows)
+        return json.dumps(metadata)
     except Exception as e:
         logger.error("Something went wrong while reading the file - ERROR: {}".format(e))
         raise Exception("Something went wrong while reading the file")
 
+
+def read_preview(s3, bucket, key, content_length, preview_bytes, preview_rows=None):
+    """
+    Read the beginning of an S3 object with a ranged GET
+    :param content_length: size of the object
+    :param preview_bytes: number of bytes to read
+    :param preview_rows: number of lines to return, only the complete lines are returned
+    :return: beginning of the object as text
+    """
+    if not content_length:
+        return ""
+    end = min(preview_bytes, content_length) - 1
+    body = s3.get_object(Bucket=bucket, Key=key, Range='bytes=0-' + str(end))['Body'].read()
+    if preview_rows:
+        lines = body.split(b'\n')
+        # the last line is cut by the range unless the object was read to its end
+        if end < content_length - 1:
+            lines = lines[:-1]
+        body = b'\n'.join(lines[:preview_rows])
+    return body.decode('utf-8', errors='replace')
+
+
 def log_request_parameters():
     logger.info("Processing the following request:\n")
     logger.info('userArn: ' + app.current_request.context['identity']['userArn'])
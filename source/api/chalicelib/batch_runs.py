@@ -0,0 +1,268 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Start the transformation Glue job for many audiences in a single request.
+#   Every entry is validated before any run is started. The entries are added
+#   to the batch queue (SQS FIFO), in the format of the request, behind the
+#   entries of the earlier batches, and the queued entries that fit in the
+#   free concurrent runs of the job (its MaxConcurrentRuns minus the runs in
+#   progress) are started right away. The other entries are started by
+#   start_queued whenever a run of the job finishes, see the Glue Job State
+#   Change handler of the API. An entry whose run cannot be started is
+#   dropped, or dead-lettered by the redrive policy of the queue when the
+#   error is transient and keeps recurring.
+###############################################################################
+
+import json
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from chalicelib.job_runs import MAX_RUN_DURATION, JobRunsCache, list_job_runs
+
+logger = logging.getLogger()
+
+MAX_BATCH_ENTRIES = 100
+# StartJobRun requests sent at the same time
+MAX_START_WORKERS = 8
+ACTIVE_STATES = ("STARTING", "RUNNING", "STOPPING", "WAITING")
+ENTRY_FIELDS = ("sourceBucket", "sourceKey", "outputBucket", "piiFields", "segmentName")
+# largest batch of a single SQS SendMessageBatch or ReceiveMessage request
+SQS_BATCH_SIZE = 10
+# the entries of every batch share one message group, so that they start in order
+MESSAGE_GROUP_ID = "transformations"
+# message attributes of the batch of an entry and of its index in the batch
+BATCH_ID_ATTRIBUTE = "batchId"
+ENTRY_INDEX_ATTRIBUTE = "entryIndex"
+# StartJobRun errors after which the entry is received again, the other errors drop it
+RETRYABLE_ERROR_CODES = ("ThrottlingException", "InternalServiceException", "OperationTimeoutException")
+
+
+def parse_pii_fields(pii_fields):
+    """
+    :param pii_fields: list of {"column_name": ..., "pii_type": ...} dicts, or its JSON string
+    :return: list of the PII fields
+    """
+    if isinstance(pii_fields, str):
+        try:
+            pii_fields = json.loads(pii_fields)
+        except ValueError:
+            raise ValueError("piiFields is not valid JSON")
+    if not isinstance(pii_fields, list) or not pii_fields:
+        raise ValueError("piiFields must be a non-empty list")
+    for field in pii_fields:
+        if not isinstance(field, dict) or not field.get("column_name") or not field.get("pii_type"):
+            raise ValueError("every piiFields entry must have a column_name and a pii_type")
+    return pii_fields
+
+
+def parse_batch_entries(entries):
+    """
+    Validate every entry of a batch, so that no run is started when one of them is invalid
+    :param entries: list of {"sourceBucket", "sourceKey", "outputBucket", "piiFields", "segmentName"} dicts
+    :return: list of the Glue job arguments of the entries
+    """
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("ERROR : entries must be a non-empty list")
+    if len(entries) > MAX_BATCH_ENTRIES:
+        raise ValueError("ERROR : a batch has at most {} entries, got {}".format(MAX_BATCH_ENTRIES, len(entries)))
+
+    errors = []
+    job_arguments = []
+    segments = set()
+    for i, entry in enumerate(entries):
+        try:
+            if not isinstance(entry, dict):
+                raise ValueError("entry is not an object")
+            missing = [name for name in ENTRY_FIELDS if not entry.get(name)]
+            if missing:
+                raise ValueError("missing {}".format(", ".join(missing)))
+            for name in ENTRY_FIELDS:
+                if name != "piiFields" and not isinstance(entry[name], str):
+                    raise ValueError("{} must be a string".format(name))
+            # the runs of a batch would overwrite the output parts of each other
+            segment = (entry["outputBucket"], entry["segmentName"])
+            if segment in segments:
+                raise ValueError("segment {} is already in the batch".format(entry["segmentName"]))
+            segments.add(segment)
+            job_arguments.append({
+                "--source_bucket": entry["sourceBucket"],
+                "--output_bucket": entry["outputBucket"],
+                "--source_key": entry["sourceKey"],
+                "--pii_fields": json.dumps(parse_pii_fields(entry["piiFields"])),
+                "--segment_name": entry["segmentName"],
+            })
+        except ValueError as e:
+            errors.append("entry {}: {}".format(i, e))
+    if errors:
+        raise ValueError("ERROR : invalid batch, " + "; ".join(errors))
+    return job_arguments
+
+
+def count_free_runs(glue_client, job_name):
+    """
+    :return: number of runs of the job that can start now without exceeding its MaxConcurrentRuns
+    """
+    job = glue_client.get_job(JobName=job_name)["Job"]
+    max_concurrent_runs = job.get("ExecutionProperty", {}).get("MaxConcurrentRuns", 1)
+    # a fresh cache, runs started by the other containers must be counted too
+    started_after = datetime.now(timezone.utc) - MAX_RUN_DURATION
+    active_runs, _ = list_job_runs(JobRunsCache(job_name), glue_client, max_results=max_concurrent_runs,
+                                   states=ACTIVE_STATES, started_after=started_after)
+    return max(max_concurrent_runs - len(active_runs), 0)
+
+
+def start_job_run(glue_client, job_name, arguments):
+    """
+    :return: JobRunId of the started run, or None when the job has no free concurrent run
+    """
+    try:
+        return glue_client.start_job_run(JobName=job_name, Arguments=arguments)["JobRunId"]
+    except glue_client.exceptions.ConcurrentRunsExceededException:
+        # runs started since the count, the entry stays in the queue
+        return None
+
+
+def enqueue_entries(sqs_client, queue_url, entries, batch_id):
+    """
+    Add the entries of a batch to the batch queue, behind the entries of the earlier batches
+    :param entries: list of the entries of the request, already validated by parse_batch_entries
+    :param batch_id: identifier of the batch, returned with the runs started by start_queued
+    """
+    for i in range(0, len(entries), SQS_BATCH_SIZE):
+        response = sqs_client.send_message_batch(QueueUrl=queue_url, Entries=[
+            {
+                "Id": str(index),
+                "MessageBody": json.dumps(entry),
+                "MessageGroupId": MESSAGE_GROUP_ID,
+                "MessageDeduplicationId": "{}-{}".format(batch_id, index),
+                "MessageAttributes": {
+                    BATCH_ID_ATTRIBUTE: {"DataType": "String", "StringValue": batch_id},
+                    ENTRY_INDEX_ATTRIBUTE: {"DataType": "Number", "StringValue": str(index)},
+                },
+            }
+            for index, entry in enumerate(entries[i:i + SQS_BATCH_SIZE], i)
+        ])
+        if response.get("Failed"):
+            raise ValueError("ERROR : unable to queue {} entries: {}".format(
+                len(response["Failed"]), "; ".join(failed.get("Message", failed["Code"]) for failed in response["Failed"])))
+
+
+def start_message(glue_client, job_name, message):
+    """
+    Start the run of a queued entry
+    :return: {"segmentName", "sourceKey", "batchId", "entryIndex"} of the entry, with the "JobRunId" of the
+        started run or the "error" that dropped the entry, or None when the entry stays in the queue
+    """
+    entry = json.loads(message["Body"])
+    attributes = message.get("MessageAttributes", {})
+    outcome = {
+        "segmentName": entry.get("segmentName"),
+        "sourceKey": entry.get("sourceKey"),
+        "batchId": attributes.get(BATCH_ID_ATTRIBUTE, {}).get("StringValue"),
+        "entryIndex": int(attributes.get(ENTRY_INDEX_ATTRIBUTE, {}).get("StringValue", -1)),
+    }
+    try:
+        run_id = start_job_run(glue_client, job_name, parse_batch_entries([entry])[0])
+    except BotoCoreError as e:
+        logger.warning("The queued transformation of {} will be retried: {}".format(outcome["segmentName"], e))
+        return None
+    except ClientError as e:
+        if e.response["Error"]["Code"] in RETRYABLE_ERROR_CODES:
+            logger.warning("The queued transformation of {} will be retried: {}".format(outcome["segmentName"], e))
+            return None
+        logger.error("Dropping the queued transformation of {}: {}".format(outcome["segmentName"], e))
+        return dict(outcome, error=str(e))
+    except ValueError as e:
+        logger.error("Dropping the queued transformation of {}: {}".format(outcome["segmentName"], e))
+        return dict(outcome, error=str(e))
+    if not run_id:
+        return None
+    return dict(outcome, JobRunId=run_id)
+
+
+def start_queued(glue_client, sqs_client, queue_url, job_name):
+    """
+    Start a run of the job for the queued entries that fit in its free concurrent runs, in the order
+    they were queued. An entry leaves the queue once its run started or could not be started, the
+    entries received but not started are released for the next call.
+    :return: list of the started entries and list of the dropped entries, see start_message
+    """
+    free_runs = count_free_runs(glue_client, job_name)
+    started = []
+    failed = []
+    while free_runs:
+        messages = sqs_client.receive_message(
+            QueueUrl=queue_url, MaxNumberOfMessages=min(free_runs, SQS_BATCH_SIZE),
+            MessageAttributeNames=[BATCH_ID_ATTRIBUTE, ENTRY_INDEX_ATTRIBUTE]).get("Messages", [])
+        if not messages:
+            break
+        received = {message["ReceiptHandle"]: message for message in messages}
+        runs_started = 0
+        errors = []
+        try:
+            with ThreadPoolExecutor(max_workers=min(len(messages), MAX_START_WORKERS)) as executor:
+                futures = [executor.submit(start_message, glue_client, job_name, message) for message in messages]
+            for message, future in zip(messages, futures):
+                # the runs started by the other messages are recorded before an error is raised
+                if future.exception():
+                    errors.append(future.exception())
+                    continue
+                outcome = future.result()
+                if not outcome:
+                    continue
+                sqs_client.delete_message(QueueUrl=queue_url, ReceiptHandle=message["ReceiptHandle"])
+                del received[message["ReceiptHandle"]]
+                if "JobRunId" in outcome:
+                    started.append(outcome)
+                    runs_started += 1
+                else:
+                    failed.append(outcome)
+        finally:
+            # the runs of other callers took the free runs, or the errors are transient: the entries
+            # are received again right away rather than after the visibility timeout
+            for message in received.values():
+                sqs_client.change_message_visibility(
+                    QueueUrl=queue_url, ReceiptHandle=message["ReceiptHandle"], VisibilityTimeout=0)
+        if errors:
+            raise errors[0]
+        if received:
+            break
+        free_runs -= runs_started
+    return started, failed
+
+
+def start_batch(glue_client, sqs_client, queue_url, job_name, entries):
+    """
+    Queue the entries of a batch behind the entries of the earlier batches, and start the queued
+    entries that fit in the free concurrent runs of the job
+    :param entries: list of the entries of the request, see parse_batch_entries
+    :return: list of {"segmentName", "sourceKey", "JobRunId"} of the started runs of the batch, list of
+        the entries of the batch left in the queue, and list of {"segmentName", "sourceKey", "error"} of
+        the entries of the batch that could not be started
+    """
+    parse_batch_entries(entries)
+    batch_id = str(uuid.uuid4())
+    enqueue_entries(sqs_client, queue_url, entries, batch_id)
+    started, failed = start_queued(glue_client, sqs_client, queue_url, job_name)
+    outcomes = {}
+    for outcome in started + failed:
+        if outcome["batchId"] == batch_id:
+            outcomes[outcome["entryIndex"]] = outcome
+        elif "JobRunId" in outcome:
+            # entries of the earlier batches start first
+            logger.info("Started the queued transformation of {} ({})".format(outcome["segmentName"], outcome["JobRunId"]))
+
+    def batch_outcomes(field):
+        return [
+            {"segmentName": outcome["segmentName"], "sourceKey": outcome["sourceKey"], field: outcome[field]}
+            for _, outcome in sorted(outcomes.items()) if field in outcome
+        ]
+
+    queued = [entry for index, entry in enumerate(entries) if index not in outcomes]
+    return batch_outcomes("JobRunId"), queued, batch_outcomes("error")
@@ -0,0 +1,70 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   AWS service clients shared by the routes of the API. Each client is created
+#   on its first use and reused by the following requests served by the same
+#   Lambda container, with the solution user agent of the botoConfig
+#   environment variable. Also configures the X-Ray instrumentation of the
+#   libraries listed in the XRAY_PATCH_MODULES environment variable.
+###############################################################################
+
+import json
+import os
+
+import boto3
+from botocore.config import Config
+
+# comma-separated modules instrumented by X-Ray, "all" for every supported library
+DEFAULT_XRAY_PATCH_MODULES = "boto3"
+
+_service_clients = dict()
+_session = None
+
+
+def get_session():
+    global _session
+    if not _session:
+        _session = boto3.session.Session()
+    return _session
+
+
+def get_botocore_config():
+    return Config(**json.loads(os.environ.get("botoConfig") or "{}"))
+
+
+def get_service_client(service_name):
+    """
+    Get the client of an AWS service, created on the first call
+    :param service_name: boto3 service name, e.g. s3 or glue
+    :return: boto3 client shared by the requests of the Lambda container
+    """
+    if service_name not in _service_clients:
+        _service_clients[service_name] = get_session().client(
+            service_name, config=get_botocore_config(), region_name=os.environ.get("AWS_REGION")
+        )
+    return _service_clients[service_name]
+
+
+def patch_xray(modules=None):
+    """
+    Instrument libraries with X-Ray
+    :param modules: comma-separated module names, "all", or empty to disable the instrumentation.
+        Defaults to the XRAY_PATCH_MODULES environment variable, or boto3
+    :return: list of patched modules, or ["all"]
+    """
+    if modules is None:
+        modules = os.environ.get("XRAY_PATCH_MODULES", DEFAULT_XRAY_PATCH_MODULES)
+    modules = [module.strip() for module in modules.split(",") if module.strip()]
+    if not modules:
+        return []
+
+    # only imported when X-Ray is enabled
+    from aws_xray_sdk.core import patch, patch_all
+
+    if modules == ["all"]:
+        patch_all()
+    else:
+        patch(modules)
+    return modules
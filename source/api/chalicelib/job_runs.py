@@ -0,0 +1,179 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Runs of the transformation Glue job for the job status pages of the web UI.
+#   The newest runs are cached for a few seconds per Lambda container, and a
+#   refresh only reads the pages of the runs started or still running since the
+#   previous one. Older pages are read from Glue when a request pages or
+#   filters past the cached runs.
+###############################################################################
+
+import time
+from datetime import datetime, timedelta, timezone
+
+TERMINAL_STATES = ("STOPPED", "SUCCEEDED", "FAILED", "TIMEOUT", "ERROR")
+GLUE_MAX_RESULTS = 200
+CACHE_SECONDS = 5
+# runs started this long before `since` can still be modified after it (default Glue job timeout)
+MAX_RUN_DURATION = timedelta(minutes=2880)
+
+
+class JobRunsCache:
+    """Newest runs of a Glue job, newest first, refreshed at most every ttl seconds"""
+
+    def __init__(self, job_name, ttl=CACHE_SECONDS):
+        self.job_name = job_name
+        self.ttl = ttl
+        # contiguous newest part of the job history
+        self.runs = []
+        # Glue token of the page following the cached runs, None once the whole history is cached
+        self.older_token = None
+        self.complete = False
+        self.refreshed_at = None
+        # time of the last refresh, the `since` of the next incremental poll
+        self.polled_at = None
+
+    def get_page(self, glue_client, next_token=None):
+        params = {"JobName": self.job_name, "MaxResults": GLUE_MAX_RESULTS}
+        if next_token:
+            params["NextToken"] = next_token
+        return glue_client.get_job_runs(**params)
+
+    def refresh(self, glue_client):
+        """Read the runs started or updated since the last refresh, unless it is more recent than ttl"""
+        now = time.monotonic()
+        if self.refreshed_at is not None and now - self.refreshed_at < self.ttl:
+            return
+        polled_at = datetime.now(timezone.utc)
+        if not self.runs and not self.complete:
+            page = self.get_page(glue_client)
+            self.runs = page["JobRuns"]
+            self.older_token = page.get("NextToken")
+            self.complete = not self.older_token
+        else:
+            self.runs = self.read_newer_runs(glue_client)
+        self.refreshed_at = now
+        self.polled_at = polled_at
+
+    def read_newer_runs(self, glue_client):
+        """
+        Read the pages of the newest runs until a cached run older than every running one: it
+        and the runs before it are finished, so they are unchanged.
+        :return: updated list of cached runs
+        """
+        cached_index = {run["Id"]: i for i, run in enumerate(self.runs)}
+        finished_from = len(self.runs)
+        while finished_from > 0 and self.runs[finished_from - 1]["JobRunState"] in TERMINAL_STATES:
+            finished_from -= 1
+
+        newer_runs = []
+        next_token = None
+        while True:
+            page = self.get_page(glue_client, next_token)
+            for run in page["JobRuns"]:
+                i = cached_index.get(run["Id"])
+                if i is not None and i >= finished_from:
+                    return newer_runs + self.runs[i:]
+                newer_runs.append(run)
+            next_token = page.get("NextToken")
+            if not next_token:
+                # the whole history was read again
+                self.older_token = None
+                self.complete = True
+                return newer_runs
+
+    def read_older_runs(self, glue_client):
+        page = self.get_page(glue_client, self.older_token)
+        # runs started since the previous page can shift older ones into the next page
+        cached_ids = {run["Id"] for run in self.runs}
+        self.runs.extend(run for run in page["JobRuns"] if run["Id"] not in cached_ids)
+        self.older_token = page.get("NextToken")
+        self.complete = not self.older_token
+
+    def iter_runs(self, glue_client, start=0):
+        """Iterate over the runs from the start index, reading older pages from Glue when needed"""
+        i = start
+        while True:
+            while i < len(self.runs):
+                yield self.runs[i]
+                i += 1
+            if self.complete:
+                return
+            self.read_older_runs(glue_client)
+
+
+def parse_timestamp(name, value):
+    """Parse an ISO 8601 timestamp, in UTC unless it has a time zone"""
+    try:
+        timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError("ERROR : {} must be an ISO 8601 timestamp, got {}".format(name, value))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def parse_job_runs_query(query_params):
+    """
+    Parse the query string of a get_etl_jobs request
+    :param query_params: dict of query string parameters, or None
+    :return: keyword arguments of list_job_runs
+    """
+    query_params = query_params or {}
+    max_results = query_params.get("max_results", str(GLUE_MAX_RESULTS))
+    if not max_results.isdigit() or not 1 <= int(max_results) <= GLUE_MAX_RESULTS:
+        raise ValueError("ERROR : max_results must be an integer from 1 to {}".format(GLUE_MAX_RESULTS))
+    query = {
+        "max_results": int(max_results),
+        "next_token": query_params.get("next_token"),
+        "segment_name": query_params.get("segment_name"),
+        "states": query_params["state"].split(",") if query_params.get("state") else None,
+    }
+    for name in ("started_after", "started_before", "since"):
+        query[name] = parse_timestamp(name, query_params[name]) if query_params.get(name) else None
+    return query
+
+
+def list_job_runs(cache, glue_client, max_results=GLUE_MAX_RESULTS, next_token=None, segment_name=None,
+                  states=None, started_after=None, started_before=None, since=None):
+    """
+    List the runs of the job matching every filter, newest first
+    :param cache: JobRunsCache of the job
+    :param next_token: id of the last run of the previous page
+    :param segment_name: --segment_name argument of the runs
+    :param states: list of JobRunState of the runs
+    :param started_after: earliest start time of the runs
+    :param started_before: start time the runs started before
+    :param since: time the runs were started or updated after, for incremental polling
+    :return: list of runs, and the next_token of the next page or None
+    """
+    cache.refresh(glue_client)
+    start = 0
+    if next_token:
+        start = next(
+            (i + 1 for i, run in enumerate(cache.iter_runs(glue_client)) if run["Id"] == next_token), None)
+        if start is None:
+            raise ValueError("ERROR : next_token {} is not a run of the job".format(next_token))
+
+    # runs are sorted by start time, so the scan stops at the first run too old to match
+    lower_bounds = [bound for bound in (started_after, since and since - MAX_RUN_DURATION) if bound]
+    oldest_start = max(lower_bounds) if lower_bounds else None
+
+    runs = []
+    for run in cache.iter_runs(glue_client, start):
+        if oldest_start and run["StartedOn"] < oldest_start:
+            break
+        if segment_name and run.get("Arguments", {}).get("--segment_name") != segment_name:
+            continue
+        if states and run["JobRunState"] not in states:
+            continue
+        if started_before and run["StartedOn"] >= started_before:
+            continue
+        if since and run.get("LastModifiedOn", run["StartedOn"]) <= since:
+            continue
+        runs.append(run)
+        if len(runs) == max_results:
+            return runs, run["Id"]
+    return runs, None
@@ -0,0 +1,46 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Names of the objects and tags the pipeline writes to the output bucket, as
+#   read by the API. They are defined by the Glue job (etl_helpers.manifest,
+#   etl_helpers.compression) and the uploaders (upload_engine.manifest,
+#   upload_engine.outcome), which are deployed apart from the API; the tests
+#   check that the values below match theirs.
+###############################################################################
+
+import os
+import re
+
+MANIFEST_SUFFIX = "_manifest.json"
+# extensions of the compressed inputs of the Glue job
+COMPRESSION_EXTENSIONS = (".gz", ".gzip", ".bz2", ".zst", ".zstd")
+# tags written by the uploaders once the partner API accepted a part
+USERS_UPLOADED_TAG = "uploaded-users"
+UPLOADED_AT_TAG = "uploaded-at"
+# part number and extension following the output key in the name of a part (etl_helpers.destinations)
+PART_SUFFIX_PATTERN = r"\d*\.csv(?:\.gz)?"
+# folder of the PII type of the TikTok parts, e.g. email_sha256/
+PII_TYPE_FOLDER_PATTERN = r"(?:[a-z0-9]+_sha256/)?"
+
+
+def get_output_key(source_key):
+    """Key of the outputs of the Glue job for a source key, without its compression and format extensions"""
+    for extension in COMPRESSION_EXTENSIONS:
+        if source_key.lower().endswith(extension):
+            source_key = source_key[:-len(extension)]
+            break
+    return os.path.splitext(source_key)[0]
+
+
+def is_part_key(key, prefix, output_key):
+    """
+    Whether an object is an output part of a source key: the output prefix of the segment, the
+    folder of a PII type, then the output key followed by the part number only, so that the parts
+    of data10.json are not taken for parts of data1.json
+    :param prefix: output prefix of the segment, e.g. output/snap/segment/
+    :param output_key: output key of the source key, see get_output_key
+    """
+    pattern = re.escape(prefix) + PII_TYPE_FOLDER_PATTERN + re.escape(output_key) + PART_SUFFIX_PATTERN
+    return re.fullmatch(pattern, key) is not None
@@ -0,0 +1,151 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Progress of the latest transformation and upload of an audience, from the
+#   objects the pipeline writes to the output bucket: the output parts listed
+#   while the Glue job runs, its run statistics and manifest once it is done,
+#   and the upload outcome the uploaders tag each part with once the partner
+#   API accepted it (aws_lambda/upload_engine/outcome.py).
+###############################################################################
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from chalicelib.job_runs import TERMINAL_STATES, list_job_runs
+from chalicelib.outputs import MANIFEST_SUFFIX, UPLOADED_AT_TAG, USERS_UPLOADED_TAG, get_output_key, is_part_key
+
+PLATFORMS = ("snap", "tiktok")
+# GetObjectTagging requests sent at the same time
+MAX_TAG_WORKERS = 8
+
+
+def list_objects(s3_client, bucket, prefix):
+    """List every object under a prefix"""
+    objects = []
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend(page.get("Contents", []))
+    return objects
+
+
+def read_json(s3_client, bucket, key):
+    """Read a JSON document, None if it does not exist"""
+    try:
+        return json.loads(s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+    except s3_client.exceptions.NoSuchKey:
+        return None
+
+
+def read_part_outcome(s3_client, bucket, key):
+    """
+    :return: {"users_uploaded": int, "uploaded_at": datetime} of an uploaded part, None if it is not uploaded yet
+    """
+    tag_set = s3_client.get_object_tagging(Bucket=bucket, Key=key)["TagSet"]
+    tags = {tag["Key"]: tag["Value"] for tag in tag_set}
+    if USERS_UPLOADED_TAG not in tags:
+        return None
+    return {
+        "users_uploaded": int(tags[USERS_UPLOADED_TAG]),
+        "uploaded_at": datetime.fromisoformat(tags[UPLOADED_AT_TAG]),
+    }
+
+
+def rate(rows, seconds):
+    return round(rows / seconds, 1) if rows and seconds else None
+
+
+def read_audience_progress(s3_client, glue_client, job_runs_cache, bucket, platform, segment_name, now=None):
+    """
+    Get the progress of the latest transformation run of an audience and of its upload
+    :param job_runs_cache: JobRunsCache of the transformation job
+    :param bucket: output bucket of the transformation job
+    :param platform: snap or tiktok
+    :param now: current time, for tests
+    :return: dict with the phase of the audience, and the progress of its transformation and upload
+    """
+    if platform not in PLATFORMS:
+        raise ValueError("ERROR : platform {} is not one of {}".format(platform, list(PLATFORMS)))
+    now = now or datetime.now(timezone.utc)
+    runs, _ = list_job_runs(job_runs_cache, glue_client, max_results=1, segment_name=segment_name)
+    if not runs:
+        raise ValueError("ERROR : segment {} has no transformation run".format(segment_name))
+    run = runs[0]
+    started_on = run["StartedOn"]
+    output_key = get_output_key(run.get("Arguments", {}).get("--source_key", ""))
+    prefix = "output/" + platform + "/" + segment_name + "/"
+
+    # parts written by this run, listed until the manifest lists them all
+    manifest_key = prefix + output_key + MANIFEST_SUFFIX
+    objects = [
+        s3_object for s3_object in list_objects(s3_client, bucket, prefix)
+        if s3_object["LastModified"] >= started_on
+        and (s3_object["Key"] == manifest_key or is_part_key(s3_object["Key"], prefix, output_key))
+    ]
+    manifest_object = next((s3_object for s3_object in objects if s3_object["Key"] == manifest_key), None)
+    manifest = read_json(s3_client, bucket, manifest_key) if manifest_object else None
+    if manifest:
+        parts = manifest["parts"]
+    else:
+        parts = [{"key": s3_object["Key"], "rows": None} for s3_object in objects if s3_object["Key"] != manifest_key]
+
+    finished = run["JobRunState"] in TERMINAL_STATES
+    transformation_seconds = ((run.get("CompletedOn") if finished else None) or now) - started_on
+    stats = read_json(s3_client, bucket, "stats/" + platform + "/" + segment_name + "/" + output_key + ".json") if manifest else None
+    rows_produced = manifest["total_rows"] if manifest else None
+    transformation = {
+        "rows_read": stats["rows_read"] if stats else None,
+        "parts_produced": len(parts),
+        "rows_produced": rows_produced,
+        "seconds": round(transformation_seconds.total_seconds(), 1),
+        "rows_per_second": rate(rows_produced, transformation_seconds.total_seconds()),
+        # time and throughput of each stage of the job, to find its bottleneck
+        "stages": stats["stages"] if stats else None,
+    }
+
+    upload = None
+    if manifest:
+        with ThreadPoolExecutor(max_workers=MAX_TAG_WORKERS) as executor:
+            outcomes = list(executor.map(lambda part: read_part_outcome(s3_client, bucket, part["key"]), parts))
+        uploaded = [(part, outcome) for part, outcome in zip(parts, outcomes) if outcome]
+        rows_uploaded = sum(part["rows"] for part, _ in uploaded)
+        # the manifest starts the upload
+        upload_end = max(outcome["uploaded_at"] for _, outcome in uploaded) if len(uploaded) == len(parts) and uploaded else now
+        upload_seconds = (upload_end - manifest_object["LastModified"]).total_seconds()
+        rows_per_second = rate(rows_uploaded, upload_seconds)
+        rows_left = rows_produced - rows_uploaded
+        upload = {
+            "parts_total": len(parts),
+            "parts_uploaded": len(uploaded),
+            "rows_uploaded": rows_uploaded,
+            "users_uploaded": sum(outcome["users_uploaded"] for _, outcome in uploaded),
+            "seconds": round(upload_seconds, 1),
+            "rows_per_second": rows_per_second,
+            "eta_seconds": round(rows_left / rows_per_second, 1) if rows_left and rows_per_second else None,
+        }
+
+    if not finished:
+        phase = "TRANSFORMING"
+    elif run["JobRunState"] != "SUCCEEDED":
+        phase = "TRANSFORMATION_FAILED"
+    elif not upload:
+        phase = "TRANSFORMED"
+    elif upload["parts_uploaded"] < upload["parts_total"]:
+        phase = "UPLOADING"
+    else:
+        phase = "UPLOADED"
+
+    return {
+        "platform": platform,
+        "segment_name": segment_name,
+        "phase": phase,
+        "job_run": {
+            "Id": run["Id"],
+            "JobRunState": run["JobRunState"],
+            "StartedOn": started_on.isoformat(),
+            "CompletedOn": run["CompletedOn"].isoformat() if run.get("CompletedOn") else None,
+        },
+        "transformation": transformation,
+        "upload": upload,
+    }
@@ -0,0 +1,114 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Column discovery for the input files of the transformation jobs, without
+#   loading a dataframe: the header line of CSV files and the first record of
+#   JSON lines files are read from the first kilobytes of the object, and the
+#   schema of Parquet files from its footer, with ranged GETs. The columns are
+#   cached per object version (bucket, key and ETag) for the lifetime of the
+#   Lambda container.
+###############################################################################
+
+import csv
+import io
+import json
+from collections import OrderedDict
+
+FILE_FORMATS = ("CSV", "JSON", "PARQUET")
+# first read of a sniff, the header or first record of most files fit in it
+SNIFF_BYTES = 64 * 1024
+# a first line longer than this is not a header or a record
+MAX_SNIFF_BYTES = 1024 * 1024
+PARQUET_MAGIC = b"PAR1"
+# length of the footer metadata and closing magic at the end of a Parquet file
+PARQUET_TRAILER_BYTES = 8
+CACHE_SIZE = 256
+
+# (bucket, key, ETag, file format) to columns, least recently used first
+_columns_cache = OrderedDict()
+
+
+def read_range(s3_client, bucket, key, start, end):
+    """Read the bytes from start to end, both included, of an object"""
+    return s3_client.get_object(Bucket=bucket, Key=key, Range="bytes={}-{}".format(start, end))["Body"].read()
+
+
+def read_first_line(s3_client, bucket, key, content_length):
+    """
+    Read the first line of an object, reading a larger range until it is complete
+    :return: first line, without its line break
+    """
+    size = SNIFF_BYTES
+    while True:
+        end = min(size, content_length) - 1
+        body = read_range(s3_client, bucket, key, 0, end)
+        newline = body.find(b"\n")
+        if newline >= 0:
+            return body[:newline].rstrip(b"\r")
+        if end >= content_length - 1:
+            return body.rstrip(b"\r")
+        if size >= MAX_SNIFF_BYTES:
+            raise ValueError("ERROR : the first line of s3://{}/{} is longer than {} bytes".format(bucket, key, MAX_SNIFF_BYTES))
+        size *= 4
+
+
+def sniff_csv_columns(first_line):
+    return next(csv.reader([first_line.decode("utf-8-sig")]))
+
+
+def sniff_json_columns(first_line):
+    record = json.loads(first_line.decode("utf-8-sig"))
+    if not isinstance(record, dict):
+        raise ValueError("ERROR : the first line of a JSON lines file must be an object")
+    return list(record)
+
+
+def sniff_parquet_columns(s3_client, bucket, key, content_length):
+    """Read the columns from the footer of a Parquet file, in a single request for most files"""
+    start = max(content_length - SNIFF_BYTES, 0)
+    tail = read_range(s3_client, bucket, key, start, content_length - 1)
+    if len(tail) < PARQUET_TRAILER_BYTES or tail[-4:] != PARQUET_MAGIC:
+        raise ValueError("ERROR : s3://{}/{} is not a Parquet file".format(bucket, key))
+    footer_length = int.from_bytes(tail[-8:-4], "little")
+    if footer_length + PARQUET_TRAILER_BYTES > len(tail):
+        footer_start = content_length - PARQUET_TRAILER_BYTES - footer_length
+        tail = read_range(s3_client, bucket, key, footer_start, content_length - 1)
+    footer = tail[-PARQUET_TRAILER_BYTES - footer_length:]
+
+    # available from the AWS Data Wrangler layer, only needed for Parquet files
+    import pyarrow.parquet as pq
+
+    # the footer between two magic numbers is a valid file for metadata reads
+    return pq.ParquetFile(io.BytesIO(PARQUET_MAGIC + footer)).schema_arrow.names
+
+
+def sniff_columns(s3_client, bucket, key, file_format):
+    """
+    Get the column names of an input file
+    :param s3_client: boto3 S3 client
+    :param file_format: CSV, JSON (lines) or PARQUET
+    :return: list of column names, in the order of the file
+    """
+    if file_format not in FILE_FORMATS:
+        raise ValueError("ERROR : file format {} is not one of {}".format(file_format, list(FILE_FORMATS)))
+    head = s3_client.head_object(Bucket=bucket, Key=key)
+    cache_key = (bucket, key, head["ETag"], file_format)
+    if cache_key in _columns_cache:
+        _columns_cache.move_to_end(cache_key)
+        return list(_columns_cache[cache_key])
+
+    content_length = head["ContentLength"]
+    if not content_length:
+        raise ValueError("ERROR : s3://{}/{} is empty".format(bucket, key))
+    if file_format == "PARQUET":
+        columns = sniff_parquet_columns(s3_client, bucket, key, content_length)
+    else:
+        first_line = read_first_line(s3_client, bucket, key, content_length)
+        columns = sniff_csv_columns(first_line) if file_format == "CSV" else sniff_json_columns(first_line)
+
+    _columns_cache[cache_key] = columns
+    if len(_columns_cache) > CACHE_SIZE:
+        _columns_cache.popitem(last=False)
+    return list(columns)
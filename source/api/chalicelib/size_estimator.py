@@ -0,0 +1,320 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Size estimate of an audience before its transformation job is started,
+#   from the JSON lines input of the job: rows, non-null rate and distinct
+#   values of each PII column, and the output parts and upload time they
+#   lead to. By default a sample of the object is read with ranged GETs at
+#   evenly spaced offsets, and the distinct values of the whole object are
+#   extrapolated from the value frequencies of the sample. A scan reads the
+#   whole object instead and counts the distinct values with HyperLogLog
+#   sketches of fixed size. Gzip and bzip2 inputs cannot be read from an
+#   arbitrary offset, their sample is decompressed from the beginning of the
+#   object. They are decompressed one chunk at a time, a scan holds a single
+#   chunk of the decompressed object and stops at MAX_SCAN_BYTES of it.
+#   Zstandard inputs cannot be estimated, the API has no zstd codec.
+###############################################################################
+
+import bz2
+import hashlib
+import json
+import math
+import zlib
+from collections import Counter
+
+from chalicelib.outputs import COMPRESSION_EXTENSIONS
+
+# bytes read by a sample, split between SAMPLE_SEGMENTS ranged GETs
+SAMPLE_BYTES = 1024 * 1024
+MAX_SAMPLE_BYTES = 8 * 1024 * 1024
+SAMPLE_SEGMENTS = 8
+# largest object a scan reads within the API Gateway timeout, decompressed size for compressed inputs
+MAX_SCAN_BYTES = 64 * 1024 * 1024
+# 2^14 registers, a standard error of 1.04 / sqrt(2^14) = 0.8%
+HLL_PRECISION = 14
+# output part limits of the Glue job destinations (etl_helpers.destinations and etl_helpers.output)
+SNAP_PART_ROWS = 100000
+TIKTOK_PART_BYTES = 50 * 1024**2
+HASH_LINE_BYTES = 65
+# rough upload throughput of the uploaders, used unless the caller passes a measured one
+# (e.g. the upload rows_per_second returned by get_audience_progress)
+DEFAULT_UPLOAD_ROWS_PER_SECOND = {"snap": 10000, "tiktok": 50000}
+# decompressors of the compressed inputs of the Glue job by extension, one per member
+DECOMPRESSORS = {
+    ".gz": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    ".gzip": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    ".bz2": bz2.BZ2Decompressor,
+}
+UNSUPPORTED_COMPRESSION_EXTENSIONS = tuple(extension for extension in COMPRESSION_EXTENSIONS if extension not in DECOMPRESSORS)
+# compressed bytes read at a time
+COMPRESSED_CHUNK_BYTES = 64 * 1024
+
+
+class HyperLogLog:
+    """Approximate count of the distinct values added, in 2^precision bytes"""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        index = x >> (64 - self.precision)
+        remaining = x & ((1 << (64 - self.precision)) - 1)
+        # position of the leftmost 1 bit of the remaining bits
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+def is_present(value):
+    """Whether the Glue job keeps a value, it drops the null and empty ones"""
+    return value is not None and str(value).strip() != ""
+
+
+def estimate_distinct(sample_rows, total_rows, counts):
+    """
+    Extrapolate the distinct values of a column from the frequencies of its values in a
+    uniform sample (Haas and Stokes Duj1 estimator)
+    :param sample_rows: number of values in the sample
+    :param total_rows: estimated number of values in the whole object
+    :param counts: Counter of the values of the sample
+    """
+    distinct = len(counts)
+    if not sample_rows or sample_rows >= total_rows:
+        return distinct
+    singletons = sum(1 for count in counts.values() if count == 1)
+    return round(sample_rows * distinct / (sample_rows - singletons + singletons * sample_rows / total_rows))
+
+
+def read_sample_lines(s3_client, bucket, key, content_length, sample_bytes):
+    """
+    Read the complete lines of SAMPLE_SEGMENTS ranges evenly spaced over the object
+    :return: list of lines, and number of bytes of these lines
+    """
+    if content_length <= sample_bytes:
+        ranges = [(0, content_length - 1)]
+    else:
+        segment_bytes = sample_bytes // SAMPLE_SEGMENTS
+        ranges = [(start, start + segment_bytes - 1)
+                  for start in (i * content_length // SAMPLE_SEGMENTS for i in range(SAMPLE_SEGMENTS))]
+    lines = []
+    sampled_bytes = 0
+    for start, end in ranges:
+        body = s3_client.get_object(Bucket=bucket, Key=key, Range="bytes={}-{}".format(start, end))["Body"].read()
+        if start > 0:
+            # the range starts within a line
+            body = body[body.find(b"\n") + 1:] if b"\n" in body else b""
+        if end < content_length - 1:
+            # and ends within a line
+            body = body[:body.rfind(b"\n") + 1]
+        sampled_bytes += len(body)
+        lines.extend(line for line in body.split(b"\n") if line.strip())
+    return lines, sampled_bytes
+
+
+def get_decompressor(key):
+    """
+    Decompressor factory of a compressed input, from the extension of its key
+    :return: function returning a decompressor of one member, None when the input is not compressed
+    """
+    extension = "." + key.rsplit(".", 1)[-1].lower() if "." in key else ""
+    if extension in UNSUPPORTED_COMPRESSION_EXTENSIONS:
+        raise ValueError("ERROR : cannot estimate the size of the zstd compressed input {}".format(key))
+    return DECOMPRESSORS.get(extension)
+
+
+class CompressedLines:
+    """
+    Complete lines at the beginning of a compressed object, decompressed one chunk at a time.
+    The members written by parallel compressors are decompressed one after the other.
+    """
+
+    def __init__(self, s3_client, bucket, key, new_decompressor, max_bytes):
+        """
+        :param new_decompressor: function returning a decompressor of one member
+        :param max_bytes: decompressed bytes of the lines read at most
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.new_decompressor = new_decompressor
+        self.max_bytes = max_bytes
+        # compressed bytes the lines read were decompressed from, in proportion to the decompressed
+        # bytes read when the lines end within a chunk
+        self.compressed_bytes = 0
+        # whether the object has more than max_bytes decompressed bytes
+        self.truncated = False
+
+    def __iter__(self):
+        body = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)["Body"]
+        decompressor = self.new_decompressor()
+        pending = b""
+        read_bytes = 0
+        compressed_bytes = 0
+        decompressed_bytes = 0
+        try:
+            for chunk in body.iter_chunks(COMPRESSED_CHUNK_BYTES):
+                compressed_bytes += len(chunk)
+                data = [pending]
+                while chunk:
+                    data.append(decompressor.decompress(chunk))
+                    chunk = decompressor.unused_data if decompressor.eof else b""
+                    if decompressor.eof:
+                        decompressor = self.new_decompressor()
+                decompressed_bytes += sum(len(part) for part in data[1:])
+                lines = b"".join(data).split(b"\n")
+                # the last line may be cut by the end of the chunk
+                pending = lines.pop()
+                for line in lines:
+                    if read_bytes + len(line) + 1 > self.max_bytes:
+                        self.truncated = True
+                        break
+                    read_bytes += len(line) + 1
+                    self.compressed_bytes = round(compressed_bytes * read_bytes / decompressed_bytes)
+                    if line.strip():
+                        yield line
+                if self.truncated or read_bytes + len(pending) > self.max_bytes:
+                    self.truncated = True
+                    return
+        except (OSError, zlib.error) as e:
+            raise ValueError("ERROR : s3://{}/{} cannot be decompressed: {}".format(self.bucket, self.key, e))
+        finally:
+            body.close()
+        self.compressed_bytes = compressed_bytes
+        if pending.strip():
+            yield pending
+
+
+def iter_records(lines):
+    for line in lines:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError("ERROR : the lines of a JSON lines file must be objects")
+        yield record
+
+
+def count_parts(platform, rows_per_type):
+    """
+    Number of output parts the Glue job writes
+    :param rows_per_type: dict of PII type to number of hashed values
+    """
+    if platform == "snap":
+        return math.ceil(sum(rows_per_type.values()) / SNAP_PART_ROWS)
+    return sum(math.ceil(rows * HASH_LINE_BYTES / TIKTOK_PART_BYTES) for rows in rows_per_type.values() if rows)
+
+
+def estimate_size(s3_client, bucket, key, pii_fields, platform, sample_bytes=SAMPLE_BYTES, scan=False,
+                  upload_rows_per_second=None):
+    """
+    Estimate the size of the audience of a JSON lines input, optionally gzip or bzip2 compressed
+    :param s3_client: boto3 S3 client
+    :param pii_fields: list of {"column_name": ..., "pii_type": ...} dicts, as passed to the Glue job
+    :param platform: snap or tiktok
+    :param sample_bytes: bytes read by a sample, the whole object is read when it is smaller. The sample of
+        a compressed input is the first sample_bytes of the decompressed object
+    :param scan: read the whole object, at most MAX_SCAN_BYTES, instead of a sample
+    :param upload_rows_per_second: upload throughput, DEFAULT_UPLOAD_ROWS_PER_SECOND of the platform by default
+    :return: dict of the estimates
+    """
+    if platform not in DEFAULT_UPLOAD_ROWS_PER_SECOND:
+        raise ValueError("ERROR : platform {} is not one of {}".format(platform, list(DEFAULT_UPLOAD_ROWS_PER_SECOND)))
+    if not 1 <= sample_bytes <= MAX_SAMPLE_BYTES:
+        raise ValueError("ERROR : sample_bytes must be from 1 to {}".format(MAX_SAMPLE_BYTES))
+    new_decompressor = get_decompressor(key)
+    content_length = s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    if not content_length:
+        raise ValueError("ERROR : s3://{}/{} is empty".format(bucket, key))
+    columns = [field["column_name"] for field in pii_fields]
+    present = Counter()
+
+    if scan:
+        if content_length > MAX_SCAN_BYTES:
+            raise ValueError("ERROR : s3://{}/{} is larger than the {} bytes a scan reads, sample it instead".format(
+                bucket, key, MAX_SCAN_BYTES))
+        sketches = {column: HyperLogLog() for column in columns}
+        if new_decompressor:
+            lines = CompressedLines(s3_client, bucket, key, new_decompressor, MAX_SCAN_BYTES)
+        else:
+            body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+            lines = (line for line in body.iter_lines() if line.strip())
+        rows = 0
+        for record in iter_records(lines):
+            rows += 1
+            for column in columns:
+                value = record.get(column)
+                if is_present(value):
+                    present[column] += 1
+                    sketches[column].add(str(value))
+        if new_decompressor and lines.truncated:
+            raise ValueError("ERROR : s3://{}/{} decompresses to more than the {} bytes a scan reads, sample it instead".format(
+                bucket, key, MAX_SCAN_BYTES))
+        total_rows = rows
+        sampled_bytes = content_length
+        distinct = {column: sketches[column].count() for column in columns}
+        # exact counts, the sample is the whole object
+        scale = 1
+    else:
+        if new_decompressor:
+            # sampled_bytes counts the compressed bytes, the scale assumes an even compression ratio
+            compressed_lines = CompressedLines(s3_client, bucket, key, new_decompressor, sample_bytes)
+            lines = list(compressed_lines)
+            sampled_bytes = compressed_lines.compressed_bytes
+        else:
+            lines, sampled_bytes = read_sample_lines(s3_client, bucket, key, content_length, sample_bytes)
+        if not lines:
+            raise ValueError("ERROR : no complete line in a sample of {} bytes, increase sample_bytes".format(sample_bytes))
+        counts = {column: Counter() for column in columns}
+        rows = 0
+        for record in iter_records(lines):
+            rows += 1
+            for column in columns:
+                value = record.get(column)
+                if is_present(value):
+                    present[column] += 1
+                    counts[column][str(value)] += 1
+        scale = content_length / sampled_bytes
+        total_rows = round(rows * scale)
+        distinct = {
+            column: estimate_distinct(present[column], round(present[column] * scale), counts[column])
+            for column in columns
+        }
+
+    estimated_columns = {}
+    rows_per_type = Counter()
+    for field in pii_fields:
+        column = field["column_name"]
+        non_null_rows = round(present[column] * scale)
+        rows_per_type[field["pii_type"]] += non_null_rows
+        estimated_columns[column] = {
+            "pii_type": field["pii_type"],
+            "non_null_rate": round(present[column] / rows, 4) if rows else 0.0,
+            "estimated_non_null_rows": non_null_rows,
+            "estimated_distinct": distinct[column],
+        }
+    output_rows = sum(rows_per_type.values())
+    upload_rows_per_second = upload_rows_per_second or DEFAULT_UPLOAD_ROWS_PER_SECOND[platform]
+    return {
+        "method": "scan" if scan else "sample",
+        "content_length": content_length,
+        "sampled_bytes": sampled_bytes,
+        "sampled_rows": rows,
+        "estimated_rows": total_rows,
+        "columns": estimated_columns,
+        "estimated_output_rows": output_rows,
+        "estimated_parts": count_parts(platform, rows_per_type),
+        "upload_rows_per_second": upload_rows_per_second,
+        "estimated_upload_seconds": round(output_rows / upload_rows_per_second, 1),
+    }
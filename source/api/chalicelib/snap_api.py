@@ -2,8 +2,8 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from chalice import Blueprint, IAMAuthorizer
-import boto3
 import os
+from chalicelib.clients import get_service_client
 import logging
 
 logger = logging.getLogger()
@@ -31,8 +31,7 @@ def start_snap_transformation():
         pii_fields = snap_routes.current_request.json_body['piiFields']
         segment_name = snap_routes.current_request.json_body['segmentName']
 
-        session = boto3.session.Session(region_name=os.environ['AWS_REGION'])
-        client = session.client('glue')
+        client = get_service_client('glue')
 
         args = {
             "--source_bucket": source_bucket,
@@ -11,19 +11,56 @@ from requests.structures import CaseInsensitiveDict
 import pandas as pd
 import urllib.parse
 import gzip
+import io
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta
 from aws_solutions.core.helpers import get_service_client
+from upload_engine.destination import AudienceDestination, iter_batches
+from upload_engine.engine import UploadEngine
+from upload_engine.manifest import MANIFEST_SUFFIX, plan_part_ranges, read_manifest, read_manifest_part, read_part, start_upload_workflow
+from upload_engine.outcome import record_part_outcome
+from upload_engine.profiling import get_memory_profiler
+from upload_engine.retry import RetryableUploadError, get_retry_delay, parse_retry_after, run_workflow_range, schedule_retry
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 s3_client = get_service_client("s3")
 secrets_client = get_service_client("secretsmanager")
+stepfunctions_client = get_service_client("stepfunctions")
+sqs_client = get_service_client("sqs")
 
 
 snap_uploader_credentials_oauth_refresh = os.environ["REFRESH_SECRET_NAME"]
 snap_uploader_credentials = os.environ["CRED_SECRET_NAME"]
 APPLICATION_JSON_HEADER = "application/json"
+# Snap Marketing API, overridden to run against a local stand-in
+SNAP_API_URL = os.environ.get("SNAP_API_URL", "https://adsapi.snapchat.com")
+MAX_UPLOAD_WORKERS = int(os.environ.get("MAX_UPLOAD_WORKERS", "4"))
+# rss or tracemalloc to log the memory high-water mark of each upload stage, to size the lambda memory
+MEMORY_PROFILE = os.environ.get("MEMORY_PROFILE")
+# refresh the oAuth token this long before it expires, so an upload never starts with a token about to expire
+TOKEN_REFRESH_AHEAD_SECONDS = 300
+# token lifetime assumed when the token endpoint does not return expires_in
+DEFAULT_TOKEN_LIFETIME_SECONDS = 1800
+# how long a container waits for the token being refreshed by another container
+TOKEN_REFRESH_WAIT_SECONDS = 10
+TOKEN_REFRESH_LOCK_STAGE = "REFRESH_LOCK"
+EXPIRES_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+# identifies this container in the token refresh lock
+TOKEN_REFRESH_LOCK_OWNER = str(uuid.uuid4())
+# snap supported schemas
+SCHEMA_OPTIONS = ["EMAIL_SHA256", "MOBILE_AD_ID_SHA256", "PHONE_SHA256"]
+# Snap accepts at most 100,000 identifiers per add users request
+USERS_PER_REQUEST = 100000
+# where the last acknowledged batch of each (part, schema) and the users uploaded up to it are recorded:
+# s3 object tags, or memory for local runs
+CHECKPOINT_STORE = os.environ.get("CHECKPOINT_STORE", "s3")
+CHECKPOINT_TAG_PREFIX = "uploaded-batch-"
+# set when the manifest uploads are orchestrated by the upload workflow
+UPLOAD_STATE_MACHINE_ARN = os.environ.get("UPLOAD_STATE_MACHINE_ARN")
 
 
 def get_snap_credentials(secret_name):
@@ -62,16 +99,25 @@ def refresh_token(snap_credentials, snap_refresh_credentials):
     )
 
     response = json.loads(response)
-    expires_at = datetime.now() + timedelta(seconds=1800)
-    expires_at = expires_at.strftime("%Y-%m-%d %H:%M:%S")
-    response["expires_at"] = expires_at
+    lifetime = int(response.get("expires_in", DEFAULT_TOKEN_LIFETIME_SECONDS))
+    expires_at = datetime.now() + timedelta(seconds=lifetime)
+    response["expires_at"] = expires_at.strftime(EXPIRES_AT_FORMAT)
 
     return response
 
 
+def check_retryable_status(res, action):
+    """Raise RetryableUploadError when the Snap API throttled a request or failed transiently"""
+    if res.status_code == 429 or res.status_code >= 500:
+        raise RetryableUploadError(
+            "Snap API returned {} {}".format(res.status_code, action),
+            parse_retry_after(res.headers.get("Retry-After")),
+        )
+
+
 def add_users(access_token, segment_id, schema, data):
     """Get all available accounts for credentials in the form of a list"""
-    url_segments = f"https://adsapi.snapchat.com/v1/segments/{segment_id}/users"
+    url_segments = f"{SNAP_API_URL}/v1/segments/{segment_id}/users"
 
     headers = CaseInsensitiveDict()
     headers["Accept"] = APPLICATION_JSON_HEADER
@@ -81,6 +127,7 @@ def add_users(access_token, segment_id, schema, data):
     payload = {"users": [{"schema": [schema], "data": data}]}
     payload = json.dumps(payload)
     res = requests.post(url=url_segments, headers=headers, data=payload)
+    check_retryable_status(res, "adding users to segment {}".format(segment_id))
     return res.json()
 
 
@@ -88,13 +135,14 @@ def get_segment_id_by_name(snap_credentials, snap_refresh_credentials, segment_n
     """Get the segment id by name"""
 
     ad_account_id = snap_credentials["ad_account_id"]
-    url_segments = f"https://adsapi.snapchat.com/v1/adaccounts/{ad_account_id}/segments"
+    url_segments = f"{SNAP_API_URL}/v1/adaccounts/{ad_account_id}/segments"
     headers = CaseInsensitiveDict()
     headers["Accept"] = APPLICATION_JSON_HEADER
     headers["Authorization"] = "Bearer " + snap_refresh_credentials["access_token"]
     headers["Content-Type"] = APPLICATION_JSON_HEADER
 
     res = requests.get(url=url_segments, headers=headers)
+    check_retryable_status(res, "listing the segments of ad account {}".format(ad_account_id))
     data = json.dumps(res.json())
     data = json.loads(data)
     data = data["segments"]
@@ -116,53 +164,455 @@ def user_hash(lst):
     return res
 
 
-def is_token_expired(expires_at):
-    """check if the oAuth Token is expired"""
+def parse_expires_at(expires_at):
+    """Expiry time of the oAuth token, None if it is missing or not valid"""
     try:
-        expires_at = datetime.strptime(expires_at, "%Y-%m-%d %H:%M:%S")
-        time_now = datetime.now()
-
-        if expires_at < time_now:
-            logger.info("Token expired")
-            return True
-        else:
-            logger.info("Token is valid")
-            return False
-    except TypeError as _:
+        return datetime.strptime(expires_at, EXPIRES_AT_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_token_expired(expires_at, refresh_ahead_seconds=0):
+    """
+    check if the oAuth Token is expired
+    :param expires_at: expiry time of the token
+    :param refresh_ahead_seconds: also report the token as expired this long before its expiry
+    """
+    expires_at = parse_expires_at(expires_at)
+    if expires_at is None:
         logger.info("Expire data format is not valid")
         return True
-    
+    if expires_at - timedelta(seconds=refresh_ahead_seconds) < datetime.now():
+        logger.info("Token expired")
+        return True
+    logger.info("Token is valid")
+    return False
+
+
+def acquire_refresh_lock(secret_name, version_id):
+    """
+    Single-flight the token refresh: every container derives the same request token from the
+    current version of the oAuth secret, and Secrets Manager rejects a second version written with
+    that request token and a different value, so only the first container gets the lock
+    :param secret_name: name of the oAuth secret
+    :param version_id: version of the secret holding the expiring token
+    :return: True if this container holds the lock and must refresh the token
+    """
+    try:
+        secrets_client.put_secret_value(
+            SecretId=secret_name,
+            ClientRequestToken=str(uuid.uuid5(uuid.NAMESPACE_URL, secret_name + "/" + version_id)),
+            SecretString=json.dumps({"refresh_lock": TOKEN_REFRESH_LOCK_OWNER}),
+            VersionStages=[TOKEN_REFRESH_LOCK_STAGE],
+        )
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ResourceExistsException":
+            logger.info("Token is being refreshed by another container")
+            return False
+        raise
+
+
+class TokenManager:
+    """
+    Keeps the oAuth token of the container between invocations and refreshes it ahead of its
+    expiry. Concurrent containers coordinate through the oAuth secret so only one of them calls
+    the token endpoint and the others reuse the token it saved.
+    """
+
+    def __init__(self, secret_name):
+        self.secret_name = secret_name
+        self.credentials = None
+        self.expires_at = None
+
+    def expires_soon(self):
+        return self.expires_at is None or self.expires_at - timedelta(seconds=TOKEN_REFRESH_AHEAD_SECONDS) < datetime.now()
+
+    def cache(self, credentials):
+        self.credentials = credentials
+        self.expires_at = parse_expires_at(credentials.get("expires_at"))
+        return credentials
+
+    def get_credentials(self, snap_credentials):
+        """
+        Get the oAuth credentials with a token valid for at least TOKEN_REFRESH_AHEAD_SECONDS
+        :param snap_credentials: snap client credentials, used to refresh the token
+        """
+        if self.credentials and not self.expires_soon():
+            return self.credentials
+        credentials = get_snap_credentials(self.secret_name)
+        if is_token_expired(credentials.get("expires_at"), TOKEN_REFRESH_AHEAD_SECONDS):
+            credentials = self.refresh(snap_credentials)
+        return self.cache(credentials)
+
+    def refresh(self, snap_credentials):
+        response = secrets_client.get_secret_value(SecretId=self.secret_name)
+        credentials = json.loads(response["SecretString"])
+        if not is_token_expired(credentials.get("expires_at"), TOKEN_REFRESH_AHEAD_SECONDS):
+            # another container refreshed the token since it was read
+            return credentials
+        if not acquire_refresh_lock(self.secret_name, response["VersionId"]):
+            credentials = self.wait_for_refresh(response["VersionId"], credentials)
+            if credentials is not None:
+                return credentials
+            logger.warning("Token was not refreshed by another container in time, refreshing it")
+            credentials = json.loads(response["SecretString"])
+        credentials = refresh_token(snap_credentials, credentials)
+        update_snap_credentials(self.secret_name, credentials)
+        return credentials
+
+    def wait_for_refresh(self, version_id, credentials):
+        """
+        Wait for the container holding the lock to save the refreshed token
+        :return: the refreshed credentials, or None if they were not saved in time
+        """
+        if not is_token_expired(credentials.get("expires_at")):
+            # the current token can still be used while it is refreshed
+            return credentials
+        deadline = time.monotonic() + TOKEN_REFRESH_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(1)
+            response = secrets_client.get_secret_value(SecretId=self.secret_name)
+            if response["VersionId"] != version_id:
+                return json.loads(response["SecretString"])
+        return None
+
+
+token_manager = TokenManager(snap_uploader_credentials_oauth_refresh)
+
+
+def get_valid_credentials():
+    """
+    Get the snap client credentials and an oAuth token valid for at least TOKEN_REFRESH_AHEAD_SECONDS
+    :return: snap credentials and oAuth credentials
+    """
+    # get the snap client credentials
+    snap_credentials = get_snap_credentials(snap_uploader_credentials)
+    snap_refresh_credentials = token_manager.get_credentials(snap_credentials)
+    return snap_credentials, snap_refresh_credentials
+
+
+class S3TagCheckpoint:
+    """
+    Index of the last batch of each schema acknowledged by Snap and number of users uploaded
+    up to it, stored as "<batch index>:<users>" in the tags of the part object. A part
+    rewritten by the Glue job starts without tags.
+    The schemas of a part are uploaded by concurrent threads sharing the checkpoint,
+    each save replaces the whole tag set so saves are serialized.
+    """
+
+    def __init__(self, bucket_name, key):
+        self.bucket_name = bucket_name
+        self.key = key
+        tag_set = s3_client.get_object_tagging(Bucket=bucket_name, Key=key)["TagSet"]
+        self.tags = {tag["Key"]: tag["Value"] for tag in tag_set}
+        self.lock = threading.Lock()
+
+    def get(self, schema):
+        """:return: index of the last acknowledged batch, -1 when there is none, and number of users uploaded up to it"""
+        batch_index, _, users_uploaded = self.tags.get(CHECKPOINT_TAG_PREFIX + schema, "-1:0").partition(":")
+        return int(batch_index), int(users_uploaded or 0)
+
+    def save(self, schema, batch_index, users_uploaded):
+        with self.lock:
+            self.tags[CHECKPOINT_TAG_PREFIX + schema] = "{}:{}".format(batch_index, users_uploaded)
+            s3_client.put_object_tagging(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                Tagging={"TagSet": [{"Key": k, "Value": v} for k, v in self.tags.items()]},
+            )
 
 
-def lambda_handler(event, _):
+class MemoryCheckpoint:
+    """Local stand-in for S3TagCheckpoint, the checkpoints only live as long as the process"""
+
+    store = {}
+
+    def __init__(self, bucket_name, key):
+        self.checkpoints = MemoryCheckpoint.store.setdefault((bucket_name, key), {})
+
+    def get(self, schema):
+        return self.checkpoints.get(schema, (-1, 0))
+
+    def save(self, schema, batch_index, users_uploaded):
+        self.checkpoints[schema] = (batch_index, users_uploaded)
+
+
+CHECKPOINT_STORES = {"s3": S3TagCheckpoint, "memory": MemoryCheckpoint}
+
+
+def get_checkpoint(bucket_name, key):
+    """Get the upload checkpoint of a part from the configured store"""
+    return CHECKPOINT_STORES[CHECKPOINT_STORE](bucket_name, key)
+
+
+def read_part_users(f, key):
+    """
+    Read the users of one output part
+    :param f: file object of the uncompressed (schema, hash) csv
+    :param key: key of the part, for logging
+    :return: dict of schema to the list of user hashes
+    """
+    data_csv = pd.read_csv(f).groupby("schema")
+    users = {}
+
+    for schema in SCHEMA_OPTIONS:
+
+        if schema in data_csv.groups.keys():
+
+            schema_data = data_csv.get_group(schema)
+
+            if not schema_data.empty:
+
+                count_row = schema_data.shape[0]
+                logger.info(
+                    schema
+                    + " has "
+                    + str(count_row)
+                    + " rows of data in "
+                    + key
+                )
+                users[schema] = schema_data["hash"].tolist()
+
+        else:
+            logger.info(schema + " is empty")
+
+    return users
+
+
+def add_schema_users(access_token, segment_id, segment_name, key, schema, hashes, checkpoint=None):
+    """
+    Add the users of one schema of an output part to the segment, in batches of at most
+    USERS_PER_REQUEST users. Batches acknowledged by a previous attempt are skipped when a
+    checkpoint is given, and each acknowledged batch is recorded in it with the users uploaded so far.
+    :return: last add users response, None if every batch was already uploaded, and number of users
+        uploaded, including the users of the batches acknowledged by previous attempts
+    """
+    add_user_resp = None
+    last_batch_index, users_uploaded = checkpoint.get(schema) if checkpoint else (-1, 0)
+    for batch_index, batch in iter_batches(hashes, USERS_PER_REQUEST):
+        if batch_index <= last_batch_index:
+            logger.info("{} batch {} of {} was already uploaded".format(schema, batch_index, key))
+            continue
+
+        data = user_hash(batch)
+        add_user_resp = add_users(
+            access_token,
+            segment_id,
+            schema,
+            data,
+        )
+
+        users_added_count = add_user_resp["users"][0]["user"]["number_uploaded_users"]
+        users_uploaded += users_added_count
+        if checkpoint:
+            checkpoint.save(schema, batch_index, users_uploaded)
+
+        logger.info(
+            "Users added to segment: "
+            + segment_name
+            + " is "
+            + str(users_added_count)
+        )
+
+    return add_user_resp, users_uploaded
+
+
+def add_part_users(f, access_token, segment_id, segment_name, key, checkpoint=None):
+    """
+    Add the users of one output part to the segment
+    :param f: file object of the uncompressed (schema, hash) csv
+    :return: last add users response and number of users uploaded
+    """
+    # initialize for the case where no schemas exist within the data_csv keys
+    add_user_resp = "no schemas were found"
+    users_uploaded = 0
+
+    for schema, hashes in read_part_users(f, key).items():
+        schema_resp, schema_users_uploaded = add_schema_users(
+            access_token, segment_id, segment_name, key, schema, hashes, checkpoint
+        )
+        add_user_resp = schema_resp or add_user_resp
+        users_uploaded += schema_users_uploaded
+
+    return add_user_resp, users_uploaded
+
+
+class SnapDestination(AudienceDestination):
+    """
+    Snap segment of an audience. Every schema of a part is one request to the upload engine,
+    sent as sequential batches so that the checkpoint of the schema only moves forward.
+    """
+
+    platform = "snap"
+    schemas = SCHEMA_OPTIONS
+    upload_method = "users"
+    max_request_rows = USERS_PER_REQUEST
+
+    def __init__(self, bucket_name, access_token, segment_id, segment_name):
+        self.bucket_name = bucket_name
+        self.access_token = access_token
+        self.segment_id = segment_id
+        self.segment_name = segment_name
+
+    def read_part(self, bucket_name, part):
+        return read_part(s3_client, bucket_name, part)
+
+    def decode_part(self, part, body):
+        with gzip.GzipFile(fileobj=io.BytesIO(body), mode="rb") as f:
+            users = read_part_users(f, part["key"])
+        # the schemas of a part share the tags of the part
+        checkpoint = get_checkpoint(self.bucket_name, part["key"])
+        return [(schema, hashes, checkpoint) for schema, hashes in users.items()]
+
+    def upload(self, part, request):
+        schema, hashes, checkpoint = request
+        _, users_uploaded = add_schema_users(
+            self.access_token, self.segment_id, self.segment_name, part["key"], schema, hashes, checkpoint
+        )
+        return users_uploaded
+
+    def part_uploaded(self, bucket_name, part, results):
+        record_part_outcome(s3_client, bucket_name, part["key"], sum(results))
+
+
+def upload_manifest_part(bucket_name, part, access_token, segment_id, segment_name):
+    """
+    Upload one part listed in a manifest to the segment
+    :return: number of users uploaded
+    """
+    engine = UploadEngine(
+        SnapDestination(bucket_name, access_token, segment_id, segment_name),
+        max_parts=1,
+        profiler=get_memory_profiler(MEMORY_PROFILE),
+    )
+    return sum(engine.upload_parts(bucket_name, [part])[0])
+
+
+def upload_manifest(bucket_name, key, snap_credentials, snap_refresh_credentials):
+    """
+    Upload every part listed in a manifest to the segment. The token and the segment id
+    are resolved once for the whole audience, and the upload engine reads and decodes
+    the next parts while the previous ones are uploaded.
+    :return: summary of the upload
+    """
+    manifest = read_manifest(s3_client, bucket_name, key)
+    segment_name = manifest["segment_name"]
+    access_token = snap_refresh_credentials["access_token"]
+    segment_id = get_segment_id_by_name(
+        snap_credentials, snap_refresh_credentials, segment_name
+    )
+    logger.info(
+        "Uploading {} parts ({} rows) of segment {}".format(
+            len(manifest["parts"]), manifest["total_rows"], segment_name
+        )
+    )
 
+    engine = UploadEngine(
+        SnapDestination(bucket_name, access_token, segment_id, segment_name),
+        max_parts=2 * MAX_UPLOAD_WORKERS,
+        max_requests=MAX_UPLOAD_WORKERS,
+        profiler=get_memory_profiler(MEMORY_PROFILE),
+    )
     try:
-        # getting secret from secret manager
-        snap_credentials = []
-        snap_refresh_credentials = get_snap_credentials(
-            snap_uploader_credentials_oauth_refresh
+        results = engine.upload_parts(bucket_name, manifest["parts"])
+    except RetryableUploadError as e:
+        e.parts_uploaded = engine.parts_uploaded
+        raise
+
+    return {
+        "segment_name": segment_name,
+        "parts_uploaded": len(manifest["parts"]),
+        "users_uploaded": sum(sum(part_results) for part_results in results),
+    }
+
+
+###############################
+# UPLOAD WORKFLOW STEPS
+###############################
+
+
+def plan_handler(event, _):
+    """
+    First step of the upload workflow: refresh the token and look up the segment once
+    for the whole audience, and list the parts for the Map state
+    :param event: {"bucket": ..., "key": ..., "etag": ...} of the manifest
+    :return: plan of the upload and the ranges of part indexes, one per Map iteration, the Map state carries the indexes only
+    """
+    snap_credentials, snap_refresh_credentials = get_valid_credentials()
+    manifest = read_manifest(s3_client, event["bucket"], event["key"])
+    segment_name = manifest["segment_name"]
+    segment_id = get_segment_id_by_name(
+        snap_credentials, snap_refresh_credentials, segment_name
+    )
+    if not segment_id:
+        raise ValueError("ERROR : segment {} was not found".format(segment_name))
+    logger.info(
+        "Planned upload of {} parts ({} rows) of segment {}".format(
+            len(manifest["parts"]), manifest["total_rows"], segment_name
+        )
+    )
+    return {
+        "plan": {
+            "bucket": event["bucket"],
+            "manifest_key": event["key"],
+            "manifest_etag": event.get("etag"),
+            "segment_name": segment_name,
+            "segment_id": segment_id,
+        },
+        "total_rows": manifest["total_rows"],
+        "parts": plan_part_ranges(len(manifest["parts"])),
+    }
+
+
+def upload_part_handler(event, context):
+    """
+    Map iteration of the upload workflow: upload a range of parts of the manifest. A throttled
+    upload returns the delay the workflow waits before the next attempt of the rest of the range.
+    :param event: {"plan": ..., "parts": ..., "attempt": ..., "results": ...}, parts is the [start, stop] range of
+        part indexes in the manifest, attempt is 1 and results is empty when missing
+    :return: outcome of the attempt, with the compact results of the parts aggregated once every part is uploaded
+    """
+    plan = event["plan"]
+
+    def upload(index):
+        part = read_manifest_part(s3_client, plan["bucket"], plan["manifest_key"], plan["manifest_etag"], index)
+        _, snap_refresh_credentials = get_valid_credentials()
+        users_uploaded = upload_manifest_part(
+            plan["bucket"],
+            part,
+            snap_refresh_credentials["access_token"],
+            plan["segment_id"],
+            plan["segment_name"],
         )
+        logger.info("Uploaded {} users of part {}".format(users_uploaded, part["key"]))
+        return {"rows": part["rows"], "users_uploaded": users_uploaded}
 
-        # get the snap client credentials
-        snap_credentials = get_snap_credentials(snap_uploader_credentials)
+    return run_workflow_range(upload, event["parts"], event.get("attempt", 1), event.get("results", []), context)
 
-        # find out if token expired
-        token_expires_at = snap_refresh_credentials["expires_at"]
 
-        # refresh the token if it expired
-        if is_token_expired(token_expires_at):
-            snap_refresh_credentials = get_snap_credentials(
-                snap_uploader_credentials_oauth_refresh
-            )
-            # get refresh token
-            snap_refresh_credentials = refresh_token(
-                snap_credentials, snap_refresh_credentials
-            )
+def aggregate_handler(event, _):
+    """
+    Last step of the upload workflow: summarize the uploaded parts into a single completion status
+    :param event: plan step output with the results of the Map iterations under "results"
+    """
+    results = [result for range_results in event["results"] for result in range_results]
+    summary = {
+        "status": "SUCCEEDED",
+        "segment_name": event["plan"]["segment_name"],
+        "parts_uploaded": len(results),
+        "rows": sum(result["rows"] for result in results),
+        "users_uploaded": sum(result["users_uploaded"] for result in results),
+    }
+    logger.info("Upload summary: " + json.dumps(summary))
+    return summary
 
-            # updated the new oauth secret in Secret Manager
-            update_snap_credentials(
-                snap_uploader_credentials_oauth_refresh, snap_refresh_credentials
-            )
+
+def lambda_handler(event, _):
+
+    try:
+        # getting secret from secret manager, refreshing the oAuth token if it expired
+        snap_credentials, snap_refresh_credentials = get_valid_credentials()
 
         for record in event["Records"]:
             # input event from s3 put event from sqs
@@ -177,6 +627,28 @@ def lambda_handler(event, _):
                 encoding="utf-8",
             )
 
+            # the Glue job writes the manifest after the last part, upload the whole audience at once
+            if key.endswith(MANIFEST_SUFFIX):
+                if UPLOAD_STATE_MACHINE_ARN:
+                    return {
+                        "uploader": {
+                            "response": start_upload_workflow(
+                                stepfunctions_client,
+                                UPLOAD_STATE_MACHINE_ARN,
+                                bucket_name,
+                                key,
+                                json.loads(record["body"])["detail"]["object"].get("etag", ""),
+                            ),
+                        }
+                    }
+                return {
+                    "uploader": {
+                        "response": upload_manifest(
+                            bucket_name, key, snap_credentials, snap_refresh_credentials
+                        ),
+                    }
+                }
+
             segment_name_prefix, file_name = os.path.split(key)
 
             segment_name_prefix = segment_name_prefix.split("/")
@@ -189,9 +661,6 @@ def lambda_handler(event, _):
                 snap_credentials, snap_refresh_credentials, segment_name_prefix
             )
 
-            # snap supported schemas
-            schema_options = ["EMAIL_SHA256", "MOBILE_AD_ID_SHA256", "PHONE_SHA256"]
-
             if not file_name.endswith(".gz"):
                 logger.info("not a supported file")
                 return {
@@ -204,49 +673,14 @@ def lambda_handler(event, _):
             # loop through the csv for each schema option and add each schema users to the  segment
             obj = s3_client.get_object(Bucket=bucket_name, Key=key)
             with gzip.GzipFile(fileobj=obj['Body'], mode='rb') as f:
-
-                data_csv = pd.read_csv(f).groupby("schema")
-
-                # initialize for the case where no schemas exist within the data_csv keys
-                add_user_resp = "no schemas were found"
-
-                for schema in schema_options:
-
-                    if schema in data_csv.groups.keys():
-
-                        schema_data = data_csv.get_group(schema)
-
-                        if not schema_data.empty:
-
-                            data = user_hash(schema_data["hash"].tolist())
-                            add_user_resp = add_users(
-                                snap_refresh_credentials["access_token"],
-                                segment_id,
-                                schema,
-                                data,
-                            )
-                            count_row = schema_data.shape[0]
-                            logger.info(
-                                schema
-                                + " has "
-                                + str(count_row)
-                                + " rows of data in "
-                                + key
-                            )
-
-                            users_added_count = str(
-                                add_user_resp["users"][0]["user"]["number_uploaded_users"]
-                            )
-
-                            logger.info(
-                                "Users added to segment: "
-                                + segment_name_prefix
-                                + " is "
-                                + users_added_count
-                            )
-
-                    else:
-                        logger.info(schema + " is empty")
+                add_user_resp, _ = add_part_users(
+                    f,
+                    snap_refresh_credentials["access_token"],
+                    segment_id,
+                    segment_name_prefix,
+                    key,
+                    get_checkpoint(bucket_name, key),
+                )
 
                 return {
                     "uploader": {
@@ -254,6 +688,14 @@ def lambda_handler(event, _):
                     }
                 }
 
+    except RetryableUploadError as e:
+        # fail the message so that it is retried, after a delay based on the progress
+        # made and the API hints rather than after the queue visibility timeout
+        logger.error(e)
+        receive_count = int(record.get("attributes", {}).get("ApproximateReceiveCount", 1))
+        schedule_retry(sqs_client, record, get_retry_delay(e, receive_count))
+        raise
+
     except ClientError as e:
         logger.error(e)
         return {"uploader": {"statusCode": e}}
@@ -9,19 +9,38 @@ import json
 import requests
 import urllib.parse
 import requests
-from six.moves.urllib.parse import urlunparse  # noqa
+from six.moves.urllib.parse import urlparse, urlunparse  # noqa
 import botocore
 import hashlib
 from aws_solutions.core.helpers import get_service_client, get_service_resource
+from upload_engine.destination import AudienceDestination
+from upload_engine.engine import UploadEngine
+from upload_engine.manifest import MANIFEST_SUFFIX, plan_part_ranges, read_manifest, read_manifest_part, read_part, start_upload_workflow
+from upload_engine.outcome import record_part_outcome
+from upload_engine.profiling import get_memory_profiler
+from upload_engine.retry import RetryableUploadError, get_retry_delay, run_workflow_range, schedule_retry
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 s3_resource = get_service_resource("s3")
 secrets_client = get_service_client("secretsmanager")
+stepfunctions_client = get_service_client("stepfunctions")
+sqs_client = get_service_client("sqs")
 
 tiktok_uploader_credentials = os.environ['CRED_SECRET_NAME']
 calculate_types = ['PHONE_SHA256', 'EMAIL_SHA256', 'GAID_SHA256', 'IDFA_SHA256']
+# TikTok API for Business, overridden to run against a local stand-in
+TIKTOK_API_URL = os.environ.get("TIKTOK_API_URL", "https://business-api.tiktok.com")
+MAX_UPLOAD_WORKERS = int(os.environ.get("MAX_UPLOAD_WORKERS", "4"))
+# rss or tracemalloc to log the memory high-water mark of each upload stage, to size the lambda memory
+MEMORY_PROFILE = os.environ.get("MEMORY_PROFILE")
+# set when the manifest uploads are orchestrated by the upload workflow
+UPLOAD_STATE_MACHINE_ARN = os.environ.get("UPLOAD_STATE_MACHINE_ARN")
+# TikTok response codes for rate limiting and internal errors
+RETRYABLE_CODES = [40100, 50000, 50002]
+# largest custom audience file accepted by TikTok
+MAX_FILE_BYTES = 50 * 1024**2
 
 
 def get_tiktok_credentials():
@@ -53,12 +72,12 @@ def build_url(path, query=""):
     :param query: Querystring
     :return: Request URL
     """
-    scheme, netloc = "https", "business-api.tiktok.com"
+    scheme, netloc = urlparse(TIKTOK_API_URL)[:2]
     return urlunparse((scheme, netloc, path, "", query, ""))
 
 
-def get_custom_audience_data(bucket_name, file_key, file_name):
-    """get custom audience data from S3"""
+def get_custom_audience_data(bucket_name, file_key, file_name, expected_signature=None):
+    """get custom audience data from S3, verifying its MD5 signature when it is known"""
     FILE_FULL_PATH = "/tmp/{}".format(file_name) # nosec, B108 # NOSONAR  Create a temp file to be uploaded to Tiktok API
     files = dict()
     file_signature = None
@@ -67,6 +86,8 @@ def get_custom_audience_data(bucket_name, file_key, file_name):
         files["file"] = open(FILE_FULL_PATH, "rb")
         file_signature = hashlib.md5( # nosec # NOSONAR
             open(FILE_FULL_PATH, 'rb').read()).hexdigest()
+        if expected_signature and file_signature != expected_signature:
+            raise ValueError("ERROR : checksum mismatch for {}".format(file_key))
 
     except botocore.exceptions.ClientError as e:
         if e.response['Error']['Code'] == "404":
@@ -76,14 +97,15 @@ def get_custom_audience_data(bucket_name, file_key, file_name):
     return files, file_signature
 
 
-def upload_custom_audience_data(bucket_name, file_key, file_name, calculate_type):
+def upload_custom_audience_data(bucket_name, file_key, file_name, calculate_type, tiktok_credentials=None, expected_signature=None):
     """upload audience data and generate file_paths"""
     path = "/open_api/v1.3/dmp/custom_audience/file/upload/"
     url = build_url(path)
-    tiktok_credentials = get_tiktok_credentials()
+    if tiktok_credentials is None:
+        tiktok_credentials = get_tiktok_credentials()
     json_args = {}
     files, file_signature = get_custom_audience_data(
-        bucket_name, file_key, file_name)
+        bucket_name, file_key, file_name, expected_signature)
     json_args["advertiser_id"] = tiktok_credentials["ADVERTISER_ID"]
     json_args["file_signature"] = str(file_signature.strip())
     json_args["calculate_type"] = calculate_type
@@ -94,14 +116,29 @@ def upload_custom_audience_data(bucket_name, file_key, file_name, calculate_type
     return resp.json()
 
 
-def create_custom_audience_data(custom_audience_name, file_path, calculate_type):
-    """create audience data from previously uploaded file on file_path"""
+def upload_custom_audience_file(file_name, body, calculate_type, tiktok_credentials):
+    """upload audience data held in memory and generate file_paths"""
+    path = "/open_api/v1.3/dmp/custom_audience/file/upload/"
+    url = build_url(path)
+    json_args = {}
+    json_args["advertiser_id"] = tiktok_credentials["ADVERTISER_ID"]
+    json_args["file_signature"] = hashlib.md5(body).hexdigest() # nosec # NOSONAR checksum only
+    json_args["calculate_type"] = calculate_type
+    headers = {
+        "Access-Token": tiktok_credentials["ACCESS_TOKEN"]
+    }
+    resp = requests.post(url, headers=headers, data=json_args, files={"file": (file_name, body)})
+    return resp.json()
+
+
+def create_custom_audience_data(custom_audience_name, file_path, calculate_type, tiktok_credentials=None):
+    """create audience data from previously uploaded file on file_path, or list of file paths"""
     path = "/open_api/v1.3/dmp/custom_audience/create/"
     url = build_url(path)
-    tiktok_credentials = get_tiktok_credentials()
+    if tiktok_credentials is None:
+        tiktok_credentials = get_tiktok_credentials()
     json_args = dict()
-    file_paths = []
-    file_paths.append(file_path)
+    file_paths = file_path if isinstance(file_path, list) else [file_path]
     json_args["advertiser_id"] = tiktok_credentials["ADVERTISER_ID"]
     json_args["file_paths"] = file_paths
     json_args["custom_audience_name"] = custom_audience_name
@@ -114,14 +151,14 @@ def create_custom_audience_data(custom_audience_name, file_path, calculate_type)
     return resp.json()
 
 
-def update_custom_audience_data(custom_audience_id, file_path):
-    """Append the audience data from uploaded file on file_path for custom_audience_id"""
+def update_custom_audience_data(custom_audience_id, file_path, tiktok_credentials=None):
+    """Append the audience data from uploaded file on file_path, or list of file paths, for custom_audience_id"""
     path = "/open_api/v1.3/dmp/custom_audience/update/"
     url = build_url(path)
-    tiktok_credentials = get_tiktok_credentials()
+    if tiktok_credentials is None:
+        tiktok_credentials = get_tiktok_credentials()
     json_args = dict()
-    file_paths = []
-    file_paths.append(file_path)
+    file_paths = file_path if isinstance(file_path, list) else [file_path]
     json_args["action"] = "APPEND"
     json_args["advertiser_id"] = tiktok_credentials["ADVERTISER_ID"]
     json_args["file_paths"] = file_paths
@@ -147,13 +184,14 @@ def get_custom_audience_obj(audience_list, custom_audience_name):
     return audience_obj
 
 
-def check_custom_audience_exist(custom_audience_name):
+def check_custom_audience_exist(custom_audience_name, tiktok_credentials=None):
     """
     checks custom audience already exists
     :returns: None if there is no custom audience
     """
     PATH = "/open_api/v1.3/dmp/custom_audience/list/"
-    tiktok_credentials = get_tiktok_credentials()
+    if tiktok_credentials is None:
+        tiktok_credentials = get_tiktok_credentials()
     ACCESS_TOKEN = tiktok_credentials["ACCESS_TOKEN"]
     advertiser_id = tiktok_credentials["ADVERTISER_ID"]
     page = 1
@@ -209,6 +247,182 @@ def clean_up(file_name):
         os.remove(FILE_FULL_PATH)
 
 
+def check_response(resp, custom_audience_name):
+    if resp['code'] in RETRYABLE_CODES:
+        raise RetryableUploadError("TikTok API returned {} for Custom Audience {}: {}".format(
+            resp['code'], custom_audience_name, resp['message']))
+    if resp['code'] != 0:
+        raise ValueError("ERROR in uploading Custom Audience {} to TikTok Ads. ERROR-->{}".format(
+            custom_audience_name, resp['message']))
+    return resp
+
+
+class TikTokDestination(AudienceDestination):
+    """TikTok custom audience. Every part is uploaded as one file, without going through /tmp"""
+
+    platform = "tiktok"
+    schemas = calculate_types
+    upload_method = "file"
+    max_request_bytes = MAX_FILE_BYTES
+
+    def __init__(self, tiktok_credentials, custom_audience_name):
+        self.tiktok_credentials = tiktok_credentials
+        self.custom_audience_name = custom_audience_name
+
+    def read_part(self, bucket_name, part):
+        return read_part(s3_resource.meta.client, bucket_name, part)
+
+    def decode_part(self, part, body):
+        file_name, calculate_type, _ = get_upload_audience_info(part["key"])
+        if len(body) > self.max_request_bytes:
+            raise ValueError("ERROR : part {} is larger than the TikTok file size limit".format(part["key"]))
+        # parts of different calculate types can share a file name
+        return [(calculate_type, calculate_type.lower() + "_" + file_name, body)]
+
+    def upload(self, part, request):
+        calculate_type, file_name, body = request
+        resp = upload_custom_audience_file(file_name, body, calculate_type, self.tiktok_credentials)
+        return calculate_type, check_response(resp, self.custom_audience_name)["data"]["file_path"]
+
+    def part_uploaded(self, bucket_name, part, results):
+        # TikTok matches the users of a file asynchronously, every row of the part was sent
+        record_part_outcome(s3_resource.meta.client, bucket_name, part["key"], part["rows"])
+
+
+def upload_manifest_part(bucket_name, part, tiktok_credentials, custom_audience_name):
+    """
+    Upload one part listed in a manifest
+    :return: calculate type and TikTok file_path of the uploaded part
+    """
+    engine = UploadEngine(
+        TikTokDestination(tiktok_credentials, custom_audience_name),
+        max_parts=1,
+        profiler=get_memory_profiler(MEMORY_PROFILE))
+    return engine.upload_parts(bucket_name, [part])[0][0]
+
+
+def add_files_to_custom_audience(custom_audience_name, file_paths, tiktok_credentials):
+    """
+    Create the custom audience, or append to it, with a single request per calculate type
+    :param file_paths: dict of calculate type to list of uploaded TikTok file paths
+    """
+    custom_audience_data = check_custom_audience_exist(custom_audience_name, tiktok_credentials)
+    custom_audience_id = custom_audience_data["audience_id"] if custom_audience_data else None
+    for calculate_type, paths in file_paths.items():
+        if custom_audience_id:
+            check_response(update_custom_audience_data(
+                custom_audience_id, paths, tiktok_credentials), custom_audience_name)
+        else:
+            resp = check_response(create_custom_audience_data(
+                custom_audience_name, paths, calculate_type, tiktok_credentials), custom_audience_name)
+            custom_audience_id = resp["data"]["custom_audience_id"]
+
+
+def upload_manifest(bucket_name, key):
+    """
+    Upload every part listed in a manifest and add them to the custom audience with a single
+    create or update request per calculate type. The credentials and the audience lookup are
+    resolved once for the whole audience, and the upload engine reads the next parts while
+    the previous ones are uploaded.
+    :return: status message
+    """
+    manifest = read_manifest(s3_resource.meta.client, bucket_name, key)
+    custom_audience_name = manifest["segment_name"]
+    tiktok_credentials = get_tiktok_credentials()
+
+    engine = UploadEngine(
+        TikTokDestination(tiktok_credentials, custom_audience_name),
+        max_parts=2 * MAX_UPLOAD_WORKERS,
+        max_requests=MAX_UPLOAD_WORKERS,
+        profiler=get_memory_profiler(MEMORY_PROFILE))
+    try:
+        results = engine.upload_parts(bucket_name, manifest["parts"])
+    except RetryableUploadError as e:
+        e.parts_uploaded = engine.parts_uploaded
+        raise
+
+    file_paths = {}
+    for part_results in results:
+        for calculate_type, file_path in part_results:
+            file_paths.setdefault(calculate_type, []).append(file_path)
+
+    if not file_paths:
+        return "Custom Audience {} has no data to upload".format(custom_audience_name)
+
+    add_files_to_custom_audience(custom_audience_name, file_paths, tiktok_credentials)
+    return "Custom Audience {} is successfully uploaded to TikTok Ads from {} files!".format(
+        custom_audience_name, len(manifest["parts"]))
+
+
+###############################
+# UPLOAD WORKFLOW STEPS
+###############################
+
+
+def plan_handler(event, _):
+    """
+    First step of the upload workflow: list the parts of the manifest for the Map state
+    :param event: {"bucket": ..., "key": ..., "etag": ...} of the manifest
+    :return: plan of the upload and the ranges of part indexes, one per Map iteration, the Map state carries the indexes only
+    """
+    manifest = read_manifest(s3_resource.meta.client, event["bucket"], event["key"])
+    logger.info("Planned upload of {} parts ({} rows) of Custom Audience {}".format(
+        len(manifest["parts"]), manifest["total_rows"], manifest["segment_name"]))
+    return {
+        "plan": {
+            "bucket": event["bucket"],
+            "manifest_key": event["key"],
+            "manifest_etag": event.get("etag"),
+            "segment_name": manifest["segment_name"],
+        },
+        "total_rows": manifest["total_rows"],
+        "parts": plan_part_ranges(len(manifest["parts"])),
+    }
+
+
+def upload_part_handler(event, context):
+    """
+    Map iteration of the upload workflow: upload a range of parts of the manifest. A throttled
+    upload returns the delay the workflow waits before the next attempt of the rest of the range.
+    :param event: {"plan": ..., "parts": ..., "attempt": ..., "results": ...}, parts is the [start, stop] range of
+        part indexes in the manifest, attempt is 1 and results is empty when missing
+    :return: outcome of the attempt, with the compact results of the parts aggregated once every part is uploaded
+    """
+    plan = event["plan"]
+
+    def upload(index):
+        part = read_manifest_part(s3_resource.meta.client, plan["bucket"], plan["manifest_key"], plan["manifest_etag"], index)
+        calculate_type, file_path = upload_manifest_part(
+            plan["bucket"], part, get_tiktok_credentials(), plan["segment_name"])
+        logger.info("Uploaded part {} to file {}".format(part["key"], file_path))
+        return {"rows": part["rows"], "calculate_type": calculate_type, "file_path": file_path}
+
+    return run_workflow_range(upload, event["parts"], event.get("attempt", 1), event.get("results", []), context)
+
+
+def aggregate_handler(event, _):
+    """
+    Last step of the upload workflow: add every uploaded file to the custom audience
+    and summarize the upload into a single completion status
+    :param event: plan step output with the results of the Map iterations under "results"
+    """
+    custom_audience_name = event["plan"]["segment_name"]
+    results = [result for range_results in event["results"] for result in range_results]
+    file_paths = {}
+    for result in results:
+        file_paths.setdefault(result["calculate_type"], []).append(result["file_path"])
+    if file_paths:
+        add_files_to_custom_audience(custom_audience_name, file_paths, get_tiktok_credentials())
+    summary = {
+        "status": "SUCCEEDED",
+        "segment_name": custom_audience_name,
+        "parts_uploaded": len(results),
+        "rows": sum(result["rows"] for result in results),
+    }
+    logger.info("Upload summary: " + json.dumps(summary))
+    return summary
+
+
 def lambda_handler(event, _):
     __error_code = 400
     for record in event["Records"]:
@@ -223,41 +437,60 @@ def lambda_handler(event, _):
             key = urllib.parse.unquote_plus(json.loads(record['body'])[
                                             'detail']['object']['key'], encoding='utf-8')
             logger.info("Key--> {}".format(key))
-            file_name, calculate_type, custom_audience_name = get_upload_audience_info(key)
-            logger.info("file_name--> {} calculate_type -->{} custom_audience_name --> {} ".format(file_name, calculate_type, custom_audience_name))
-            # Step 1 :Upload custom audience data and get file_path.
-            # file_path is required in both new and update case
-            resp = upload_custom_audience_data(
-                bucket_name, key, file_name, calculate_type)
-            if resp['code'] == 0:
-                file_path = resp["data"]["file_path"]
-                # Step 2 : Check Custom audience is already present
-                custom_audience_data = check_custom_audience_exist(
-                    custom_audience_name)
-                if custom_audience_data:
-                    # Step 2-A : Custom audience is already present . Update the audience
-                    resp = update_custom_audience_data(
-                        custom_audience_data["audience_id"], file_path)
-                    __message = "Custom Audience {} is successfully updated in TikTok Ads!".format(
-                        custom_audience_name)
+            if key.endswith(MANIFEST_SUFFIX):
+                # the Glue job writes the manifest after the last part, upload the whole audience at once
+                if UPLOAD_STATE_MACHINE_ARN:
+                    etag = json.loads(record['body'])['detail']['object'].get('etag', '')
+                    response = start_upload_workflow(stepfunctions_client, UPLOAD_STATE_MACHINE_ARN, bucket_name, key, etag)
+                    if "execution_arn" in response:
+                        __message = "Started upload workflow {}".format(response["execution_arn"])
+                    else:
+                        __message = "Upload workflow {} was already started".format(response["execution_name"])
                 else:
-                    # Step 2-B : Create new audience.
-                    resp = create_custom_audience_data(
-                        custom_audience_name, file_path, calculate_type)
-                    __message = "Custom Audience {} is successfully created to TikTok Ads!".format(
+                    __message = upload_manifest(bucket_name, key)
+            else:
+                file_name, calculate_type, custom_audience_name = get_upload_audience_info(key)
+                logger.info("file_name--> {} calculate_type -->{} custom_audience_name --> {} ".format(file_name, calculate_type, custom_audience_name))
+                # Step 1 :Upload custom audience data and get file_path.
+                # file_path is required in both new and update case
+                resp = upload_custom_audience_data(
+                    bucket_name, key, file_name, calculate_type)
+                if resp['code'] == 0:
+                    file_path = resp["data"]["file_path"]
+                    # Step 2 : Check Custom audience is already present
+                    custom_audience_data = check_custom_audience_exist(
                         custom_audience_name)
-            # Step 3 :Clean up. Delete temporary files
-            clean_up(file_name)
-            if resp:
-                if resp['code'] != 0:
-                    __message = "ERROR in uploading Custom Audience {} to TikTok Ads. ERROR-->{}".format(
-                        custom_audience_name, resp['message'])
-                    __status_code = resp['code']
+                    if custom_audience_data:
+                        # Step 2-A : Custom audience is already present . Update the audience
+                        resp = update_custom_audience_data(
+                            custom_audience_data["audience_id"], file_path)
+                        __message = "Custom Audience {} is successfully updated in TikTok Ads!".format(
+                            custom_audience_name)
+                    else:
+                        # Step 2-B : Create new audience.
+                        resp = create_custom_audience_data(
+                            custom_audience_name, file_path, calculate_type)
+                        __message = "Custom Audience {} is successfully created to TikTok Ads!".format(
+                            custom_audience_name)
+                # Step 3 :Clean up. Delete temporary files
+                clean_up(file_name)
+                if resp:
+                    if resp['code'] != 0:
+                        __message = "ERROR in uploading Custom Audience {} to TikTok Ads. ERROR-->{}".format(
+                            custom_audience_name, resp['message'])
+                        __status_code = resp['code']
     
-            else:
-                __message = "ERROR in uploading Custom Audience {} to TikTok Ads.".format(
-                    custom_audience_name)
-                __status_code = __error_code
+                else:
+                    __message = "ERROR in uploading Custom Audience {} to TikTok Ads.".format(
+                        custom_audience_name)
+                    __status_code = __error_code
+        except RetryableUploadError as err:
+            # fail the message so that it is retried, after a delay based on the progress
+            # made and the API hints rather than after the queue visibility timeout
+            logger.error(err)
+            receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+            schedule_retry(sqs_client, record, get_retry_delay(err, receive_count))
+            raise
         except ValueError as err:
             __message = err
             __status_code = __error_code
@@ -0,0 +1,73 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Interface between the upload engine and a partner API. An upload of a
+#   manifest part goes through three stages: the part is read from S3, decoded
+#   into the requests the partner API accepts, and each request is sent. The
+#   stages are blocking calls that the engine overlaps across parts.
+###############################################################################
+
+from abc import ABC, abstractmethod
+
+
+def iter_batches(values, batch_size):
+    """
+    Split the values of a request into batches of at most batch_size values
+    :return: generator of (batch index, batch) tuples
+    """
+    for batch_index, start in enumerate(range(0, len(values), batch_size)):
+        yield batch_index, values[start:start + batch_size]
+
+
+class AudienceDestination(ABC):
+    """
+    A partner API the audiences are uploaded to. Destinations declare what the API accepts,
+    matching the destination of the Glue job of the platform (etl_helpers.destinations).
+    """
+
+    # name of the platform in the output prefix, e.g. snap
+    platform = None
+    # output schemas the API accepts, e.g. EMAIL_SHA256
+    schemas = ()
+    # "users" to send batches of at most max_request_rows hashed users, "file" to send each part as a file
+    upload_method = None
+    max_request_rows = None
+    # largest file the API accepts
+    max_request_bytes = None
+
+    @abstractmethod
+    def read_part(self, bucket_name, part):
+        """
+        Read one part listed in the manifest and verify its checksum
+        :param bucket_name: output bucket of the Glue job
+        :param part: manifest entry of the part
+        :return: body of the part
+        """
+
+    @abstractmethod
+    def decode_part(self, part, body):
+        """
+        Decode a part into the requests sent to the partner API
+        :param part: manifest entry of the part
+        :param body: body returned by read_part
+        :return: list of requests
+        """
+
+    @abstractmethod
+    def upload(self, part, request):
+        """
+        Send one request returned by decode_part
+        :param part: manifest entry of the part
+        :param request: request to send
+        :return: result of the request
+        """
+
+    def part_uploaded(self, bucket_name, part, results):
+        """
+        Record the outcome of a part once every request of the part was sent. Does nothing by default
+        :param bucket_name: output bucket of the Glue job
+        :param part: manifest entry of the part
+        :param results: list of the results of the requests of the part
+        """
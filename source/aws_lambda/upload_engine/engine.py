@@ -0,0 +1,104 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   asyncio upload engine shared by the uploader lambdas. The S3 reads, the
+#   decoding and the partner API requests of the parts of a manifest run in
+#   worker threads scheduled by an event loop, so the next parts are read and
+#   decoded while the previous ones are being uploaded, within bounds on the
+#   number of parts held in memory and of requests in flight.
+###############################################################################
+
+import asyncio
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+
+class UploadEngine:
+    """Upload the parts of a manifest to an AudienceDestination"""
+
+    def __init__(self, destination, max_parts=4, max_requests=4, profiler=None):
+        """
+        :param destination: AudienceDestination the parts are uploaded to
+        :param max_parts: number of parts read and decoded ahead of the uploads
+        :param max_requests: number of partner API requests in flight
+        :param profiler: upload_engine.profiling.MemoryProfiler recording the memory of each stage during the uploads
+        """
+        self.destination = destination
+        self.max_parts = max_parts
+        self.max_requests = max_requests
+        self.profiler = profiler
+        # parts whose every request was sent, reported when an upload fails
+        self.parts_uploaded = 0
+        # worker seconds spent in each stage (read, decode, upload, record), summed over the parts
+        self.stage_seconds = Counter()
+
+    def _timed(self, stage, function, *args):
+        start = time.perf_counter()
+        try:
+            if self.profiler:
+                with self.profiler.stage(stage):
+                    return function(*args)
+            return function(*args)
+        finally:
+            self.stage_seconds[stage] += time.perf_counter() - start
+
+    async def _call(self, stage, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._timed, stage, function, *args)
+
+    async def _send(self, part, request):
+        # a failed request keeps its slot, the requests waiting for one are cancelled rather than sent
+        await self._request_slots.acquire()
+        result = await self._call("upload", self.destination.upload, part, request)
+        self._request_slots.release()
+        return result
+
+    async def _upload_part(self, bucket_name, part):
+        async with self._part_slots:
+            body = await self._call("read", self.destination.read_part, bucket_name, part)
+            part_requests = await self._call("decode", self.destination.decode_part, part, body)
+            del body
+            results = list(await asyncio.gather(*(self._send(part, request) for request in part_requests)))
+            await self._call("record", self.destination.part_uploaded, bucket_name, part, results)
+        self.parts_uploaded += 1
+        return results
+
+    async def upload_parts_async(self, bucket_name, parts):
+        """
+        Upload the parts of a manifest
+        :param bucket_name: output bucket of the Glue job
+        :param parts: manifest entries of the parts
+        :return: list of the results of the requests of each part, in the order of the parts
+        """
+        self.stage_seconds = Counter()
+        self._part_slots = asyncio.Semaphore(self.max_parts)
+        self._request_slots = asyncio.Semaphore(self.max_requests)
+        with ThreadPoolExecutor(max_workers=self.max_parts + self.max_requests) as self._executor:
+            tasks = [asyncio.create_task(self._upload_part(bucket_name, part)) for part in parts]
+            try:
+                return await asyncio.gather(*tasks)
+            except Exception:
+                # the first failure abandons the other parts, they are cancelled and waited for before it is raised
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+
+    def upload_parts(self, bucket_name, parts):
+        """Blocking version of upload_parts_async, for the lambda handlers"""
+        self.parts_uploaded = 0
+        if self.profiler:
+            self.profiler.start()
+        try:
+            results = asyncio.run(self.upload_parts_async(bucket_name, parts))
+        finally:
+            if self.profiler:
+                self.profiler.stop()
+                logger.info("Peak memory per stage: {}".format(self.profiler.peaks))
+        logger.info("Uploaded {} parts to {}".format(self.parts_uploaded, self.destination.platform))
+        return results
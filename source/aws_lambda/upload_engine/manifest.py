@@ -0,0 +1,86 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Manifest of the output parts written by the Glue job once every part is
+#   written: reading it and the parts it lists, and starting the upload
+#   workflow of the audience it describes. The workflow state only carries
+#   ranges of part indexes, each Map iteration reads its parts from the manifest.
+###############################################################################
+
+import functools
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger()
+
+# also read by the API (chalicelib/progress.py)
+MANIFEST_SUFFIX = "_manifest.json"
+# iterations of the Map state of the upload workflow. A standard execution fails past 25,000
+# history events and an iteration logs about 11 events, plus about 6 per throttled attempt, so
+# a large audience (a Snap part holds 100,000 rows, about 2,000 parts for 100 million users
+# with email and phone) is uploaded in ranges of parts rather than one part per iteration.
+MAX_MAP_ITERATIONS = 200
+
+
+def read_manifest(s3_client, bucket_name, key):
+    """Read the manifest of output parts written by the Glue job"""
+    return json.loads(s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read())
+
+
+@functools.lru_cache(maxsize=8)
+def _read_manifest_version(s3_client, bucket_name, key, etag):
+    request = {"Bucket": bucket_name, "Key": key}
+    if etag:
+        request["IfMatch"] = etag
+    return json.loads(s3_client.get_object(**request)["Body"].read())
+
+
+def read_manifest_part(s3_client, bucket_name, key, etag, index):
+    """
+    Read the manifest entry of one part, the manifest is read once per container and version
+    :param etag: ETag of the manifest version the upload was planned on, or None for the current version
+    :param index: index of the part in the manifest
+    """
+    return _read_manifest_version(s3_client, bucket_name, key, etag)["parts"][index]
+
+
+def plan_part_ranges(part_count, max_ranges=MAX_MAP_ITERATIONS):
+    """
+    Split the parts of a manifest into contiguous ranges, one per Map iteration of the upload workflow
+    :param part_count: number of parts in the manifest
+    :param max_ranges: maximum number of ranges
+    :return: [start, stop] ranges of part indexes, stop excluded
+    """
+    size = max(1, -(-part_count // max_ranges))
+    return [[start, min(start + size, part_count)] for start in range(0, part_count, size)]
+
+
+def read_part(s3_client, bucket_name, part):
+    """Download one part listed in the manifest and verify its checksum"""
+    body = s3_client.get_object(Bucket=bucket_name, Key=part["key"])["Body"].read()
+    if hashlib.md5(body).hexdigest() != part["md5"]: # nosec # NOSONAR checksum only
+        raise ValueError("ERROR : checksum mismatch for part {}".format(part["key"]))
+    return body
+
+
+def start_upload_workflow(stepfunctions_client, state_machine_arn, bucket_name, key, etag):
+    """
+    Start the upload workflow for a manifest. The execution name is derived from the manifest
+    object so that a redelivered message does not upload the audience twice.
+    :return: {"execution_arn": ...} of the started execution, or {"execution_name": ...} when it was already started
+    """
+    execution_name = hashlib.sha256((bucket_name + "/" + key + "/" + etag).encode()).hexdigest()[:80]
+    try:
+        response = stepfunctions_client.start_execution(
+            stateMachineArn=state_machine_arn,
+            name=execution_name,
+            input=json.dumps({"bucket": bucket_name, "key": key, "etag": etag}),
+        )
+    except stepfunctions_client.exceptions.ExecutionAlreadyExists:
+        logger.info("Upload workflow {} was already started".format(execution_name))
+        return {"execution_name": execution_name}
+    logger.info("Started upload workflow " + response["executionArn"])
+    return {"execution_arn": response["executionArn"]}
@@ -0,0 +1,40 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Upload outcome of each output part, stored in the tags of the part once
+#   every request of the part was accepted by the partner API: the number of
+#   users uploaded and when. The progress endpoint of the API reads them to
+#   report the parts uploaded and the upload throughput of an audience.
+###############################################################################
+
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger()
+
+# also read by the API (chalicelib/progress.py)
+USERS_UPLOADED_TAG = "uploaded-users"
+UPLOADED_AT_TAG = "uploaded-at"
+
+
+def record_part_outcome(s3_client, bucket_name, key, users_uploaded):
+    """
+    Tag a part with its upload outcome, keeping its other tags. The users are already
+    uploaded, so failing to record the outcome only logs a warning.
+    :param s3_client: boto3 S3 client
+    :param users_uploaded: number of users of the part accepted by the partner API
+    """
+    try:
+        tag_set = s3_client.get_object_tagging(Bucket=bucket_name, Key=key)["TagSet"]
+        tags = {tag["Key"]: tag["Value"] for tag in tag_set}
+        tags[USERS_UPLOADED_TAG] = str(users_uploaded)
+        tags[UPLOADED_AT_TAG] = datetime.now(timezone.utc).isoformat()
+        s3_client.put_object_tagging(
+            Bucket=bucket_name,
+            Key=key,
+            Tagging={"TagSet": [{"Key": k, "Value": v} for k, v in tags.items()]},
+        )
+    except Exception as e:
+        logger.warning("Unable to record the upload outcome of {}: {}".format(key, e))
@@ -0,0 +1,123 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Memory high-water marks of the stages of the upload engine (read, decode,
+#   upload) and of the transformation jobs, to size the uploader lambdas and
+#   the Glue workers from measurements. A background thread samples the
+#   resident memory of the process, and optionally the memory allocated by
+#   Python (tracemalloc, slower), and records the largest sample taken while
+#   each stage was running. Enabled by the MEMORY_PROFILE environment variable
+#   of the uploaders and the --memory_profile parameter of the Glue jobs, the
+#   build adds this module to the etl_helpers library of the Glue jobs.
+###############################################################################
+
+import os
+import resource
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+MEMORY_PROFILES = ("rss", "tracemalloc")
+SAMPLE_INTERVAL_SECONDS = 0.05
+
+
+def current_rss_bytes():
+    """Resident memory of the process, or its high-water mark where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # kilobytes on Linux, bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class MemoryProfiler:
+    """
+    Samples the memory of the process while stages run. Stages can overlap, a sample counts
+    towards every stage running when it is taken:
+
+        profiler.start()
+        with profiler.stage("read"):
+            ...
+        profiler.stop()
+        profiler.peaks["read"]["peak_rss_bytes"]
+    """
+
+    def __init__(self, trace_allocations=False, interval=SAMPLE_INTERVAL_SECONDS):
+        """
+        :param trace_allocations: also sample the memory allocated by Python with tracemalloc
+        :param interval: seconds between two samples
+        """
+        self.trace_allocations = trace_allocations
+        self.interval = interval
+        # stage name to its peak_rss_bytes, and peak_traced_bytes when tracing allocations
+        self.peaks = {}
+        self._running = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._started_tracing = False
+
+    def start(self):
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._sample_until_stopped, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _sample_until_stopped(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Record the current memory as the peak of the running stages it exceeds"""
+        sample = {"peak_rss_bytes": current_rss_bytes()}
+        if self.trace_allocations and tracemalloc.is_tracing():
+            sample["peak_traced_bytes"] = tracemalloc.get_traced_memory()[0]
+        with self._lock:
+            for name, running in self._running.items():
+                if not running:
+                    continue
+                peaks = self.peaks[name]
+                for measure, value in sample.items():
+                    peaks[measure] = max(peaks.get(measure, 0), value)
+
+    @contextmanager
+    def stage(self, name):
+        """Record the memory high-water marks while the block runs"""
+        with self._lock:
+            self._running[name] += 1
+            self.peaks.setdefault(name, {})
+        self.sample()
+        try:
+            yield
+        finally:
+            self.sample()
+            with self._lock:
+                self._running[name] -= 1
+
+
+def get_memory_profiler(memory_profile):
+    """
+    Get the profiler of the MEMORY_PROFILE environment variable or the --memory_profile job parameter
+    :param memory_profile: rss, tracemalloc, or None to disable profiling
+    :return: MemoryProfiler, or None
+    """
+    if not memory_profile:
+        return None
+    if memory_profile not in MEMORY_PROFILES:
+        raise ValueError("ERROR : memory profile {} is not one of {}".format(memory_profile, list(MEMORY_PROFILES)))
+    return MemoryProfiler(trace_allocations=memory_profile == "tracemalloc")
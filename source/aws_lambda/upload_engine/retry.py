@@ -0,0 +1,138 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Retries of the uploads throttled or failed transiently by a partner API.
+#   The uploaders raise RetryableUploadError with the retry hint of the API,
+#   and the delay before the next attempt is derived from the hint, the
+#   progress made and the number of attempts, whether the upload is retried by
+#   the upload workflow or by redelivering the message of the upload queue.
+###############################################################################
+
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# bounds of the delay before a throttled upload is attempted again
+MIN_RETRY_DELAY_SECONDS = 30
+MAX_RETRY_DELAY_SECONDS = 900
+# attempts of a part by the upload workflow before the upload fails
+MAX_WORKFLOW_ATTEMPTS = 6
+# time left to an upload part lambda below which it stops before the next part of its range,
+# the workflow invokes it again for the rest of the range
+MIN_REMAINING_MILLIS = 300 * 1000
+# status of an attempt of the upload workflow, see run_workflow_attempt
+UPLOADED_STATUS = "UPLOADED"
+RETRY_STATUS = "RETRY"
+
+
+class RetryableUploadError(Exception):
+    """The partner API throttled or failed transiently, the request can be retried"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        # seconds to wait before retrying, when the API hinted it
+        self.retry_after = retry_after
+        # parts of the manifest uploaded before the error
+        self.parts_uploaded = 0
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header
+    :param value: delay in seconds or HTTP date, or None
+    :return: seconds to wait, or None when there is no valid hint
+    """
+    if not value:
+        return None
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(int((retry_at - datetime.now(timezone.utc)).total_seconds()), 0)
+
+
+def get_retry_delay(error, attempt):
+    """
+    Seconds before a throttled upload is attempted again: the retry hint when the API
+    sent one, the minimum delay when the attempt still uploaded parts, and an exponential
+    backoff on the number of attempts otherwise
+    :param attempt: number of the failed attempt, from 1
+    """
+    if error.retry_after is not None:
+        delay = error.retry_after
+    elif error.parts_uploaded:
+        delay = MIN_RETRY_DELAY_SECONDS
+    else:
+        delay = MIN_RETRY_DELAY_SECONDS * 2 ** (attempt - 1)
+    return int(min(max(delay, 0), MAX_RETRY_DELAY_SECONDS))
+
+
+def schedule_retry(sqs_client, record, delay):
+    """Make a failed message of the upload queue visible again after delay seconds instead of the queue visibility timeout"""
+    try:
+        _, _, _, _, account_id, queue_name = record["eventSourceARN"].split(":")
+        queue_url = sqs_client.get_queue_url(QueueName=queue_name, QueueOwnerAWSAccountId=account_id)["QueueUrl"]
+        sqs_client.change_message_visibility(
+            QueueUrl=queue_url, ReceiptHandle=record["receiptHandle"], VisibilityTimeout=delay
+        )
+        logger.info("Retrying the message in {} seconds".format(delay))
+    except (ClientError, KeyError, ValueError) as e:
+        logger.error("Unable to change the message visibility, it will be retried after the queue visibility timeout: {}".format(e))
+
+
+def run_workflow_attempt(upload, attempt):
+    """
+    Run one attempt of a step of the upload workflow. A throttled attempt is not failed: it returns
+    the delay the workflow waits (Wait state) before the next attempt, so that the retry hint of the
+    API is followed rather than the fixed schedule of a Step Functions retrier.
+    :param upload: function running the step and returning its result
+    :param attempt: number of the attempt, from 1
+    :return: {"status": "UPLOADED", "result": ...}, or {"status": "RETRY", "retry_after_seconds": ..., "attempt": ...}
+        with the number of the next attempt
+    """
+    try:
+        return {"status": UPLOADED_STATUS, "result": upload()}
+    except RetryableUploadError as e:
+        if attempt >= MAX_WORKFLOW_ATTEMPTS:
+            raise
+        delay = get_retry_delay(e, attempt)
+        logger.warning("Attempt {} was throttled, retrying in {} seconds: {}".format(attempt, delay, e))
+        return {"status": RETRY_STATUS, "retry_after_seconds": delay, "attempt": attempt + 1}
+
+
+def run_workflow_range(upload_part, part_range, attempt, results, context=None):
+    """
+    Run one attempt of a Map iteration of the upload workflow, uploading a range of parts in order.
+    The results of the parts uploaded before a throttled one are returned with the retry, so that the
+    next attempt resumes at the throttled part, and a lambda running out of time returns a retry
+    without delay to upload the rest of the range in a new invocation.
+    :param upload_part: function uploading the part of an index and returning its result
+    :param part_range: [start, stop] range of part indexes, stop excluded
+    :param attempt: number of the attempt of the first part not uploaded yet, from 1
+    :param results: results of the parts of the range uploaded by the previous attempts
+    :param context: lambda context, or None when the time left is not checked
+    :return: outcome of run_workflow_attempt, with the results of the range uploaded so far on a retry
+    """
+    start, stop = part_range
+    results = list(results)
+    first = start + len(results)
+    for index in range(first, stop):
+        if index > first and context and context.get_remaining_time_in_millis() < MIN_REMAINING_MILLIS:
+            logger.info("Stopping before part {} of range {}, the lambda is running out of time".format(index, part_range))
+            return {"status": RETRY_STATUS, "retry_after_seconds": 0, "attempt": 1, "results": results}
+        outcome = run_workflow_attempt(lambda: upload_part(index), attempt)
+        if outcome["status"] == RETRY_STATUS:
+            return dict(outcome, results=results)
+        results.append(outcome["result"])
+        attempt = 1
+    return {"status": UPLOADED_STATUS, "result": results}
@@ -0,0 +1,84 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Compare the throughput of the shared PII normalizer (etl_helpers) against
+#   the per-value normalization previously inlined in the Glue scripts.
+#
+# SAMPLE COMMAND-LINE USAGE:
+#
+#    python benchmarks/normalization_benchmark.py --rows 3000000
+#
+###############################################################################
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from etl_helpers.normalization import normalize_pii_columns
+
+PII_FIELDS = [
+    {"column_name": "email", "pii_type": "EMAIL"},
+    {"column_name": "phone_number", "pii_type": "PHONE"},
+    {"column_name": "mobile_advertiser_id", "pii_type": "MOBILE_AD_ID"},
+]
+
+
+def generate_records(rows, seed=0):
+    """Generate synthetic Clean Rooms output with a small share of non-ASCII values"""
+    rng = np.random.default_rng(seed)
+    ids = pd.Series(rng.integers(0, 10**9, size=rows)).astype(str)
+    area_codes = pd.Series(rng.integers(200, 999, size=rows)).astype(str)
+    df = pd.DataFrame({
+        "email": " User" + ids + "@Example.com ",
+        "phone_number": "+1 (" + area_codes + ") " + ids.str.zfill(9).str[:3] + "-" + ids.str.zfill(9).str[3:7],
+        "mobile_advertiser_id": ids.str.zfill(12).str.upper() + "-ABCD-EF01-2345-6789ABCDEF01",
+    })
+    # full-width digits exercise the NFKD path
+    non_ascii = rng.random(rows) < 0.01
+    df.loc[non_ascii, "phone_number"] = "０１" + df.loc[non_ascii, "phone_number"]
+    return df
+
+
+def legacy_normalize(df, pii_fields):
+    """Normalization as previously implemented in the Glue scripts"""
+    columns = [field["column_name"] for field in pii_fields]
+    df2 = df[columns].apply(lambda x: x.astype(str).str.normalize("NFKD").str.strip())
+    for field in pii_fields:
+        column_name = field["column_name"]
+        if field["pii_type"] == "PHONE":
+            df2[column_name] = df2[column_name].str.replace(r"[^0-9]+", "", regex=True).str.lstrip("0")
+        elif field["pii_type"] == "MOBILE_AD_ID":
+            df2[column_name] = df2[column_name].str.lower()
+    return df2
+
+
+def time_it(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PII normalization")
+    parser.add_argument("--rows", type=int, default=3000000)
+    args = parser.parse_args()
+
+    df = generate_records(args.rows)
+    legacy, legacy_seconds = time_it(legacy_normalize, df, PII_FIELDS)
+    (normalized, _), seconds = time_it(normalize_pii_columns, df, PII_FIELDS)
+
+    # the synthetic records are fully populated, so no rows are dropped
+    pd.testing.assert_frame_equal(legacy, pd.DataFrame(normalized), check_dtype=False)
+
+    print("rows: {}".format(args.rows))
+    print("legacy: {:.2f}s ({:,.0f} rows/sec)".format(legacy_seconds, args.rows / legacy_seconds))
+    print("etl_helpers: {:.2f}s ({:,.0f} rows/sec)".format(seconds, args.rows / seconds))
+    print("speedup: {:.2f}x".format(legacy_seconds / seconds))
+
+
+if __name__ == "__main__":
+    main()
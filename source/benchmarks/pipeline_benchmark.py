@@ -0,0 +1,294 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   End-to-end benchmark of the upload pipeline: generate a synthetic Clean
+#   Rooms output of configurable size, run the Glue transformation of each
+#   platform against an in-process S3 stand-in (moto), then upload the output
+#   manifests with the uploader handlers against the local mock partner API.
+#   Reports rows/sec, peak RSS and the latency and peak RSS of every stage, and
+#   compares them with the baselines saved for the same number of rows.
+#
+#   The peak RSS of a step is the high-water mark of the process at its end,
+#   so it only grows from one step to the next; the peak RSS of a stage is
+#   sampled while the stage runs (upload_engine.profiling).
+#
+# SAMPLE COMMAND-LINE USAGE:
+#
+#    PYTHONPATH=glue:aws_lambda:tests/aws_lambda python benchmarks/pipeline_benchmark.py --rows 1000000
+#    PYTHONPATH=glue:aws_lambda:tests/aws_lambda python benchmarks/pipeline_benchmark.py --rows 1000000 --save-baseline
+#
+###############################################################################
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import boto3
+import numpy as np
+import pandas as pd
+from moto import mock_cloudwatch, mock_s3, mock_secretsmanager
+
+from mock_partner_api import MockPartnerApi
+
+# configuration read by the lambda handlers when they are imported
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+os.environ.setdefault("SOLUTION_ID", "SO0226")
+os.environ.setdefault("SOLUTION_VERSION", "v1.0.0")
+os.environ.setdefault("REFRESH_SECRET_NAME", "benchmark-refresh")
+os.environ.setdefault("CRED_SECRET_NAME", "benchmark")
+os.environ.setdefault("MEMORY_PROFILE", "rss")
+# the moto S3 stand-in stores the aws-chunked uploads of recent botocore versions as is
+os.environ.setdefault("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+
+SOURCE_BUCKET = "benchmark-data"
+OUTPUT_BUCKET = "benchmark-output"
+SOURCE_KEY = "cleanrooms/benchmark.json"
+SEGMENT_NAME = "benchmark"
+SNAP_SEGMENT_ID = "1"
+PLATFORMS = ["snap", "tiktok"]
+PII_FIELDS = {
+    "snap": [
+        {"column_name": "e-mail", "pii_type": "EMAIL"},
+        {"column_name": "phone_number", "pii_type": "PHONE"},
+        {"column_name": "mobile_advertiser_id", "pii_type": "MOBILE_AD_ID"},
+    ],
+    "tiktok": [
+        {"column_name": "e-mail", "pii_type": "EMAIL"},
+        {"column_name": "phone_number", "pii_type": "PHONE"},
+        {"column_name": "mobile_advertiser_id", "pii_type": "IDFA"},
+    ],
+}
+DEFAULT_BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "pipeline_benchmark.json")
+
+
+def generate_records(rows, seed=0):
+    """Synthetic Clean Rooms output, with a small share of empty PII values"""
+    rng = np.random.default_rng(seed)
+    ids = pd.Series(rng.integers(0, 10**9, size=rows)).astype(str)
+    area_codes = pd.Series(rng.integers(200, 999, size=rows)).astype(str)
+    df = pd.DataFrame({
+        "age": rng.integers(18, 90, size=rows),
+        "e-mail": " User" + ids + "@Example.com ",
+        "phone_number": "+1 (" + area_codes + ") " + ids.str.zfill(9).str[:3] + "-" + ids.str.zfill(9).str[3:7],
+        "mobile_advertiser_id": ids.str.zfill(12).str.upper() + "-ABCD-EF01-2345-6789ABCDEF01",
+    })
+    df.loc[rng.random(rows) < 0.01, "phone_number"] = ""
+    return df
+
+
+def write_source(s3_client, rows, chunk_rows):
+    """
+    Write the synthetic input as JSON lines, generated chunk by chunk into a local file
+    so that its size is not bounded by memory
+    :return: size of the input in bytes
+    """
+    with tempfile.TemporaryFile() as f:
+        for start in range(0, rows, chunk_rows):
+            lines = generate_records(min(chunk_rows, rows - start), seed=start).to_json(orient="records", lines=True)
+            f.write(lines.encode())
+            if not lines.endswith("\n"):
+                f.write(b"\n")
+        size = f.tell()
+        f.seek(0)
+        s3_client.upload_fileobj(f, SOURCE_BUCKET, SOURCE_KEY)
+    return size
+
+
+def peak_rss_mb():
+    """High-water mark of the resident memory of the process"""
+    # kilobytes on Linux, bytes on macOS
+    scale = 1024**2 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def measurement(rows, seconds, stage_seconds, stage_peak_rss_bytes):
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds, 1) if seconds else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": {
+            name: {"seconds": round(seconds, 3), "peak_rss_mb": round((stage_peak_rss_bytes.get(name) or 0) / 1024**2, 1)}
+            for name, seconds in stage_seconds.items()
+        },
+    }
+
+
+def run_glue(platform, read_method="full"):
+    """Run the Glue transformation of a platform on the synthetic input"""
+    from etl_helpers.destinations import get_destination
+    from etl_helpers.pipeline import run_transformation
+
+    args = {
+        "JOB_NAME": "benchmark",
+        "JOB_RUN_ID": None,
+        "source_bucket": SOURCE_BUCKET,
+        "source_key": SOURCE_KEY,
+        "output_bucket": OUTPUT_BUCKET,
+        "segment_name": SEGMENT_NAME,
+        "pii_fields": PII_FIELDS[platform],
+        "memory_profile": os.environ["MEMORY_PROFILE"],
+        "read_method": read_method,
+    }
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_stats = run_transformation(get_destination(platform), args)
+    seconds = time.perf_counter() - start
+    return measurement(
+        run_stats.rows_read,
+        seconds,
+        {name: stage.seconds for name, stage in run_stats.stages.items()},
+        {name: stage.peak_rss_bytes for name, stage in run_stats.stages.items()},
+    )
+
+
+def record_engines(handler):
+    """Keep the upload engines created by a handler, to report the time spent in each of their stages"""
+    engines = []
+
+    class RecordingUploadEngine(handler.UploadEngine):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            engines.append(self)
+
+    handler.UploadEngine = RecordingUploadEngine
+    return engines
+
+
+def run_uploader(platform):
+    """Upload the manifest written by the Glue transformation of a platform"""
+    from etl_helpers.manifest import manifest_key
+
+    key = manifest_key(platform, SEGMENT_NAME, os.path.splitext(SOURCE_KEY)[0])
+    manifest = json.loads(boto3.client("s3").get_object(Bucket=OUTPUT_BUCKET, Key=key)["Body"].read())
+    if platform == "snap":
+        import snap.uploader.lambda_handler as handler
+
+        engines = record_engines(handler)
+        logging.getLogger().setLevel(logging.WARNING)
+        start = time.perf_counter()
+        handler.upload_manifest(OUTPUT_BUCKET, key, {"ad_account_id": "benchmark"}, {"access_token": "benchmark"})
+    else:
+        import tiktok.uploader.lambda_handler as handler
+
+        engines = record_engines(handler)
+        logging.getLogger().setLevel(logging.WARNING)
+        start = time.perf_counter()
+        handler.upload_manifest(OUTPUT_BUCKET, key)
+    seconds = time.perf_counter() - start
+    engine = engines[-1]
+    return measurement(
+        manifest["total_rows"],
+        seconds,
+        engine.stage_seconds,
+        {name: peaks.get("peak_rss_bytes") for name, peaks in engine.profiler.peaks.items()},
+    )
+
+
+def print_results(results):
+    print("{:<14} {:>12} {:>10} {:>14} {:>10}  {}".format("step", "rows", "seconds", "rows/sec", "rss MB", "stages (seconds/rss MB)"))
+    for name, result in results.items():
+        stages = " ".join(
+            "{}={}/{}".format(stage, measures["seconds"], measures["peak_rss_mb"]) for stage, measures in result["stages"].items())
+        print("{:<14} {:>12,} {:>10.2f} {:>14,.0f} {:>10.1f}  {}".format(
+            name, result["rows"], result["seconds"], result["rows_per_second"], result["peak_rss_mb"], stages))
+
+
+def check_baseline(results, baseline, tolerance):
+    """
+    Compare the results with the baseline of the same number of rows
+    :param tolerance: share of throughput that can be lost, or of peak RSS gained, before a step regresses
+    :return: list of regressions
+    """
+    regressions = []
+    for name, expected in baseline.items():
+        if name not in results:
+            continue
+        result = results[name]
+        if result["rows_per_second"] < expected["rows_per_second"] * (1 - tolerance):
+            regressions.append("{}: {:,.0f} rows/sec, baseline {:,.0f}".format(name, result["rows_per_second"], expected["rows_per_second"]))
+        if result["peak_rss_mb"] > expected["peak_rss_mb"] * (1 + tolerance):
+            regressions.append("{}: peak RSS {:.1f} MB, baseline {:.1f} MB".format(name, result["peak_rss_mb"], expected["peak_rss_mb"]))
+    return regressions
+
+
+def run(args):
+    s3_client = boto3.client("s3")
+    s3_client.create_bucket(Bucket=SOURCE_BUCKET)
+    s3_client.create_bucket(Bucket=OUTPUT_BUCKET)
+    boto3.client("secretsmanager").create_secret(
+        Name=os.environ["CRED_SECRET_NAME"],
+        SecretString=json.dumps({"ACCESS_TOKEN": "benchmark", "ADVERTISER_ID": "benchmark"}),
+    )
+
+    start = time.perf_counter()
+    size = write_source(s3_client, args.rows, args.chunk_rows)
+    print("input: {:,} rows, {:,} bytes, generated in {:.2f}s".format(args.rows, size, time.perf_counter() - start))
+
+    results = {}
+    for platform in args.platforms:
+        results["glue." + platform] = run_glue(platform, args.read_method)
+    with MockPartnerApi(latency=args.api_latency, segments={SEGMENT_NAME: SNAP_SEGMENT_ID}) as api:
+        os.environ["SNAP_API_URL"] = api.url
+        os.environ["TIKTOK_API_URL"] = api.url
+        for platform in args.platforms:
+            results["upload." + platform] = run_uploader(platform)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Glue transformations and the uploaders end to end")
+    parser.add_argument("--rows", type=int, default=100000, help="rows of the synthetic Clean Rooms output")
+    parser.add_argument("--chunk-rows", type=int, default=1000000, help="rows generated at a time")
+    parser.add_argument("--platforms", nargs="+", choices=PLATFORMS, default=PLATFORMS)
+    parser.add_argument("--api-latency", type=float, default=0.05, help="seconds per partner API request")
+    parser.add_argument("--workers", type=int, default=4, help="MAX_UPLOAD_WORKERS of the uploaders")
+    parser.add_argument("--baselines", default=DEFAULT_BASELINES, help="JSON file of the baselines")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the baseline of --rows")
+    parser.add_argument("--read-method", choices=["full", "select"], default="full",
+                        help="read method of the Glue transformations, the S3 stand-in falls back to full reads")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against the baseline")
+    args = parser.parse_args()
+
+    # read by the uploader handlers when they are imported
+    os.environ["MAX_UPLOAD_WORKERS"] = str(args.workers)
+
+    with mock_s3(), mock_secretsmanager(), mock_cloudwatch():
+        results = run(args)
+    print_results(results)
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines[str(args.rows)] = results
+        os.makedirs(os.path.dirname(args.baselines), exist_ok=True)
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print("Saved the baseline of {:,} rows to {}".format(args.rows, args.baselines))
+    elif str(args.rows) in baselines:
+        regressions = check_baseline(results, baselines[str(args.rows)], args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+        print("No regression against the baseline of {:,} rows".format(args.rows))
+    else:
+        print("No baseline of {:,} rows in {}".format(args.rows, args.baselines))
+
+
+if __name__ == "__main__":
+    main()
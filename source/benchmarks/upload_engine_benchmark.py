@@ -0,0 +1,191 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Compare the throughput of the upload engine against the previous manifest
+#   upload of the uploader lambdas, which read, decoded and uploaded each part
+#   in turn on a pool of threads. The partner APIs are replaced by the local
+#   mock partner API answering after a fixed latency, and the S3 reads by an
+#   in-memory store with its own latency.
+#
+# SAMPLE COMMAND-LINE USAGE:
+#
+#    PYTHONPATH=aws_lambda:tests/aws_lambda python benchmarks/upload_engine_benchmark.py --parts 16 --rows 30000
+#
+###############################################################################
+
+import argparse
+import gzip
+import hashlib
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from mock_partner_api import MockPartnerApi
+
+# configuration read by the lambda handlers when they are imported
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("SOLUTION_ID", "SO0226")
+os.environ.setdefault("SOLUTION_VERSION", "v1.0.0")
+os.environ.setdefault("REFRESH_SECRET_NAME", "benchmark")
+os.environ.setdefault("CRED_SECRET_NAME", "benchmark")
+os.environ["CHECKPOINT_STORE"] = "memory"
+
+SNAP_SCHEMAS = ["EMAIL_SHA256", "PHONE_SHA256", "MOBILE_AD_ID_SHA256"]
+
+
+def random_hashes(rng, rows):
+    return ["{:064x}".format(value) for value in rng.integers(0, 2**62, size=rows)]
+
+
+def generate_parts(platform, parts, rows, seed=0):
+    """Synthetic Glue output parts and their manifest entries"""
+    rng = np.random.default_rng(seed)
+    objects = {}
+    entries = []
+    for i in range(parts):
+        if platform == "snap":
+            key = "output/snap/benchmark/benchmark{}.csv.gz".format(i)
+            # the Glue job writes the schemas column by column, so a part usually holds several
+            lines = [SNAP_SCHEMAS[j * len(SNAP_SCHEMAS) // rows] + "," + h + "\n" for j, h in enumerate(random_hashes(rng, rows))]
+            body = gzip.compress(("schema,hash\n" + "".join(lines)).encode())
+        else:
+            key = "output/tiktok/benchmark/email_sha256/benchmark{}.csv".format(i)
+            body = "".join(h + "\n" for h in random_hashes(rng, rows)).encode()
+        objects[key] = body
+        entries.append({"key": key, "rows": rows, "bytes": len(body), "md5": hashlib.md5(body).hexdigest()})
+    return objects, entries
+
+
+class MemoryS3:
+    """In-memory stand-in for the S3 reads of the lambda handlers"""
+
+    def __init__(self, objects, latency):
+        self.objects = objects
+        self.latency = latency
+        self.tags = {}
+        # the client of the S3 resource of the TikTok handler
+        self.meta = self
+        self.client = self
+
+    def read(self, key):
+        time.sleep(self.latency)
+        return self.objects[key]
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.read(Key))}
+
+    def get_object_tagging(self, Bucket, Key):
+        return {"TagSet": self.tags.get(Key, [])}
+
+    def put_object_tagging(self, Bucket, Key, Tagging):
+        self.tags[Key] = Tagging["TagSet"]
+
+    def Object(self, bucket_name, key):
+        read = self.read
+
+        class _Object:
+            def get(self):
+                return {"Body": io.BytesIO(read(key))}
+
+        return _Object()
+
+
+def legacy_snap_upload(handler, bucket_name, parts, workers):
+    """Manifest upload of the Snap handler before the upload engine"""
+
+    def upload_part(part):
+        body = handler.read_part(bucket_name, part)
+        with gzip.GzipFile(fileobj=io.BytesIO(body), mode="rb") as f:
+            _, users_uploaded = handler.add_part_users(f, "benchmark", 1, "benchmark", part["key"])
+        return users_uploaded
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(upload_part, parts))
+
+
+def legacy_tiktok_upload(handler, bucket_name, parts, workers):
+    """Manifest upload of the TikTok handler before the upload engine, without its copy through /tmp"""
+    credentials = {"ACCESS_TOKEN": "benchmark", "ADVERTISER_ID": "benchmark"}
+
+    def upload_part(part):
+        body = handler.read_part(bucket_name, part)
+        file_name, calculate_type, _ = handler.get_upload_audience_info(part["key"])
+        resp = handler.upload_custom_audience_file(file_name, body, calculate_type, credentials)
+        return handler.check_response(resp, "benchmark")["data"]["file_path"]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(upload_part, parts))
+
+
+def engine_upload(handler, destination, bucket_name, parts, workers):
+    engine = handler.UploadEngine(destination, max_parts=2 * workers, max_requests=workers)
+    return engine.upload_parts(bucket_name, parts)
+
+
+def time_it(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def report(platform, label, rows, seconds):
+    print("{} {}: {:.2f}s ({:,.0f} rows/sec)".format(platform, label, seconds, rows / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the uploader lambdas against a local mock partner API")
+    parser.add_argument("--parts", type=int, default=16)
+    parser.add_argument("--rows", type=int, default=30000, help="rows per part")
+    parser.add_argument("--api-latency", type=float, default=0.2, help="seconds per partner API request")
+    parser.add_argument("--s3-latency", type=float, default=0.1, help="seconds per S3 read")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--snap-batch", type=int, default=10000, help="users per Snap request")
+    args = parser.parse_args()
+
+    api = MockPartnerApi(latency=args.api_latency)
+    url = api.start()
+    os.environ["SNAP_API_URL"] = url
+    os.environ["TIKTOK_API_URL"] = url
+
+    # imported once the mock API is configured
+    import snap.uploader.lambda_handler as snap_handler
+    import tiktok.uploader.lambda_handler as tiktok_handler
+    logging.getLogger().setLevel(logging.WARNING)
+
+    snap_handler.USERS_PER_REQUEST = args.snap_batch
+    rows = args.parts * args.rows
+    bucket_name = "benchmark"
+    print("parts: {} rows: {} api latency: {}s s3 latency: {}s workers: {}".format(
+        args.parts, rows, args.api_latency, args.s3_latency, args.workers))
+
+    objects, parts = generate_parts("snap", args.parts, args.rows)
+    snap_handler.s3_client = MemoryS3(objects, args.s3_latency)
+    snap_handler.MemoryCheckpoint.store.clear()
+    legacy_seconds = time_it(legacy_snap_upload, snap_handler, bucket_name, parts, args.workers)
+    snap_handler.MemoryCheckpoint.store.clear()
+    destination = snap_handler.SnapDestination(bucket_name, "benchmark", 1, "benchmark")
+    seconds = time_it(engine_upload, snap_handler, destination, bucket_name, parts, args.workers)
+    report("snap", "legacy", rows, legacy_seconds)
+    report("snap", "upload engine", rows, seconds)
+    print("snap speedup: {:.2f}x".format(legacy_seconds / seconds))
+
+    objects, parts = generate_parts("tiktok", args.parts, args.rows)
+    tiktok_handler.s3_resource = MemoryS3(objects, args.s3_latency)
+    legacy_seconds = time_it(legacy_tiktok_upload, tiktok_handler, bucket_name, parts, args.workers)
+    destination = tiktok_handler.TikTokDestination({"ACCESS_TOKEN": "benchmark", "ADVERTISER_ID": "benchmark"}, "benchmark")
+    seconds = time_it(engine_upload, tiktok_handler, destination, bucket_name, parts, args.workers)
+    report("tiktok", "legacy", rows, legacy_seconds)
+    report("tiktok", "upload engine", rows, seconds)
+    print("tiktok speedup: {:.2f}x".format(legacy_seconds / seconds))
+
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Decompression of gzip, bzip2 and zstd Clean Rooms outputs. A compressed
+#   object is downloaded as is, then its members (gzip), streams (bzip2) or
+#   frames (zstd) are decompressed in parallel: every offset where a member
+#   header appears is decompressed speculatively by a pool of threads, and the
+#   members are chained from the start of the object, each one ending where
+#   the next one starts. Headers found inside the compressed data of a member
+#   are false starts whose output is never used. A single-member object is
+#   decompressed by a single thread.
+###############################################################################
+
+import bisect
+import bz2
+import io
+import itertools
+import re
+import struct
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# members decompressed at the same time, zlib, bz2 and zstandard release the GIL while decompressing
+MAX_DECOMPRESS_WORKERS = 4
+# skippable zstd frames, e.g. the frame index written by pzstd, are not decompressed
+ZSTD_SKIPPABLE_MAGIC_MASK = 0xFFFFFFF0
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A50
+
+Codec = namedtuple("Codec", ["name", "extensions", "magic", "member_pattern", "decompressor"])
+
+
+def zstd_decompressor():
+    # not in the Glue runtime, installed with the --additional-python-modules of the job
+    import zstandard
+
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+CODECS = [
+    # deflate members, the reserved flag bits are always 0
+    Codec("gzip", (".gz", ".gzip"), b"\x1f\x8b", re.compile(rb"\x1f\x8b\x08[\x00-\x1f]"), lambda: zlib.decompressobj(31)),
+    # stream header followed by the magic of its first block
+    Codec("bzip2", (".bz2",), b"BZh", re.compile(rb"BZh[1-9]1AY&SY"), bz2.BZ2Decompressor),
+    Codec("zstd", (".zst", ".zstd"), b"\x28\xb5\x2f\xfd", re.compile(rb"\x28\xb5\x2f\xfd"), zstd_decompressor),
+]
+
+
+def get_codec(key):
+    """
+    Get the codec of an object from the extension of its key
+    :return: Codec, or None when the object is not compressed
+    """
+    lower_key = key.lower()
+    return next((codec for codec in CODECS if lower_key.endswith(codec.extensions)), None)
+
+
+def strip_codec_extension(key):
+    """Key of a compressed object without its compression extension, e.g. data.json for data.json.gz"""
+    codec = get_codec(key)
+    if not codec:
+        return key
+    return next(key[:-len(extension)] for extension in codec.extensions if key.lower().endswith(extension))
+
+
+def decompress_member(codec, data, start, boundaries):
+    """
+    Decompress the member starting at an offset
+    :param data: memoryview of the compressed object
+    :param boundaries: sorted offsets where a member may start, the data is fed up to each one after start in turn
+        so that the decompressor never copies the rest of the object
+    :return: decompressed bytes and offset of the end of the member, or None when no member starts at the offset
+    """
+    decompressor = codec.decompressor()
+    chunks = []
+    position = start
+    ends = (boundaries[i] for i in range(bisect.bisect_right(boundaries, start), len(boundaries)))
+    try:
+        for end in itertools.chain(ends, [len(data)]):
+            chunks.append(decompressor.decompress(data[position:end]))
+            position = end
+            if decompressor.eof:
+                return b"".join(chunks), end - len(decompressor.unused_data)
+    except Exception:
+        # the errors of a false start depend on the codec: zlib.error, OSError, EOFError, zstandard.ZstdError
+        pass
+    return None
+
+
+def skip_frame(codec, data, offset):
+    """:return: offset after the skippable zstd frame at an offset, or the offset when there is none"""
+    if codec.name != "zstd" or len(data) - offset < 8:
+        return offset
+    magic, size = struct.unpack_from("<II", data, offset)
+    if magic & ZSTD_SKIPPABLE_MAGIC_MASK != ZSTD_SKIPPABLE_MAGIC:
+        return offset
+    return offset + 8 + size
+
+
+def decompress(codec, data, max_workers=MAX_DECOMPRESS_WORKERS):
+    """
+    Decompress a gzip, bzip2 or zstd object, its members decompressed in parallel
+    :param data: bytes of the compressed object
+    :return: decompressed bytes
+    """
+    if bytes(data[:len(codec.magic)]) != codec.magic:
+        raise ValueError("ERROR : the input is not {} compressed".format(codec.name))
+    # fails here rather than on every member when the codec library is missing
+    codec.decompressor()
+    data = memoryview(data)
+    starts = [match.start() for match in codec.member_pattern.finditer(data)]
+    with ThreadPoolExecutor(max_workers=max(min(len(starts), max_workers), 1)) as executor:
+        members = dict(zip(starts, executor.map(lambda start: decompress_member(codec, data, start, starts), starts)))
+    outputs = []
+    offset = 0
+    while offset < len(data):
+        offset = skip_frame(codec, data, offset)
+        if offset >= len(data):
+            break
+        member = members.get(offset)
+        if member is None and not any(data[offset:]):
+            # zero padding after the last member
+            break
+        if member is None:
+            # a member whose header the pattern does not match, decompressed on its own
+            member = decompress_member(codec, data, offset, [])
+        if member is None:
+            raise ValueError("ERROR : the {} input is corrupt or truncated at byte {}".format(codec.name, offset))
+        output, offset = member
+        outputs.append(output)
+    return b"".join(outputs)
+
+
+def read_compressed_object(s3_client, bucket, key, codec):
+    """
+    Download and decompress an object, the download is split in parallel ranged GETs by the transfer manager
+    :return: decompressed bytes
+    """
+    body = io.BytesIO()
+    s3_client.download_fileobj(Bucket=bucket, Key=key, Fileobj=body)
+    return decompress(codec, body.getbuffer())
@@ -0,0 +1,115 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Target platforms of the Glue transformation jobs. Each destination declares
+#   the PII types its API accepts and the limits of its upload API, and renders
+#   the hashed columns into the output parts read by its uploader lambda. The
+#   reading, normalization, hashing, statistics and manifest are shared by
+#   every destination (see etl_helpers.pipeline).
+###############################################################################
+
+import gzip
+import math
+from abc import ABC, abstractmethod
+
+from etl_helpers.output import count_hash_list_parts, count_parts, iter_hash_list_csv, iter_long_format_csv
+
+
+class Destination(ABC):
+    """A platform the audiences are uploaded to"""
+
+    # name of the platform in the output prefix, e.g. snap
+    platform = None
+    # PII types of the pii_fields job parameter the platform accepts
+    pii_types = ()
+    # how the uploader sends the audience: "users" in batches of hashed users, or one "file" per part
+    upload_method = None
+
+    def output_prefix(self, segment_name):
+        """S3 prefix of the output parts of a segment"""
+        return "output/" + self.platform + "/" + segment_name + "/"
+
+    def validate_pii_fields(self, pii_fields):
+        """
+        Fail before reading the input when a PII type cannot be uploaded to the platform. Several columns
+        may share a PII type, but a column is normalized once and can only be listed once.
+        """
+        column_names = [field["column_name"] for field in pii_fields]
+        for column_name in set(column_names):
+            if column_names.count(column_name) > 1:
+                raise ValueError("ERROR : column {} is listed more than once in pii_fields".format(column_name))
+        for field in pii_fields:
+            if field["pii_type"] not in self.pii_types:
+                raise ValueError(
+                    "ERROR : PII type {} of column {} is not supported by {}, the type must be one of {}".format(
+                        field["pii_type"], field["column_name"], self.platform, list(self.pii_types)
+                    )
+                )
+
+    @abstractmethod
+    def iter_parts(self, hashed_columns, segment_name, output_key):
+        """
+        Render the hashed columns into output parts
+        :param hashed_columns: dict of output schema (e.g. EMAIL_SHA256) to Series of SHA-256 hex digests
+        :param segment_name: name of the segment/audience
+        :param output_key: source key without its extension
+        :return: generator of (S3 key, body, rows, schema) tuples, schema is None when a part mixes schemas
+        """
+
+
+class SnapDestination(Destination):
+    """Gzipped (schema, hash) CSV parts of at most one Snap add users request each"""
+
+    platform = "snap"
+    pii_types = ("EMAIL", "PHONE", "MOBILE_AD_ID")
+    upload_method = "users"
+    # Snap accepts at most 100,000 identifiers per add users request
+    max_part_rows = 100000
+
+    def iter_parts(self, hashed_columns, segment_name, output_key):
+        columns = {schema: values.tolist() for schema, values in hashed_columns.items()}
+        num_parts = count_parts(columns, self.max_part_rows)
+        num_file_digits = int(math.log10(max(num_parts, 1))) + 1
+        prefix = self.output_prefix(segment_name)
+        for i, part in enumerate(iter_long_format_csv(columns, self.max_part_rows)):
+            key = prefix + output_key + str(i + 1).zfill(num_file_digits) + ".csv.gz"
+            yield key, gzip.compress(part.encode()), part.count("\n") - 1, None
+
+
+class TikTokDestination(Destination):
+    """One folder per PII type, one hash per line, in parts below the TikTok file size limit"""
+
+    platform = "tiktok"
+    pii_types = ("EMAIL", "PHONE", "IDFA", "GAID")
+    upload_method = "file"
+    max_part_bytes = 50 * 1024**2  # 50 MB
+
+    def iter_parts(self, hashed_columns, segment_name, output_key):
+        prefix = self.output_prefix(segment_name)
+        for schema, values in hashed_columns.items():
+            if values.empty:
+                print("Skipping " + schema + ": no values to upload")
+                continue
+            values = values.tolist()
+            num_parts = count_hash_list_parts(len(values), self.max_part_bytes)
+            num_file_digits = int(math.log10(num_parts)) + 1
+            for i, part in enumerate(iter_hash_list_csv(values, self.max_part_bytes)):
+                suffix = str(i + 1).zfill(num_file_digits) if num_parts > 1 else ""
+                key = prefix + schema.lower() + "/" + output_key + suffix + ".csv"
+                yield key, part.encode(), part.count("\n"), schema
+
+
+DESTINATIONS = {destination.platform: destination for destination in (SnapDestination, TikTokDestination)}
+
+
+def get_destination(platform):
+    """
+    Get the destination of a platform
+    :param platform: name of the platform, e.g. snap
+    :return: Destination instance
+    """
+    if platform not in DESTINATIONS:
+        raise ValueError("ERROR : platform {} is not in supported platforms {}".format(platform, list(DESTINATIONS)))
+    return DESTINATIONS[platform]()
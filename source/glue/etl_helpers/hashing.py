@@ -0,0 +1,87 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   SHA-256 hashing of normalized PII columns, with a passthrough for columns
+#   that already hold SHA-256 hex digests (pii_fields entries with
+#   "pre_hashed": true).
+###############################################################################
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from etl_helpers.normalization import VECTORIZED_CHUNK_ROWS, is_pre_hashed
+
+SHA256_HEX_LENGTH = 64
+ZERO, NINE, LOWER_A, LOWER_F = ord("0"), ord("9"), ord("a"), ord("f")
+
+
+def _is_sha256_hex_chunk(array):
+    width = array.dtype.itemsize // 4
+    if width < SHA256_HEX_LENGTH:
+        return np.zeros(len(array), dtype=bool)
+    codes = array.view(np.uint32).reshape(len(array), width)[:, :SHA256_HEX_LENGTH]
+    hex_digits = ((codes >= ZERO) & (codes <= NINE)) | ((codes >= LOWER_A) & (codes <= LOWER_F))
+    return hex_digits.all(axis=1) & (np.char.str_len(array) == SHA256_HEX_LENGTH)
+
+
+def is_sha256_hex(values):
+    """
+    Vectorized check that values are lowercase 64 character hex digests
+    :param values: pandas Series of strings
+    :return: numpy boolean array, True where the value is a SHA-256 hex digest
+    """
+    raw = values.to_numpy()
+    chunks = [np.zeros(0, dtype=bool)]
+    for start in range(0, len(raw), VECTORIZED_CHUNK_ROWS):
+        chunks.append(_is_sha256_hex_chunk(np.asarray(raw[start:start + VECTORIZED_CHUNK_ROWS], dtype=str)))
+    return np.concatenate(chunks)
+
+
+def sha256_hex(values):
+    """
+    Hash every value of a column
+    :param values: pandas Series of normalized strings
+    :return: pandas Series of SHA-256 hex digests, with the same index
+    """
+    sha256 = hashlib.sha256
+    digests = [sha256(value.encode()).hexdigest() for value in values.to_numpy()]
+    return pd.Series(digests, index=values.index, dtype=object)
+
+
+def validate_pre_hashed(values, column_name):
+    """
+    Pass a pre-hashed column through, failing if any value is not a SHA-256 hex digest
+    so that raw identifiers are never uploaded as if they were hashes
+    """
+    invalid_count = int((~is_sha256_hex(values)).sum())
+    if invalid_count:
+        raise ValueError(
+            "ERROR : column {} is flagged as pre_hashed but {} values are not SHA-256 hex digests".format(column_name, invalid_count)
+        )
+    return values
+
+
+def hash_pii_columns(pii_columns, pii_fields):
+    """
+    Hash the normalized PII columns, passing pre-hashed columns straight through
+    :param pii_columns: dict of column name to normalized Series
+    :param pii_fields: list of {"column_name": ..., "pii_type": ..., "pre_hashed": ...} dicts
+    :return: dict of output schema (e.g. EMAIL_SHA256) to Series of SHA-256 hex digests, the digests of
+        several columns of the same PII type are concatenated in the order of pii_fields
+    """
+    hashed_columns = {}
+    for field in pii_fields:
+        column_name = field["column_name"]
+        if is_pre_hashed(field):
+            hashed = validate_pre_hashed(pii_columns[column_name], column_name)
+        else:
+            hashed = sha256_hex(pii_columns[column_name])
+        schema = field["pii_type"] + "_SHA256"
+        if schema in hashed_columns:
+            hashed = pd.concat([hashed_columns[schema], hashed], ignore_index=True)
+        hashed_columns[schema] = hashed
+    return hashed_columns
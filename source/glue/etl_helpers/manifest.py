@@ -0,0 +1,77 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Completion manifest written by the Glue transformation jobs after the last
+#   output part. The manifest lists every part of the audience with its row
+#   count and MD5 checksum, and is the object whose creation triggers the
+#   uploader lambdas, so an audience is uploaded once, and only when complete.
+###############################################################################
+
+import hashlib
+import json
+from datetime import datetime, timezone
+
+MANIFEST_SUFFIX = "_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def md5_hex(body):
+    """MD5 checksum of a part, also used by TikTok as the file signature"""
+    return hashlib.md5(body).hexdigest()  # nosec # NOSONAR checksum only, not used for security
+
+
+def manifest_key(platform, segment_name, output_key):
+    """
+    S3 key of the manifest of one job run
+    :param platform: target platform, e.g. snap
+    :param segment_name: name of the segment/audience
+    :param output_key: source key without its extension
+    """
+    return "output/" + platform + "/" + segment_name + "/" + output_key + MANIFEST_SUFFIX
+
+
+def build_manifest(run_stats, bucket):
+    """
+    Build the manifest document from the parts recorded in the run statistics
+    :param run_stats: RunStatistics of the job run
+    :param bucket: output bucket the parts were written to
+    :return: manifest as a dict
+    """
+    prefix = "s3://" + bucket + "/"
+    parts = []
+    for part in run_stats.parts:
+        entry = {
+            "key": part["path"][len(prefix):] if part["path"].startswith(prefix) else part["path"],
+            "rows": part["rows"],
+            "bytes": part["bytes"],
+            "md5": part["md5"],
+        }
+        if part["schema"]:
+            entry["schema"] = part["schema"]
+        parts.append(entry)
+    return {
+        "version": MANIFEST_VERSION,
+        "platform": run_stats.platform,
+        "segment_name": run_stats.segment_name,
+        "source": run_stats.source,
+        "job_run_id": run_stats.job_run_id,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "bucket": bucket,
+        "total_rows": sum(part["rows"] for part in parts),
+        "parts": parts,
+    }
+
+
+def write_manifest(run_stats, s3_client, bucket, key):
+    """
+    Write the manifest. This must be the last object the job writes under output/
+    since it starts the upload of the audience.
+    """
+    manifest = build_manifest(run_stats, bucket)
+    s3_client.put_object(
+        Bucket=bucket, Key=key, Body=json.dumps(manifest, separators=(",", ":")).encode(), ContentType="application/json"
+    )
+    print("Wrote manifest s3://" + bucket + "/" + key + " with " + str(len(manifest["parts"])) + " parts")
+    return manifest
@@ -0,0 +1,161 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Table-driven PII normalization shared by the Glue transformation jobs.
+#   Each PII type maps to an ordered list of vectorized rules that are applied
+#   to one column at a time. Regular expressions are compiled once at import.
+###############################################################################
+
+import re
+
+import numpy as np
+import pandas as pd
+
+NON_DIGIT_PATTERN = re.compile(r"[^0-9]+")
+# values wider than this are normalized with the regex fallback rather than a code point matrix
+MAX_VECTORIZED_WIDTH = 32
+VECTORIZED_CHUNK_ROWS = 1000000
+ZERO, NINE = ord("0"), ord("9")
+
+
+def unicode_normalize(values):
+    """Apply NFKD normalization, only to the values that contain non-ASCII characters"""
+    non_ascii = ~np.fromiter((value.isascii() for value in values.to_numpy()), dtype=bool, count=len(values))
+    if not non_ascii.any():
+        return values
+    values = values.copy()
+    values[non_ascii] = values[non_ascii].str.normalize("NFKD")
+    return values
+
+
+def strip_whitespace(values):
+    return values.str.strip()
+
+
+def _phone_digits_chunk(array):
+    """Keep the ASCII digits of each value, dropping leading zeros, using a code point matrix"""
+    width = array.dtype.itemsize // 4
+    codes = array.view(np.uint32).reshape(len(array), width)
+    digits = (codes >= ZERO) & (codes <= NINE)
+    significant = np.cumsum(digits & (codes != ZERO), axis=1, dtype=np.uint8) > 0
+    keep = digits & significant
+    rows, columns = np.nonzero(keep)
+    positions = np.cumsum(keep, axis=1, dtype=np.uint8)[rows, columns] - 1
+    result = np.zeros_like(codes)
+    result[rows, positions] = codes[rows, columns]
+    return result.reshape(-1).view(array.dtype)
+
+
+def phone_digits(values):
+    """Equivalent to removing [^0-9]+ and then leading zeros"""
+    raw = values.to_numpy()
+    chunks = []
+    for start in range(0, len(raw), VECTORIZED_CHUNK_ROWS):
+        chunk = np.asarray(raw[start:start + VECTORIZED_CHUNK_ROWS], dtype=str)
+        if chunk.dtype.itemsize // 4 > MAX_VECTORIZED_WIDTH:
+            chunks.append(np.asarray([NON_DIGIT_PATTERN.sub("", value).lstrip("0") for value in chunk], dtype=object))
+        else:
+            chunks.append(_phone_digits_chunk(chunk).astype(object))
+    if not chunks:
+        return values
+    return pd.Series(np.concatenate(chunks), index=values.index, dtype=values.dtype)
+
+
+def lowercase(values):
+    return values.str.lower()
+
+
+MOBILE_ID_RULES = (unicode_normalize, strip_whitespace, lowercase)
+
+NORMALIZATION_RULES = {
+    "PHONE": (unicode_normalize, phone_digits),
+    "EMAIL": (unicode_normalize, strip_whitespace),
+    "MOBILE_AD_ID": MOBILE_ID_RULES,
+    "GAID": MOBILE_ID_RULES,
+    "IDFA": MOBILE_ID_RULES,
+}
+
+# columns that already hold SHA-256 hex digests are only trimmed and lowercased
+PRE_HASHED_RULES = (strip_whitespace, lowercase)
+
+
+def is_pre_hashed(field):
+    """Whether a pii_fields entry is flagged as already holding SHA-256 hex digests"""
+    return str(field.get("pre_hashed", False)).lower() == "true"
+
+
+def get_normalization_rules(pii_type, pre_hashed=False):
+    """
+    Get the normalization rules for a PII type
+    :param pii_type: PII type of the column (e.g. PHONE, EMAIL)
+    :param pre_hashed: whether the column already holds SHA-256 hex digests
+    :return: ordered tuple of rules to apply to the column
+    """
+    if pii_type not in NORMALIZATION_RULES:
+        raise ValueError(
+            "ERROR : PII type {} is not in supported types {}".format(pii_type, list(NORMALIZATION_RULES))
+        )
+    if pre_hashed:
+        return PRE_HASHED_RULES
+    return NORMALIZATION_RULES[pii_type]
+
+
+def to_strings(values):
+    """
+    Cast a column to strings. Integral floats are formatted as integers: a numeric column
+    with a null is read as float64, and 15551234567.0 must not become the digits 155512345670.
+    """
+    if not pd.api.types.is_float_dtype(values):
+        return values.astype(str)
+    raw = values.to_numpy()
+    with np.errstate(invalid="ignore"):
+        integral = np.isfinite(raw) & (np.mod(raw, 1) == 0)
+    strings = values.astype(str)
+    strings[integral] = raw[integral].astype(np.int64).astype(str)
+    return strings
+
+
+def normalize_column(values, pii_type, pre_hashed=False):
+    """
+    Normalize a single column of PII values
+    :param values: pandas Series holding the raw column values
+    :param pii_type: PII type of the column
+    :param pre_hashed: whether the column already holds SHA-256 hex digests
+    :return: pandas Series of normalized strings
+    """
+    rules = get_normalization_rules(pii_type, pre_hashed)
+    values = to_strings(values)
+    for rule in rules:
+        values = rule(values)
+    return values
+
+
+def drop_empty_values(values, pii_type, pre_hashed=False):
+    """
+    Normalize a column, dropping missing values before normalization and values
+    that are empty once normalized (e.g. a phone number without any digit)
+    :param values: pandas Series holding the raw column values
+    :param pii_type: PII type of the column
+    :param pre_hashed: whether the column already holds SHA-256 hex digests
+    :return: pandas Series of the non-empty normalized strings
+    """
+    values = normalize_column(values.dropna(), pii_type, pre_hashed)
+    return values[values != ""]
+
+
+def normalize_pii_columns(df, pii_fields):
+    """
+    Normalize every PII column of a DataFrame, each one keeping only its populated rows
+    :param df: input DataFrame
+    :param pii_fields: list of {"column_name": ..., "pii_type": ..., "pre_hashed": ...} dicts
+    :return: tuple of (dict of column name to normalized Series, dict of column name to number of dropped values)
+    """
+    columns = {}
+    dropped_counts = {}
+    for field in pii_fields:
+        column_name = field["column_name"]
+        columns[column_name] = drop_empty_values(df[column_name], field["pii_type"], is_pre_hashed(field))
+        dropped_counts[column_name] = len(df) - len(columns[column_name])
+    return columns, dropped_counts
@@ -0,0 +1,82 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Output writers shared by the Glue transformation jobs.
+###############################################################################
+
+import math
+
+LONG_FORMAT_HEADER = "schema,hash\n"
+# 64 hex characters and a newline
+HASH_LINE_BYTES = 65
+
+
+def _long_format_lines(schema, values):
+    """Render one (schema, hash) CSV line per value with a single string join"""
+    prefix = schema + ","
+    return prefix + ("\n" + prefix).join(values) + "\n"
+
+
+def count_parts(columns, part_rows):
+    """
+    Number of parts needed to write every value of every column
+    :param columns: dict of schema name to hashed values
+    :param part_rows: maximum number of rows per part
+    """
+    return math.ceil(sum(len(values) for values in columns.values()) / part_rows)
+
+
+def iter_long_format_csv(columns, part_rows):
+    """
+    Emit the long (schema, hash) CSV format directly from per-column arrays, without
+    materializing a melted DataFrame. Rows are ordered column by column, like DataFrame.melt().
+    :param columns: dict of schema name (e.g. EMAIL_SHA256) to a sequence of hashed values
+    :param part_rows: maximum number of rows per part
+    :return: generator of CSV documents, each with a header and at most part_rows rows
+    """
+    lines = []
+    part_size = 0
+    for schema, values in columns.items():
+        start = 0
+        while start < len(values):
+            end = start + min(part_rows - part_size, len(values) - start)
+            lines.append(_long_format_lines(schema, values[start:end]))
+            part_size += end - start
+            start = end
+            if part_size == part_rows:
+                yield LONG_FORMAT_HEADER + "".join(lines)
+                lines = []
+                part_size = 0
+    if part_size:
+        yield LONG_FORMAT_HEADER + "".join(lines)
+
+
+def count_hash_list_parts(rows, max_bytes):
+    """
+    Number of parts needed to keep every hash list file below max_bytes
+    :param rows: number of hashes to write
+    :param max_bytes: maximum size of a part
+    """
+    if not rows:
+        return 0
+    return max(math.ceil(rows * HASH_LINE_BYTES / max_bytes), 1)
+
+
+def iter_hash_list_csv(values, max_bytes):
+    """
+    Emit one hash per line, without header, split evenly into the fewest parts below max_bytes
+    :param values: sequence of SHA-256 hex digests
+    :param max_bytes: maximum size of a part
+    :return: generator of CSV documents
+    """
+    num_parts = count_hash_list_parts(len(values), max_bytes)
+    if not num_parts:
+        return
+    part_rows, remainder = divmod(len(values), num_parts)
+    start = 0
+    for i in range(num_parts):
+        end = start + part_rows + (1 if i < remainder else 0)
+        yield "\n".join(values[start:end]) + "\n"
+        start = end
@@ -0,0 +1,218 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Transformation pipeline shared by the Glue jobs of every platform: read the
+#   Clean Rooms output, normalize and hash the PII columns, write the output
+#   parts of the destination, then the run statistics and, last, the manifest
+#   that triggers the upload. Each stage is a function, timed and, with the
+#   --memory_profile job parameter, memory profiled in the run statistics.
+#   With --read_method select, only the PII columns are read, with S3 Select.
+#   Compressed inputs (.gz, .bz2, .zst) are decompressed in parallel.
+###############################################################################
+
+import io
+import json
+import os
+import sys
+
+import awswrangler as wr
+import boto3
+import pandas as pd
+
+from etl_helpers.compression import get_codec, read_compressed_object, strip_codec_extension
+from etl_helpers.hashing import hash_pii_columns
+from etl_helpers.manifest import manifest_key, md5_hex, write_manifest
+from etl_helpers.normalization import normalize_pii_columns
+from upload_engine.profiling import get_memory_profiler
+from etl_helpers.pushdown import FULL_READ, READ_METHODS, SELECT_READ, read_pii_columns
+from etl_helpers.stats import RunStatistics, write_run_statistics
+
+JOB_PARAMETERS = ['JOB_NAME', 'source_bucket', 'source_key', 'output_bucket', 'pii_fields', 'segment_name']
+# optional, rss or tracemalloc to record the memory high-water mark of every stage in the run statistics
+MEMORY_PROFILE_PARAMETER = 'memory_profile'
+# optional, select to read only the PII columns of the input with S3 Select
+READ_METHOD_PARAMETER = 'read_method'
+READ_CHUNK_SIZE = 2000
+
+
+def parse_job_args(argv):
+    """
+    Parse the job parameters, exiting when a required one is missing
+    :param argv: command line of the job
+    :return: dict of job parameters, with pii_fields parsed and JOB_RUN_ID set to None outside of Glue
+    """
+    # only available in the Glue runtime, run_transformation can be called without it
+    from awsglue.utils import getResolvedOptions
+
+    args = getResolvedOptions(argv, JOB_PARAMETERS)
+    print("Runtime args for job " + args['JOB_NAME'] + ":")
+    print(args)
+    for name in ['source_bucket', 'source_key', 'output_bucket', 'segment_name']:
+        if name not in args:
+            sys.exit("ERROR: Missing " + name + " job parameter")
+
+    args['pii_fields'] = json.loads(args['pii_fields']) if 'pii_fields' in args else []
+
+    # Glue passes the run id of every job run, it is only missing when the script runs outside of Glue
+    args['JOB_RUN_ID'] = None
+    if '--JOB_RUN_ID' in argv:
+        args['JOB_RUN_ID'] = getResolvedOptions(argv, ['JOB_RUN_ID'])['JOB_RUN_ID']
+    args[MEMORY_PROFILE_PARAMETER] = None
+    if '--' + MEMORY_PROFILE_PARAMETER in argv:
+        args[MEMORY_PROFILE_PARAMETER] = getResolvedOptions(argv, [MEMORY_PROFILE_PARAMETER])[MEMORY_PROFILE_PARAMETER]
+    args[READ_METHOD_PARAMETER] = FULL_READ
+    if '--' + READ_METHOD_PARAMETER in argv:
+        args[READ_METHOD_PARAMETER] = getResolvedOptions(argv, [READ_METHOD_PARAMETER])[READ_METHOD_PARAMETER]
+    if args[READ_METHOD_PARAMETER] not in READ_METHODS:
+        sys.exit("ERROR: read_method must be one of " + ", ".join(READ_METHODS))
+    return args
+
+
+def read_json_lines(source_bucket, source_key):
+    """
+    Read every column of the Clean Rooms output
+    :return: DataFrame of the records
+    """
+    # dtype=False keeps the strings as read, pandas would turn "0015551234567" into the number 15551234567
+    codec = get_codec(source_key)
+    if codec:
+        # downloaded compressed, the members of the object are decompressed in parallel
+        data = read_compressed_object(boto3.client('s3'), source_bucket, source_key, codec)
+        chunks = pd.read_json(io.BytesIO(data), chunksize=READ_CHUNK_SIZE, lines=True, orient='records', dtype=False)
+    else:
+        chunks = wr.s3.read_json(path=['s3://'+source_bucket+'/'+source_key], chunksize=READ_CHUNK_SIZE, lines=True,
+                                 orient='records', dtype=False)
+    # a single concatenation: concatenating chunk by chunk copies the rows read so far for every chunk
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_input(source_bucket, source_key, pii_columns=None, read_method=FULL_READ):
+    """
+    Read the Clean Rooms output
+    :param pii_columns: names of the PII columns, the only ones read with the select read method
+    :param read_method: full to read the whole object, or select to read the PII columns with S3 Select
+    :return: DataFrame of the records, read method used, and number of bytes returned by S3 Select
+    """
+    print('Reading input file from: ')
+    print('s3://'+source_bucket+'/'+source_key)
+    if read_method == SELECT_READ:
+        codec = get_codec(source_key)
+        return read_pii_columns(boto3.client('s3'), source_bucket, source_key, pii_columns,
+                                lambda: read_json_lines(source_bucket, source_key), codec.name if codec else None)
+    return read_json_lines(source_bucket, source_key), FULL_READ, None
+
+
+def write_output(destination, hashed_columns, segment_name, output_bucket, output_key, run_stats):
+    """Write the output parts of the destination and record them in the run statistics"""
+    for key, body, rows, schema in destination.iter_parts(hashed_columns, segment_name, output_key):
+        output_file = 's3://'+output_bucket+'/'+key
+        wr.s3.upload(local_file=io.BytesIO(body), path=output_file)
+        run_stats.add_part(output_file, rows, len(body), md5_hex(body), schema)
+
+
+def run_transformation(destination, args):
+    """
+    Transform the Clean Rooms output of a job run for a destination
+    :param destination: etl_helpers.destinations.Destination of the job
+    :param args: job parameters returned by parse_job_args
+    :return: RunStatistics of the run
+    """
+    profiler = get_memory_profiler(args.get('memory_profile'))
+    if profiler:
+        profiler.start()
+    try:
+        return run_stages(destination, args, profiler)
+    finally:
+        if profiler:
+            profiler.stop()
+
+
+def run_stages(destination, args, profiler=None):
+    """Run the stages of the transformation, recording them in the run statistics"""
+    source_bucket = args['source_bucket']
+    source_key = args['source_key']
+    output_bucket = args['output_bucket']
+    # data.json.gz is written to the same output keys as data.json
+    output_key = os.path.splitext(strip_codec_extension(source_key))[0]
+    segment_name = args['segment_name']
+    pii_fields = args['pii_fields']
+    platform = destination.platform
+
+    destination.validate_pii_fields(pii_fields)
+    run_stats = RunStatistics(args['JOB_NAME'], args['JOB_RUN_ID'], platform, segment_name, 's3://'+source_bucket+'/'+source_key, profiler)
+
+    ###############################
+    # LOAD INPUT DATA
+    ###############################
+
+    with run_stats.stage('read') as stage:
+        # with S3 Select, the rows without any PII value are filtered out by S3 and not counted
+        df, run_stats.read_method, run_stats.bytes_read = read_input(
+            source_bucket, source_key, [field['column_name'] for field in pii_fields], args.get(READ_METHOD_PARAMETER, FULL_READ))
+        stage.rows = len(df)
+    run_stats.rows_read = len(df)
+
+    ###############################
+    # DATA NORMALIZATION
+    ###############################
+
+    # Only the PII columns are kept, each one normalized according to its PII type.
+    # Missing and empty values are dropped per column so they are neither hashed nor uploaded.
+    with run_stats.stage('normalize') as stage:
+        pii_columns, dropped_counts = normalize_pii_columns(df, pii_fields)
+        stage.rows = len(df) * len(pii_fields)
+    for field in pii_fields:
+        column_name = field['column_name']
+        run_stats.add_column(field, dropped_counts[column_name])
+        print("Dropped " + str(dropped_counts[column_name]) + " of " + str(len(df)) + " rows with a null or empty " + column_name)
+    del df
+
+    ###############################
+    # PII HASHING
+    ###############################
+
+    # Columns flagged as pre_hashed are validated and passed through without rehashing
+    with run_stats.stage('hash') as stage:
+        hashed_columns = hash_pii_columns(pii_columns, pii_fields)
+        run_stats.rows_hashed = {schema: len(values) for schema, values in hashed_columns.items()}
+        stage.rows = sum(run_stats.rows_hashed.values())
+    del pii_columns
+
+    ###############################
+    # SAVE OUTPUT DATA
+    ###############################
+
+    # The destination renders the hashed columns in the format and part size its uploader expects
+    with run_stats.stage('write') as stage:
+        write_output(destination, hashed_columns, segment_name, output_bucket, output_key, run_stats)
+        stage.rows = sum(run_stats.rows_hashed.values())
+
+    ###############################
+    # SAVE RUN STATISTICS
+    ###############################
+
+    s3_client = boto3.client('s3')
+    write_run_statistics(run_stats, s3_client, boto3.client('cloudwatch'), output_bucket, 'stats/'+platform+'/'+segment_name+'/'+output_key+'.json')
+
+    ###############################
+    # SAVE MANIFEST
+    ###############################
+
+    # The manifest lists every part written above and is written last: its creation is what
+    # starts the upload, so the uploader only ever sees complete audiences, once per job run.
+    write_manifest(run_stats, s3_client, output_bucket, manifest_key(platform, segment_name, output_key))
+    return run_stats
+
+
+def main(destination, argv=None):
+    """
+    Entry point of the Glue scripts
+    :param destination: etl_helpers.destinations.Destination of the job
+    :param argv: command line of the job, sys.argv by default
+    """
+    return run_transformation(destination, parse_job_args(sys.argv if argv is None else argv))
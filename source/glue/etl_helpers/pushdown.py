@@ -0,0 +1,143 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Read only the PII columns of the Clean Rooms output with S3 Select. The
+#   column projection and the null filtering run in S3, so the job transfers
+#   the PII columns of the rows that hold at least one PII value instead of
+#   the whole object. Uncompressed inputs are scanned in ranges, one S3 Select
+#   request per range sent in parallel, and gzip and bzip2 inputs by a single
+#   request. S3 implementations without S3 Select (local stand-ins, accounts
+#   where it is not enabled) and zstd inputs fall back to reading the whole
+#   object and projecting the same columns locally.
+###############################################################################
+
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from botocore.eventstream import ParserError
+from botocore.exceptions import ClientError, ConnectionError
+from botocore.parsers import ResponseParserError
+
+# values of the --read_method job parameter
+FULL_READ = "full"
+SELECT_READ = "select"
+READ_METHODS = (FULL_READ, SELECT_READ)
+# bytes scanned by each S3 Select request
+SCAN_RANGE_BYTES = 64 * 1024**2
+# S3 Select requests sent at the same time
+MAX_SELECT_WORKERS = 8
+# CompressionType of the input codecs S3 Select can read, see etl_helpers.compression
+SELECT_COMPRESSION_TYPES = {None: "NONE", "gzip": "GZIP", "bzip2": "BZIP2"}
+# error codes of the S3 implementations without S3 Select, the other errors are raised
+SELECT_UNAVAILABLE_ERROR_CODES = ("MethodNotAllowed", "NotImplemented", "XNotImplemented")
+
+
+def quote_column(column_name):
+    """Path of a column in the SQL expression, quoted so that any column name can be selected"""
+    return 's."' + column_name.replace('"', '""') + '"'
+
+
+def build_select_expression(columns):
+    """
+    SQL expression projecting the columns of the rows where at least one of them is not null
+    :param columns: list of column names
+    """
+    projection = ", ".join(quote_column(column) for column in columns)
+    # empty values are still dropped by the normalization, comparing them in S3 would fail on non-string values
+    condition = " OR ".join(quote_column(column) + " IS NOT NULL" for column in columns)
+    return "SELECT " + projection + " FROM S3Object s WHERE " + condition
+
+
+def scan_ranges(content_length, scan_range_bytes=SCAN_RANGE_BYTES):
+    """
+    Split an object in scan ranges, S3 Select returns the records that start within each range
+    :return: list of (start, end) byte offsets, end included as in the ScanRange of S3 Select
+    """
+    return [(start, min(start + scan_range_bytes, content_length) - 1) for start in range(0, content_length, scan_range_bytes)]
+
+
+def select_records(s3_client, bucket, key, expression, scan_range=None, compression=None):
+    """
+    Run an S3 Select expression on a JSON lines object
+    :param scan_range: (start, end) byte offsets of the records to scan, end included, the whole object by default
+    :param compression: codec name of the object, None when it is not compressed
+    :return: JSON lines of the selected records, and number of bytes returned by S3
+    """
+    request = {
+        "Bucket": bucket,
+        "Key": key,
+        "Expression": expression,
+        "ExpressionType": "SQL",
+        "InputSerialization": {"JSON": {"Type": "LINES"}, "CompressionType": SELECT_COMPRESSION_TYPES[compression]},
+        "OutputSerialization": {"JSON": {"RecordDelimiter": "\n"}},
+    }
+    if scan_range:
+        request["ScanRange"] = {"Start": scan_range[0], "End": scan_range[1]}
+    records = io.BytesIO()
+    bytes_returned = 0
+    for event in s3_client.select_object_content(**request)["Payload"]:
+        if "Records" in event:
+            records.write(event["Records"]["Payload"])
+        elif "Stats" in event:
+            bytes_returned += event["Stats"]["Details"]["BytesReturned"]
+    return records.getvalue(), bytes_returned
+
+
+def select_columns(s3_client, bucket, key, columns, scan_range_bytes=SCAN_RANGE_BYTES, compression=None):
+    """
+    Read the columns of the rows where at least one of them is not null with S3 Select
+    :param columns: list of column names
+    :param compression: codec name of the object, None when it is not compressed
+    :return: DataFrame of the columns, and number of bytes returned by S3
+    """
+    expression = build_select_expression(columns)
+    if compression:
+        # scan ranges are only supported on uncompressed objects
+        ranges = [None]
+    else:
+        ranges = scan_ranges(s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"], scan_range_bytes)
+    with ThreadPoolExecutor(max_workers=max(min(len(ranges), MAX_SELECT_WORKERS), 1)) as executor:
+        results = list(executor.map(
+            lambda scan_range: select_records(s3_client, bucket, key, expression, scan_range, compression), ranges))
+    records = b"".join(result[0] for result in results)
+    bytes_returned = sum(result[1] for result in results)
+    if not records.strip():
+        return pd.DataFrame(columns=columns), bytes_returned
+    # the values keep their JSON type, pandas would otherwise turn strings such as phone numbers into numbers
+    df = pd.read_json(io.BytesIO(records), lines=True, orient="records", dtype=False)
+    # S3 Select leaves out the null and missing values, a column null in every row has no value at all
+    return df.reindex(columns=columns), bytes_returned
+
+
+def project_columns(df, columns):
+    """Local equivalent of the S3 Select expression: the columns of the rows where at least one of them is not null"""
+    df = df.reindex(columns=columns)
+    return df[df.notna().any(axis=1)].reset_index(drop=True)
+
+
+def read_pii_columns(s3_client, bucket, key, columns, read_full, compression=None):
+    """
+    Read the PII columns with S3 Select, or read the whole object when S3 Select is not available:
+    the request is rejected as not implemented, or a stand-in drops the connection or sends a response
+    that cannot be parsed. Any other error, such as AccessDenied, is raised.
+    :param columns: list of the PII column names
+    :param read_full: function reading the whole object into a DataFrame
+    :param compression: codec name of the object, None when it is not compressed
+    :return: DataFrame of the PII columns, read method used, and number of bytes returned by S3 Select
+    """
+    if compression not in SELECT_COMPRESSION_TYPES:
+        print("S3 Select cannot read " + compression + " objects, reading the whole object")
+        return project_columns(read_full(), columns), FULL_READ, None
+    try:
+        df, bytes_returned = select_columns(s3_client, bucket, key, columns, compression=compression)
+        return df, SELECT_READ, bytes_returned
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in SELECT_UNAVAILABLE_ERROR_CODES:
+            raise
+        print("S3 Select is not available for s3://" + bucket + "/" + key + ", reading the whole object: " + str(e))
+    except (ConnectionError, ResponseParserError, ParserError) as e:
+        print("S3 Select is not available for s3://" + bucket + "/" + key + ", reading the whole object: " + str(e))
+    return project_columns(read_full(), columns), FULL_READ, None
@@ -0,0 +1,175 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Run statistics for the Glue transformation jobs: rows read, dropped and
+#   hashed, parts and bytes written, and wall time, throughput and, when a
+#   memory profiler is attached, memory high-water marks per stage.
+#   Serialized as a compact JSON document and published as CloudWatch metrics.
+###############################################################################
+
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from etl_helpers.normalization import is_pre_hashed
+
+METRICS_NAMESPACE = "AudienceUploaderFromCleanRooms"
+
+
+class StageStatistics:
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = 0
+        # set from the memory profiler of the run, if any
+        self.peak_rss_bytes = None
+        self.peak_traced_bytes = None
+
+    @property
+    def rows_per_second(self):
+        if not self.seconds:
+            return 0.0
+        return self.rows / self.seconds
+
+    def to_dict(self):
+        stage = {
+            "seconds": round(self.seconds, 3),
+            "rows": self.rows,
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+        if self.peak_rss_bytes is not None:
+            stage["peak_rss_bytes"] = self.peak_rss_bytes
+        if self.peak_traced_bytes is not None:
+            stage["peak_traced_bytes"] = self.peak_traced_bytes
+        return stage
+
+
+class RunStatistics:
+    """Collects the statistics of one transformation job run"""
+
+    def __init__(self, job_name, job_run_id, platform, segment_name, source, profiler=None):
+        """
+        :param profiler: upload_engine.profiling.MemoryProfiler, started and stopped by the caller, to record the memory of each stage
+        """
+        self.job_name = job_name
+        self.job_run_id = job_run_id
+        self.platform = platform
+        self.segment_name = segment_name
+        self.source = source
+        self.started_at = datetime.now(timezone.utc)
+        self.rows_read = 0
+        # full or select, and the bytes S3 Select returned
+        self.read_method = "full"
+        self.bytes_read = None
+        self.columns = {}
+        self.rows_hashed = {}
+        self.parts = []
+        self.stages = {}
+        self.profiler = profiler
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the job. The caller sets the number of rows the stage processed:
+
+            with run_stats.stage("read") as stage:
+                ...
+                stage.rows = len(df)
+        """
+        stage = self.stages.setdefault(name, StageStatistics(name))
+        start = time.perf_counter()
+        try:
+            if self.profiler:
+                with self.profiler.stage(name):
+                    yield stage
+            else:
+                yield stage
+        finally:
+            stage.seconds += time.perf_counter() - start
+            if self.profiler:
+                peaks = self.profiler.peaks[name]
+                stage.peak_rss_bytes = peaks.get("peak_rss_bytes")
+                stage.peak_traced_bytes = peaks.get("peak_traced_bytes")
+
+    def add_column(self, field, rows_dropped):
+        self.columns[field["column_name"]] = {
+            "pii_type": field["pii_type"],
+            "pre_hashed": is_pre_hashed(field),
+            "rows_dropped": rows_dropped,
+        }
+
+    def add_part(self, path, rows, size, md5=None, schema=None):
+        self.parts.append({"path": path, "rows": rows, "bytes": size, "md5": md5, "schema": schema})
+
+    @property
+    def rows_dropped(self):
+        return sum(column["rows_dropped"] for column in self.columns.values())
+
+    @property
+    def bytes_written(self):
+        return sum(part["bytes"] for part in self.parts)
+
+    def to_dict(self):
+        return {
+            "job_name": self.job_name,
+            "job_run_id": self.job_run_id,
+            "platform": self.platform,
+            "segment_name": self.segment_name,
+            "source": self.source,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "read_method": self.read_method,
+            "bytes_read": self.bytes_read,
+            "rows_read": self.rows_read,
+            "rows_dropped": self.rows_dropped,
+            "columns": self.columns,
+            "rows_hashed": self.rows_hashed,
+            "parts_written": len(self.parts),
+            "bytes_written": self.bytes_written,
+            "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    def metric_data(self):
+        """CloudWatch metric data for this run, dimensioned by platform and per stage"""
+        dimensions = [{"Name": "Platform", "Value": self.platform}]
+        metrics = [
+            ("RowsRead", self.rows_read, "Count"),
+            ("RowsDropped", self.rows_dropped, "Count"),
+            ("RowsHashed", sum(self.rows_hashed.values()), "Count"),
+            ("PartsWritten", len(self.parts), "Count"),
+            ("BytesWritten", self.bytes_written, "Bytes"),
+        ]
+        metric_data = [
+            {"MetricName": name, "Dimensions": dimensions, "Value": value, "Unit": unit}
+            for name, value, unit in metrics
+        ]
+        for name, stage in self.stages.items():
+            stage_dimensions = dimensions + [{"Name": "Stage", "Value": name}]
+            metric_data.append({"MetricName": "StageDuration", "Dimensions": stage_dimensions, "Value": stage.seconds, "Unit": "Seconds"})
+            metric_data.append({"MetricName": "StageThroughput", "Dimensions": stage_dimensions, "Value": stage.rows_per_second, "Unit": "Count/Second"})
+            if stage.peak_rss_bytes is not None:
+                metric_data.append({"MetricName": "StagePeakMemory", "Dimensions": stage_dimensions, "Value": stage.peak_rss_bytes, "Unit": "Bytes"})
+        return metric_data
+
+    def publish_metrics(self, cloudwatch_client, namespace=METRICS_NAMESPACE):
+        cloudwatch_client.put_metric_data(Namespace=namespace, MetricData=self.metric_data())
+
+
+def write_run_statistics(run_stats, s3_client, cloudwatch_client, bucket, key):
+    """
+    Save the run statistics next to the output data and publish them as CloudWatch metrics.
+    Failing to publish the metrics does not fail the job.
+    """
+    document = run_stats.to_json()
+    print("Run statistics: " + document)
+    s3_client.put_object(Bucket=bucket, Key=key, Body=document.encode(), ContentType="application/json")
+    try:
+        run_stats.publish_metrics(cloudwatch_client)
+    except Exception as e:
+        print("Unable to publish run statistics to CloudWatch: {}".format(e))
@@ -11,9 +11,12 @@ from aws_cdk import (
 )
 from aws_solutions.cdk.stack import NestedSolutionStack
 from lib.aws_lambda.layers.aws_solutions.layer import SolutionsLayer
+from lib.upload_workflow import UploadWorkflow
 
 SOLUTION_ID = "SOLUTION_ID"
 SOLUTION_VERSION = "SOLUTION_VERSION"
+UPLOAD_MAX_CONCURRENCY = "UPLOAD_MAX_CONCURRENCY"
+DEFAULT_UPLOAD_MAX_CONCURRENCY = 4
 
 class BaseUploaderStack(NestedSolutionStack):
     def __init__(self, scope: Construct, construct_id: str, *args, **kwargs) -> None:
@@ -30,6 +33,7 @@ class BaseUploaderStack(NestedSolutionStack):
         stack = Stack.of(self)
         self.solution_id = stack.node.try_get_context(SOLUTION_ID)
         self.solution_version = stack.node.try_get_context(SOLUTION_VERSION)
+        self.upload_max_concurrency = int(stack.node.try_get_context(UPLOAD_MAX_CONCURRENCY) or DEFAULT_UPLOAD_MAX_CONCURRENCY)
 
         #Layers
         self.layer_solutions = SolutionsLayer.get_or_create(self)
@@ -60,3 +64,20 @@ class BaseUploaderStack(NestedSolutionStack):
         event_source = SqsEventSource(queue, batch_size=1)
         queue.grant_consume_messages(uploader_lambda)
         uploader_lambda.add_event_source(event_source)
+
+    ##############################################################################
+    # Upload workflow
+    ##############################################################################
+
+    def add_upload_workflow(self, uploader_lambda, plan_lambda, upload_part_lambda, aggregate_lambda):
+        """Orchestrate manifest uploads with a Step Functions workflow started by the uploader lambda"""
+        self.upload_workflow = UploadWorkflow(
+            self,
+            "UploadWorkflow",
+            plan_function=plan_lambda,
+            upload_part_function=upload_part_lambda,
+            aggregate_function=aggregate_lambda,
+            max_concurrency=self.upload_max_concurrency,
+        )
+        self.upload_workflow.state_machine.grant_start_execution(uploader_lambda)
+        uploader_lambda.add_environment("UPLOAD_STATE_MACHINE_ARN", self.upload_workflow.state_machine.state_machine_arn)
@@ -11,6 +11,9 @@ from aws_cdk import (
 from aws_solutions_constructs.aws_eventbridge_sqs import EventbridgeToSqs
 from constructs import Construct
 
+UPLOAD_MAX_RECEIVE_COUNT = "UPLOAD_MAX_RECEIVE_COUNT"
+DEFAULT_UPLOAD_MAX_RECEIVE_COUNT = 10
+
 
 class EventbridgeToSQS(Construct):
     """Link the Glue Job Event Bridge notifications to the SQS queues to kick off activators"""
@@ -19,6 +22,19 @@ class EventbridgeToSQS(Construct):
         super().__init__(scope, "EventBrSqs")
 
         key = kms.Key(self, "Key", enable_key_rotation=True)
+
+        # the uploaders shorten the visibility of throttled messages so they are retried within
+        # seconds to minutes, messages still failing after max receive count are kept for inspection
+        max_receive_count = int(
+            Stack.of(self).node.try_get_context(UPLOAD_MAX_RECEIVE_COUNT) or DEFAULT_UPLOAD_MAX_RECEIVE_COUNT
+        )
+        dead_letter_queue = sqs.Queue(
+            self,
+            "activator_connector_dlq",
+            encryption=sqs.QueueEncryption.KMS,
+            encryption_master_key=key,
+            retention_period=Duration.days(14),
+        )
         queue = sqs.Queue(
             self,
             "activator_connector",
@@ -26,6 +42,7 @@ class EventbridgeToSQS(Construct):
             encryption_master_key=key,
             data_key_reuse=Duration.days(1),
             visibility_timeout=Duration.minutes(90),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=max_receive_count, queue=dead_letter_queue),
         )
 
         # create the bus object to watch for the Glue Job notifications
@@ -38,8 +55,10 @@ class EventbridgeToSQS(Construct):
                     detail_type=["Object Created"],
                     account=[Stack.of(self).account],
                     region=[Stack.of(self).region],
+                    # only the manifest the Glue job writes after the last output part starts an upload,
+                    # so the uploaders see each audience once and only when it is complete
                     detail={"bucket": {"name": [{"prefix": "uploader-etl-artifacts"}]},
-                            "object": {"key": [{"prefix": "output/"}]}
+                            "object": {"key": [{"suffix": "_manifest.json"}]}
                             }
                 )
             ),
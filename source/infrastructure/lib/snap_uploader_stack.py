@@ -39,6 +39,7 @@ class SnapUploaderStack(BaseUploaderStack):
             actions=[
                 "S3:ListBucket",
                 "S3:GetObjectTagging",
+                "S3:PutObjectTagging",
                 "S3:ListBucket",
                 "S3:GetObject",
                 "S3:PutBucketNotification",
@@ -51,21 +52,56 @@ class SnapUploaderStack(BaseUploaderStack):
         )
 
         layer_arn = f"arn:aws:lambda:{self.region}:580247275435:layer:LambdaInsightsExtension:21"
+        self.insights_version = _lambda.LambdaInsightsVersion.from_insight_version_arn(layer_arn)
+        self.datawrangler_layer = _lambda.LayerVersion.from_layer_version_arn(
+            self,
+            "datawrangler-02",
+            f"arn:aws:lambda:{self.region}:336392948345:layer:AWSDataWrangler-Python39:9",
+        )
 
         # segment uploader
-        self.snap_uploader_lambda = SolutionsPythonFunction(
-            self,
+        self.snap_uploader_lambda = self.create_snap_lambda(
             "snap-uploader-segment",
+            "lambda_handler",
+            description="activate users to segment",
+            reserved_concurrent_executions=2,
+            on_failure=_lambda_dest.SqsDestination(self.lambda_dest_failure_queue),
+        )
+
+        # upload workflow steps
+        plan_lambda = self.create_snap_lambda("snap-upload-plan", "plan_handler", description="plan the upload of a segment manifest")
+        upload_part_lambda = self.create_snap_lambda("snap-upload-part", "upload_part_handler", description="activate the users of one part to segment")
+        aggregate_lambda = self.create_snap_lambda("snap-upload-aggregate", "aggregate_handler", description="summarize the upload of a segment manifest")
+
+        # Add inline policy to the lambda
+        self.snap_uploader_lambda.add_to_role_policy(s3_read_policy_stmt)
+        self.snap_uploader_lambda.add_to_role_policy(queue_decrypt_policy_stmt)
+        for snap_lambda in (plan_lambda, upload_part_lambda, aggregate_lambda):
+            snap_lambda.add_to_role_policy(s3_read_policy_stmt)
+
+        # Add read secret permissions for both secrets and write to oAuth
+        for snap_lambda in (self.snap_uploader_lambda, plan_lambda, upload_part_lambda, aggregate_lambda):
+            self.snap_secrets.oauth_refresh_secret.grant_read(snap_lambda)
+            self.snap_secrets.snap_uploader_secret.grant_read(snap_lambda)
+            self.snap_secrets.oauth_refresh_secret.grant_write(snap_lambda)
+
+        self.add_upload_workflow(self.snap_uploader_lambda, plan_lambda, upload_part_lambda, aggregate_lambda)
+
+        CfnOutput(self, "snapCredentialsOauthRefreshSecretName", value=self.snap_secrets.oauth_refresh_secret.secret_name)
+        CfnOutput(self, "snapCredentialsSecretName", value=self.snap_secrets.snap_uploader_secret.secret_name)
+
+    def create_snap_lambda(self, construct_id, function, **kwargs):
+        """Create a function from the snap uploader lambda handler"""
+        return SolutionsPythonFunction(
+            self,
+            construct_id,
             entrypoint=Path(__file__).parent.parent.parent.absolute() / "aws_lambda" / "snap" / "uploader" / "lambda_handler.py",
-            function="lambda_handler",
+            function=function,
+            libraries=[Path(__file__).parent.parent.parent.absolute() / "aws_lambda" / "upload_engine"],
             runtime=_lambda.Runtime.PYTHON_3_9,
-            description="activate users to segment",
             timeout=Duration.seconds(900),
             memory_size=256,
-            reserved_concurrent_executions=2,
-            insights_version=_lambda.LambdaInsightsVersion.from_insight_version_arn(
-                layer_arn
-            ),
+            insights_version=self.insights_version,
             tracing=_lambda.Tracing.ACTIVE,
             environment={
                 "REFRESH_SECRET_NAME": self.snap_secrets.oauth_refresh_secret.secret_name,
@@ -74,24 +110,8 @@ class SnapUploaderStack(BaseUploaderStack):
                 "SOLUTION_VERSION": self.solution_version
             },
             layers=[
-                _lambda.LayerVersion.from_layer_version_arn(
-                    self,
-                    "datawrangler-02",
-                    f"arn:aws:lambda:{self.region}:336392948345:layer:AWSDataWrangler-Python39:9",
-                ),
+                self.datawrangler_layer,
                 self.layer_solutions
             ],
-            on_failure=_lambda_dest.SqsDestination(self.lambda_dest_failure_queue),
+            **kwargs,
         )
-
-        # Add inline policy to the lambda
-        self.snap_uploader_lambda.add_to_role_policy(s3_read_policy_stmt)
-        self.snap_uploader_lambda.add_to_role_policy(queue_decrypt_policy_stmt)
-
-        # Add read secret permissions for both secrets and write to oAuth
-        self.snap_secrets.oauth_refresh_secret.grant_read(self.snap_uploader_lambda)
-        self.snap_secrets.snap_uploader_secret.grant_read(self.snap_uploader_lambda)
-        self.snap_secrets.oauth_refresh_secret.grant_write(self.snap_uploader_lambda)
-
-        CfnOutput(self, "snapCredentialsOauthRefreshSecretName", value=self.snap_secrets.oauth_refresh_secret.secret_name)
-        CfnOutput(self, "snapCredentialsSecretName", value=self.snap_secrets.snap_uploader_secret.secret_name)
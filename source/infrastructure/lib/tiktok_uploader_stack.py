@@ -41,6 +41,7 @@ class TiktokUploaderStack(BaseUploaderStack):
             actions=[
                 "S3:ListBucket",
                 "S3:GetObjectTagging",
+                "S3:PutObjectTagging",
                 "S3:ListBucket",
                 "S3:GetObject",
                 "S3:PutBucketNotification",
@@ -53,21 +54,58 @@ class TiktokUploaderStack(BaseUploaderStack):
         )
 
         layer_arn = f"arn:aws:lambda:{self.region}:580247275435:layer:LambdaInsightsExtension:21"
+        self.insights_version = _lambda.LambdaInsightsVersion.from_insight_version_arn(layer_arn)
+        self.datawrangler_layer = _lambda.LayerVersion.from_layer_version_arn(
+            self,
+            "datawrangler-02",
+            f"arn:aws:lambda:{self.region}:336392948345:layer:AWSDataWrangler-Python39:9",
+        )
 
         # segment uploader for SQS
-        self.tiktok_uploader_lambda = SolutionsPythonFunction(
-            self,
+        self.tiktok_uploader_lambda = self.create_tiktok_lambda(
             "tiktok-uploader-segment-sqs",
+            "lambda_handler",
+            description="activate users to segment",
+            reserved_concurrent_executions=2,
+            on_failure=_lambda_dest.SqsDestination(self.lambda_dest_failure_queue),
+        )
+
+        # upload workflow steps
+        plan_lambda = self.create_tiktok_lambda("tiktok-upload-plan", "plan_handler", description="plan the upload of a custom audience manifest")
+        upload_part_lambda = self.create_tiktok_lambda("tiktok-upload-part", "upload_part_handler", description="upload one part of a custom audience")
+        aggregate_lambda = self.create_tiktok_lambda("tiktok-upload-aggregate", "aggregate_handler", description="add the uploaded parts to the custom audience")
+
+        # Add inline policy to the lambda
+        self.tiktok_uploader_lambda.add_to_role_policy(s3_read_policy_stmt)
+        self.tiktok_uploader_lambda.add_to_role_policy(queue_decrypt_policy_stmt)
+        for tiktok_lambda in (plan_lambda, upload_part_lambda, aggregate_lambda):
+            tiktok_lambda.add_to_role_policy(s3_read_policy_stmt)
+
+        # Add read secret permissions for both secrets and write to oAuth
+        for tiktok_lambda in (self.tiktok_uploader_lambda, plan_lambda, upload_part_lambda, aggregate_lambda):
+            self.tiktok_secrets.tiktok_uploader_secret.grant_read(
+                tiktok_lambda
+            )
+            self.tiktok_secrets.tiktok_uploader_secret.grant_write(
+                tiktok_lambda
+            )
+
+        self.add_upload_workflow(self.tiktok_uploader_lambda, plan_lambda, upload_part_lambda, aggregate_lambda)
+
+        CfnOutput(self, "tiktokCredentialsSecretName", value=self.tiktok_secrets.tiktok_uploader_secret.secret_name)
+
+    def create_tiktok_lambda(self, construct_id, function, **kwargs):
+        """Create a function from the tiktok uploader lambda handler"""
+        return SolutionsPythonFunction(
+            self,
+            construct_id,
             entrypoint=Path(__file__).parent.parent.parent.absolute() / "aws_lambda" / "tiktok" / "uploader" / "lambda_handler.py",
-            function="lambda_handler",
+            function=function,
+            libraries=[Path(__file__).parent.parent.parent.absolute() / "aws_lambda" / "upload_engine"],
             runtime=_lambda.Runtime.PYTHON_3_9,
-            description="activate users to segment",
             timeout=Duration.seconds(900),
             memory_size=256,
-            reserved_concurrent_executions=2,
-            insights_version=_lambda.LambdaInsightsVersion.from_insight_version_arn(
-                layer_arn
-            ),
+            insights_version=self.insights_version,
             tracing=_lambda.Tracing.ACTIVE,
             environment={
                 "CRED_SECRET_NAME": self.tiktok_secrets.tiktok_uploader_secret.secret_name,
@@ -75,28 +113,8 @@ class TiktokUploaderStack(BaseUploaderStack):
                 "SOLUTION_VERSION": self.solution_version
             },
             layers=[
-                _lambda.LayerVersion.from_layer_version_arn(
-                    self,
-                    "datawrangler-02",
-                    f"arn:aws:lambda:{self.region}:336392948345:layer:AWSDataWrangler-Python39:9",
-                ),
+                self.datawrangler_layer,
                 self.layer_solutions
             ],
-            on_failure=_lambda_dest.SqsDestination(self.lambda_dest_failure_queue),
-        )
-
-        # Add inline policy to the lambda
-        self.tiktok_uploader_lambda.add_to_role_policy(s3_read_policy_stmt)
-        self.tiktok_uploader_lambda.add_to_role_policy(queue_decrypt_policy_stmt)
-
-        # Add read secret permissions for both secrets and write to oAuth
-        self.tiktok_secrets.tiktok_uploader_secret.grant_read(
-            self.tiktok_uploader_lambda
+            **kwargs,
         )
-        self.tiktok_secrets.tiktok_uploader_secret.grant_write(
-            self.tiktok_uploader_lambda
-        )
-        
-
-        CfnOutput(self, "tiktokCredentialsSecretName", value=self.tiktok_secrets.tiktok_uploader_secret.secret_name)
-
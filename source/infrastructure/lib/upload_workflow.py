@@ -0,0 +1,94 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from aws_cdk import (
+    aws_stepfunctions as sfn,
+    Duration,
+)
+from aws_solutions.cdk.stepfunctions.solution_fragment import SolutionFragment
+from constructs import Construct
+
+# raised by the uploader lambdas when the partner API throttles or fails transiently
+RETRYABLE_UPLOAD_ERROR = "RetryableUploadError"
+# status returned by the upload part lambdas for a throttled range of parts (upload_engine.retry.run_workflow_range)
+RETRY_STATUS = "RETRY"
+
+
+class UploadWorkflow(Construct):
+    """
+    Upload an audience from the manifest written by the Glue job: plan the upload once,
+    upload the parts with a Map state of bounded concurrency, then aggregate the results
+    into a single completion status. A throttled part is attempted again after the delay
+    returned by the upload part lambda, which follows the retry hint of the partner API.
+    The state only carries ranges of part indexes and a compact result per part, so that
+    large audiences stay below the Step Functions state size limit. Each Map iteration
+    uploads a range of parts planned by the plan lambda (upload_engine.manifest.plan_part_ranges)
+    rather than a single part, so that the execution history of an audience of thousands
+    of parts stays below the 25,000 events of a standard workflow.
+    """
+
+    def __init__(self, scope: Construct, construct_id: str, plan_function, upload_part_function, aggregate_function, max_concurrency: int):
+        super().__init__(scope, construct_id)
+
+        upload_failed = sfn.Fail(self, "Upload Failed", error="UploadFailed", cause="The audience upload did not complete")
+
+        plan = SolutionFragment(self, "Plan Upload", function=plan_function, failure_state=upload_failed)
+        upload_part = SolutionFragment(self, "Upload Part", function=upload_part_function, result_path="$.outcome")
+        aggregate = SolutionFragment(
+            self,
+            "Aggregate Upload",
+            function=aggregate_function,
+            payload=sfn.TaskInput.from_object({"plan.$": "$.plan", "results.$": "$.results"}),
+            failure_state=upload_failed,
+        )
+        for fragment in (plan, aggregate):
+            fragment.task.add_retry(
+                errors=[RETRYABLE_UPLOAD_ERROR],
+                interval=Duration.seconds(10),
+                backoff_rate=2,
+                max_attempts=6,
+            )
+
+        upload_parts = sfn.Map(
+            self,
+            "Upload Parts",
+            items_path="$.parts",
+            max_concurrency=max_concurrency,
+            parameters={"plan.$": "$.plan", "parts.$": "$$.Map.Item.Value"},
+            result_path="$.results",
+        )
+        wait_retry_after = sfn.Wait(
+            self,
+            "Wait Retry After",
+            time=sfn.WaitTime.seconds_path("$.outcome.retry_after_seconds"),
+        )
+        next_attempt = sfn.Pass(
+            self,
+            "Next Attempt",
+            parameters={
+                "plan.$": "$.plan",
+                "parts.$": "$.parts",
+                "attempt.$": "$.outcome.attempt",
+                "results.$": "$.outcome.results",
+            },
+        )
+        part_uploaded = sfn.Pass(self, "Part Uploaded", input_path="$.outcome.result")
+        part_throttled = (
+            sfn.Choice(self, "Part Throttled?")
+            .when(
+                sfn.Condition.string_equals("$.outcome.status", RETRY_STATUS),
+                wait_retry_after.next(next_attempt).next(upload_part),
+            )
+            .otherwise(part_uploaded)
+        )
+        upload_parts.iterator(upload_part.next(part_throttled))
+        upload_parts.add_catch(upload_failed, result_path="$.statesError")
+
+        definition = plan.next(upload_parts).next(aggregate).next(sfn.Succeed(self, "Upload Complete"))
+
+        self.state_machine = sfn.StateMachine(
+            self,
+            "StateMachine",
+            definition=definition,
+            tracing_enabled=True,
+        )
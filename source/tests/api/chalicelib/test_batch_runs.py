@@ -0,0 +1,257 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+
+from chalicelib.batch_runs import enqueue_entries, parse_batch_entries, start_batch, start_queued
+
+
+class ConcurrentRunsExceededException(Exception):
+    pass
+
+
+class FakeGlue:
+    """Glue job with a concurrent run limit, on a single page of runs"""
+
+    exceptions = SimpleNamespace(ConcurrentRunsExceededException=ConcurrentRunsExceededException)
+
+    def __init__(self, max_concurrent_runs, running=0, started_elsewhere=0):
+        self.max_concurrent_runs = max_concurrent_runs
+        self.runs = [self.make_run("jr_running_" + str(i)) for i in range(running)]
+        # runs started by other callers between the count and the StartJobRun requests
+        self.started_elsewhere = started_elsewhere
+        # error code of the StartJobRun requests of a segment, "unexpected" for an error that is not a ClientError
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_run(run_id, arguments=None):
+        return {"Id": run_id, "JobRunState": "RUNNING", "StartedOn": datetime.now(timezone.utc),
+                "Arguments": arguments or {}}
+
+    def get_job(self, JobName):
+        return {"Job": {"Name": JobName, "ExecutionProperty": {"MaxConcurrentRuns": self.max_concurrent_runs}}}
+
+    def get_job_runs(self, JobName, MaxResults, NextToken=None):
+        return {"JobRuns": [dict(run) for run in self.runs]}
+
+    def start_job_run(self, JobName, Arguments):
+        error = self.errors.get(Arguments["--segment_name"])
+        if error == "unexpected":
+            raise RuntimeError("unexpected")
+        if error:
+            raise ClientError({"Error": {"Code": error, "Message": error}}, "StartJobRun")
+        with self.lock:
+            while self.started_elsewhere:
+                self.started_elsewhere -= 1
+                self.runs.insert(0, self.make_run("jr_elsewhere_" + str(len(self.runs))))
+            if len(self.runs) >= self.max_concurrent_runs:
+                raise ConcurrentRunsExceededException()
+            run_id = "jr_" + Arguments["--segment_name"]
+            self.runs.insert(0, self.make_run(run_id, Arguments))
+            return {"JobRunId": run_id}
+
+
+class FakeSQS:
+    """FIFO queue receiving the visible messages in order, a received message is hidden until deleted or released"""
+
+    def __init__(self):
+        self.messages = []
+        self.hidden = set()
+
+    def send_message_batch(self, QueueUrl, Entries):
+        assert len(Entries) <= 10
+        for entry in Entries:
+            assert entry["MessageGroupId"] and entry["MessageDeduplicationId"]
+            self.messages.append({"ReceiptHandle": entry["MessageDeduplicationId"], "Body": entry["MessageBody"],
+                                  "MessageAttributes": entry["MessageAttributes"]})
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, MessageAttributeNames):
+        messages = [message for message in self.messages if message["ReceiptHandle"] not in self.hidden]
+        messages = messages[:MaxNumberOfMessages]
+        self.hidden.update(message["ReceiptHandle"] for message in messages)
+        return {"Messages": messages} if messages else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.messages = [message for message in self.messages if message["ReceiptHandle"] != ReceiptHandle]
+        self.hidden.discard(ReceiptHandle)
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        assert VisibilityTimeout == 0
+        self.hidden.discard(ReceiptHandle)
+
+    def bodies(self):
+        return [json.loads(message["Body"]) for message in self.messages]
+
+
+def make_entries(count):
+    pii_fields = json.dumps([{"column_name": "email", "pii_type": "EMAIL"}])
+    return [{"sourceBucket": "data", "sourceKey": "input/{}.json".format(i), "outputBucket": "output",
+             "piiFields": pii_fields, "segmentName": "segment{}".format(i)} for i in range(count)]
+
+
+def test_start_batch():
+    glue = FakeGlue(max_concurrent_runs=4, running=1)
+    sqs = FakeSQS()
+    entries = make_entries(5)
+    started, queued, failed = start_batch(glue, sqs, "queue", "job", entries)
+    assert [run["JobRunId"] for run in started] == ["jr_segment0", "jr_segment1", "jr_segment2"]
+    assert started[0] == {"segmentName": "segment0", "sourceKey": "input/0.json", "JobRunId": "jr_segment0"}
+    assert queued == entries[3:]
+    assert failed == []
+    assert glue.runs[0]["Arguments"]["--pii_fields"] == entries[0]["piiFields"]
+    assert sqs.bodies() == entries[3:]
+    assert not sqs.hidden
+
+
+def test_start_batch_no_free_runs():
+    glue = FakeGlue(max_concurrent_runs=2, running=2)
+    sqs = FakeSQS()
+    entries = make_entries(2)
+    assert start_batch(glue, sqs, "queue", "job", entries) == ([], entries, [])
+    assert sqs.bodies() == entries
+
+
+def test_start_batch_after_queued_entries():
+    glue = FakeGlue(max_concurrent_runs=1, running=1)
+    sqs = FakeSQS()
+    first = make_entries(2)
+    start_batch(glue, sqs, "queue", "job", first)
+    glue.runs.clear()
+    second = [dict(entry, segmentName="other" + entry["segmentName"]) for entry in make_entries(2)]
+    # the entries of the earlier batch start first
+    assert start_batch(glue, sqs, "queue", "job", second) == ([], second, [])
+    assert glue.runs[0]["Id"] == "jr_segment0"
+    assert sqs.bodies() == first[1:] + second
+
+
+def test_start_batch_runs_started_elsewhere():
+    glue = FakeGlue(max_concurrent_runs=3, started_elsewhere=1)
+    sqs = FakeSQS()
+    entries = make_entries(4)
+    started, queued, _ = start_batch(glue, sqs, "queue", "job", entries)
+    assert len(started) == 2
+    # the entry that could not start stays ahead of the entries that were not tried
+    assert len(queued) == 2
+    assert queued[-1] == entries[3]
+    assert sqs.bodies() == queued
+    assert not sqs.hidden
+
+
+def test_start_queued():
+    glue = FakeGlue(max_concurrent_runs=12, running=12)
+    sqs = FakeSQS()
+    entries = make_entries(15)
+    enqueue_entries(sqs, "queue", entries, "batch")
+    assert sqs.bodies() == entries
+    # no run finished yet
+    assert start_queued(glue, sqs, "queue", "job") == ([], [])
+    assert len(sqs.messages) == 15
+
+    # 11 runs finished, more than a single receive
+    del glue.runs[1:]
+    started, failed = start_queued(glue, sqs, "queue", "job")
+    assert [run["JobRunId"] for run in started] == ["jr_segment{}".format(i) for i in range(11)]
+    assert started[0] == {"segmentName": "segment0", "sourceKey": "input/0.json", "JobRunId": "jr_segment0",
+                          "batchId": "batch", "entryIndex": 0}
+    assert failed == []
+    assert sqs.bodies() == entries[11:]
+    assert not sqs.hidden
+
+
+def test_start_queued_runs_started_elsewhere():
+    glue = FakeGlue(max_concurrent_runs=3, started_elsewhere=2)
+    sqs = FakeSQS()
+    entries = make_entries(4)
+    enqueue_entries(sqs, "queue", entries, "batch")
+    started, _ = start_queued(glue, sqs, "queue", "job")
+    assert len(started) == 1
+    # the entries that could not start are received again by the next call
+    assert len(sqs.messages) == 3
+    assert not sqs.hidden
+
+
+def test_start_queued_errors():
+    glue = FakeGlue(max_concurrent_runs=4)
+    glue.errors = {"segment0": "AccessDeniedException", "segment1": "ThrottlingException"}
+    sqs = FakeSQS()
+    entries = make_entries(4)
+    enqueue_entries(sqs, "queue", entries, "batch")
+    started, failed = start_queued(glue, sqs, "queue", "job")
+    assert [run["JobRunId"] for run in started] == ["jr_segment2", "jr_segment3"]
+    # the entry that cannot start leaves the queue, the throttled one is received again
+    assert [(entry["segmentName"], entry["entryIndex"]) for entry in failed] == [("segment0", 0)]
+    assert "AccessDeniedException" in failed[0]["error"]
+    assert sqs.bodies() == entries[1:2]
+    assert not sqs.hidden
+
+    # the received entries are released when an unexpected error stops the call
+    glue.errors = {"segment1": "unexpected"}
+    enqueue_entries(sqs, "queue", make_entries(6)[4:], "other")
+    with pytest.raises(RuntimeError):
+        start_queued(glue, sqs, "queue", "job")
+    # the entry started with it left the queue
+    assert glue.runs[0]["Id"] == "jr_segment4"
+    assert [entry["segmentName"] for entry in sqs.bodies()] == ["segment1", "segment5"]
+    assert not sqs.hidden
+
+
+def test_start_batch_failed():
+    glue = FakeGlue(max_concurrent_runs=4)
+    glue.errors = {"segment1": "InvalidInputException"}
+    sqs = FakeSQS()
+    entries = make_entries(2)
+    started, queued, failed = start_batch(glue, sqs, "queue", "job", entries)
+    assert [run["segmentName"] for run in started] == ["segment0"]
+    assert queued == []
+    assert [(entry["segmentName"], entry["sourceKey"]) for entry in failed] == [("segment1", "input/1.json")]
+    assert "InvalidInputException" in failed[0]["error"]
+    assert sqs.messages == []
+
+
+def test_enqueue_entries_failed(mocker):
+    sqs = mocker.MagicMock()
+    sqs.send_message_batch.return_value = {"Failed": [{"Id": "0", "Code": "InternalError", "Message": "retry"}]}
+    with pytest.raises(ValueError, match="unable to queue 1 entries: retry"):
+        enqueue_entries(sqs, "queue", make_entries(1), "batch")
+
+
+def test_parse_batch_entries():
+    entries = make_entries(2)
+    entries[1]["piiFields"] = [{"column_name": "phone", "pii_type": "PHONE"}]
+    arguments = parse_batch_entries(entries)
+    assert arguments[1] == {
+        "--source_bucket": "data",
+        "--output_bucket": "output",
+        "--source_key": "input/1.json",
+        "--pii_fields": '[{"column_name": "phone", "pii_type": "PHONE"}]',
+        "--segment_name": "segment1",
+    }
+
+
+def test_parse_batch_entries_errors():
+    with pytest.raises(ValueError, match="non-empty list"):
+        parse_batch_entries([])
+    with pytest.raises(ValueError, match="at most 100 entries"):
+        parse_batch_entries(make_entries(101))
+
+    entries = make_entries(4)
+    del entries[0]["sourceKey"]
+    entries[1]["piiFields"] = "[{"
+    entries[2]["piiFields"] = '[{"column_name": "email"}]'
+    entries[3]["segmentName"] = "segment1"
+    with pytest.raises(ValueError) as e:
+        parse_batch_entries(entries)
+    message = str(e.value)
+    # every invalid entry is reported at once
+    assert "entry 0: missing sourceKey" in message
+    assert "entry 1: piiFields is not valid JSON" in message
+    assert "entry 2: every piiFields entry" in message
+    assert "entry 3: segment segment1 is already in the batch" in message
@@ -0,0 +1,47 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from chalicelib import clients
+
+
+@pytest.fixture
+def no_clients(mocker, monkeypatch):
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    mocker.patch.object(clients, "_service_clients", {})
+    mocker.patch.object(clients, "_session", None)
+
+
+def test_get_service_client(no_clients, monkeypatch):
+    monkeypatch.setenv("botoConfig", '{"user_agent_extra": "AwsSolution/SO0226/v1.0.0"}')
+    s3 = clients.get_service_client("s3")
+    assert clients.get_service_client("s3") is s3
+    assert clients.get_service_client("glue") is not s3
+    assert s3.meta.region_name == "us-east-1"
+    assert "AwsSolution/SO0226/v1.0.0" in s3.meta.config.user_agent_extra
+
+
+def test_get_service_client_without_config(no_clients, monkeypatch):
+    monkeypatch.delenv("botoConfig", raising=False)
+    assert clients.get_service_client("s3").meta.config.user_agent_extra is None
+
+
+def test_patch_xray(mocker, monkeypatch):
+    patch = mocker.patch("aws_xray_sdk.core.patch")
+    patch_all = mocker.patch("aws_xray_sdk.core.patch_all")
+
+    monkeypatch.delenv("XRAY_PATCH_MODULES", raising=False)
+    assert clients.patch_xray() == ["boto3"]
+    patch.assert_called_once_with(["boto3"])
+
+    assert clients.patch_xray("boto3, requests") == ["boto3", "requests"]
+    patch.assert_called_with(["boto3", "requests"])
+
+    monkeypatch.setenv("XRAY_PATCH_MODULES", "")
+    assert clients.patch_xray() == []
+    assert patch.call_count == 2
+
+    monkeypatch.setenv("XRAY_PATCH_MODULES", "all")
+    assert clients.patch_xray() == ["all"]
+    patch_all.assert_called_once_with()
@@ -0,0 +1,131 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from chalicelib.job_runs import JobRunsCache, list_job_runs, parse_job_runs_query
+
+NOW = datetime(2023, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def make_run(i, state="SUCCEEDED", segment_name="segment", modified_after=timedelta(minutes=5)):
+    """Run i started i hours before NOW"""
+    started_on = NOW - timedelta(hours=i)
+    return {
+        "Id": "jr_" + str(i),
+        "JobRunState": state,
+        "StartedOn": started_on,
+        "LastModifiedOn": started_on + modified_after,
+        "Arguments": {"--segment_name": segment_name},
+    }
+
+
+class FakeGlue:
+    """Glue get_job_runs over a list of runs, newest first"""
+
+    def __init__(self, runs, page_size=2):
+        self.runs = runs
+        self.page_size = page_size
+        self.calls = 0
+
+    def get_job_runs(self, JobName, MaxResults, NextToken=None):
+        self.calls += 1
+        start = int(NextToken or 0)
+        end = start + self.page_size
+        page = {"JobRuns": [dict(run) for run in self.runs[start:end]]}
+        if end < len(self.runs):
+            page["NextToken"] = str(end)
+        return page
+
+
+def ids(runs):
+    return [run["Id"] for run in runs]
+
+
+def test_list_job_runs_pages():
+    glue = FakeGlue([make_run(i) for i in range(5)])
+    cache = JobRunsCache("job")
+    runs, next_token = list_job_runs(cache, glue, max_results=3)
+    assert ids(runs) == ["jr_0", "jr_1", "jr_2"]
+    # the first page only reads the Glue pages it needs
+    assert glue.calls == 2
+    runs, next_token = list_job_runs(cache, glue, max_results=3, next_token=next_token)
+    assert ids(runs) == ["jr_3", "jr_4"]
+    assert next_token is None
+    with pytest.raises(ValueError):
+        list_job_runs(cache, glue, next_token="jr_unknown")
+
+
+def test_list_job_runs_filters():
+    glue = FakeGlue([
+        make_run(0, "RUNNING", "a"),
+        make_run(1, "FAILED", "b"),
+        make_run(2, "SUCCEEDED", "a"),
+        make_run(3, "SUCCEEDED", "b"),
+        make_run(30, "SUCCEEDED", "a"),
+        make_run(40, "SUCCEEDED", "a"),
+    ])
+    cache = JobRunsCache("job")
+    assert ids(list_job_runs(cache, glue, segment_name="a")[0]) == ["jr_0", "jr_2", "jr_30", "jr_40"]
+    assert ids(list_job_runs(cache, glue, states=["RUNNING", "FAILED"])[0]) == ["jr_0", "jr_1"]
+    assert ids(list_job_runs(cache, glue, started_before=NOW - timedelta(hours=2))[0]) == ["jr_3", "jr_30", "jr_40"]
+
+    cache = JobRunsCache("job")
+    glue.calls = 0
+    runs, _ = list_job_runs(cache, glue, started_after=NOW - timedelta(hours=2), segment_name="b")
+    assert ids(runs) == ["jr_1"]
+    # the scan stops at the first run started before started_after
+    assert glue.calls == 2
+
+
+def test_list_job_runs_since():
+    glue = FakeGlue([make_run(0, "RUNNING"), make_run(1), make_run(2), make_run(60, "RUNNING", modified_after=timedelta(hours=59))])
+    cache = JobRunsCache("job")
+    runs, _ = list_job_runs(cache, glue, since=NOW - timedelta(hours=1, minutes=30))
+    # run 2 was last updated before `since`, run 60 started more than the maximum run duration before
+    assert ids(runs) == ["jr_0", "jr_1"]
+
+
+def test_refresh_reads_newer_runs_only():
+    runs = [make_run(i, "RUNNING" if i == 1 else "SUCCEEDED") for i in range(1, 8)]
+    glue = FakeGlue(runs)
+    cache = JobRunsCache("job", ttl=0)
+    cache.refresh(glue)
+    assert ids(cache.runs) == ["jr_1", "jr_2"]
+
+    # a new run started and the running one finished
+    glue.runs = [make_run(0, "RUNNING"), make_run(1)] + runs[1:]
+    glue.calls = 0
+    cache.refresh(glue)
+    assert ids(cache.runs) == ["jr_0", "jr_1", "jr_2"]
+    assert cache.runs[1]["JobRunState"] == "SUCCEEDED"
+    # stopped at jr_2, finished like every older cached run
+    assert glue.calls == 2
+
+    # the older pages are still read on demand
+    assert ids(cache.iter_runs(glue)) == ["jr_" + str(i) for i in range(8)]
+    assert cache.complete
+
+
+def test_refresh_ttl():
+    glue = FakeGlue([make_run(0)])
+    cache = JobRunsCache("job", ttl=60)
+    cache.refresh(glue)
+    cache.refresh(glue)
+    assert glue.calls == 1
+    assert cache.polled_at is not None
+
+
+def test_parse_job_runs_query():
+    query = parse_job_runs_query({"max_results": "10", "state": "RUNNING,FAILED", "since": "2023-03-01T12:00:00Z"})
+    assert query["max_results"] == 10
+    assert query["states"] == ["RUNNING", "FAILED"]
+    assert query["since"] == NOW
+    assert parse_job_runs_query(None)["max_results"] == 200
+    assert parse_job_runs_query({"started_after": "2023-03-01 12:00:00"})["started_after"] == NOW
+    with pytest.raises(ValueError):
+        parse_job_runs_query({"max_results": "0"})
+    with pytest.raises(ValueError):
+        parse_job_runs_query({"since": "yesterday"})
@@ -0,0 +1,41 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pytest
+
+from chalicelib.outputs import (
+    COMPRESSION_EXTENSIONS, MANIFEST_SUFFIX, UPLOADED_AT_TAG, USERS_UPLOADED_TAG, get_output_key, is_part_key,
+)
+
+PREFIX = "output/tiktok/segment/"
+
+
+def test_get_output_key():
+    assert get_output_key("input/data.json") == "input/data"
+    # compressed inputs are written to the same output keys
+    assert get_output_key("input/data.json.gz") == "input/data"
+    assert get_output_key("input/data.json.ZST") == "input/data"
+
+
+def test_is_part_key():
+    assert is_part_key(PREFIX + "seg1.csv", PREFIX, "seg1")
+    assert is_part_key(PREFIX + "email_sha256/seg102.csv", PREFIX, "seg1")
+    assert is_part_key(PREFIX + "dir/seg13.csv.gz", PREFIX, "dir/seg1")
+    assert not is_part_key(PREFIX + "seg1_manifest.json", PREFIX, "seg1")
+    assert not is_part_key(PREFIX + "seg1a.csv", PREFIX, "seg1")
+    assert not is_part_key(PREFIX + "email_sha256/other_seg1.csv", PREFIX, "seg1")
+    assert not is_part_key("output/snap/segment/seg1.csv.gz", PREFIX, "seg1")
+    # the output key is matched literally
+    assert not is_part_key(PREFIX + "segX1.csv", PREFIX, "seg.")
+
+
+def test_outputs_match_the_pipeline():
+    # the Glue job and the uploaders are deployed apart from the API
+    etl_manifest = pytest.importorskip("etl_helpers.manifest")
+    etl_compression = pytest.importorskip("etl_helpers.compression")
+    engine_manifest = pytest.importorskip("upload_engine.manifest")
+    engine_outcome = pytest.importorskip("upload_engine.outcome")
+    assert MANIFEST_SUFFIX == etl_manifest.MANIFEST_SUFFIX == engine_manifest.MANIFEST_SUFFIX
+    assert set(COMPRESSION_EXTENSIONS) == {extension for codec in etl_compression.CODECS for extension in codec.extensions}
+    assert USERS_UPLOADED_TAG == engine_outcome.USERS_UPLOADED_TAG
+    assert UPLOADED_AT_TAG == engine_outcome.UPLOADED_AT_TAG
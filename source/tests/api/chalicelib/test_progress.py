@@ -0,0 +1,164 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from chalicelib.job_runs import JobRunsCache
+from chalicelib.progress import read_audience_progress
+
+BUCKET = "artifacts"
+PREFIX = "output/snap/segment/"
+
+
+class FakeGlue:
+    def __init__(self, runs):
+        self.runs = runs
+
+    def get_job_runs(self, JobName, MaxResults, NextToken=None):
+        return {"JobRuns": [dict(run) for run in self.runs]}
+
+
+def make_run(state, started_on, completed_on=None):
+    run = {"Id": "jr_1", "JobRunState": state, "StartedOn": started_on,
+           "Arguments": {"--segment_name": "segment", "--source_key": "input/data.json"}}
+    if completed_on:
+        run["CompletedOn"] = completed_on
+    return run
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    # moto stores the aws-chunked uploads of recent botocore versions as is
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    with mock_s3():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+        # part of an earlier run of another source of the segment
+        s3_client.put_object(Bucket=BUCKET, Key=PREFIX + "other1.csv.gz", Body=b"x")
+        yield s3_client
+
+
+def write_parts(s3_client, count):
+    keys = [PREFIX + "input/data{}.csv.gz".format(i + 1) for i in range(count)]
+    for key in keys:
+        s3_client.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+    return keys
+
+
+def write_manifest(s3_client, keys, rows=100):
+    manifest = {"segment_name": "segment", "total_rows": rows * len(keys),
+                "parts": [{"key": key, "rows": rows, "bytes": 1, "md5": ""} for key in keys]}
+    s3_client.put_object(Bucket=BUCKET, Key=PREFIX + "input/data_manifest.json", Body=json.dumps(manifest).encode())
+    stats = {"rows_read": 1000, "stages": {"read": {"seconds": 2.0, "rows": 1000, "rows_per_second": 500.0}}}
+    s3_client.put_object(Bucket=BUCKET, Key="stats/snap/segment/input/data.json", Body=json.dumps(stats).encode())
+    return s3_client.head_object(Bucket=BUCKET, Key=PREFIX + "input/data_manifest.json")["LastModified"]
+
+
+def tag_uploaded(s3_client, key, users, uploaded_at):
+    s3_client.put_object_tagging(Bucket=BUCKET, Key=key, Tagging={"TagSet": [
+        {"Key": "uploaded-users", "Value": str(users)}, {"Key": "uploaded-at", "Value": uploaded_at.isoformat()}]})
+
+
+def progress(s3_client, run, now=None):
+    return read_audience_progress(s3_client, FakeGlue([run]), JobRunsCache("job"), BUCKET, "snap", "segment", now)
+
+
+def test_progress_transforming(s3_client):
+    now = datetime.now(timezone.utc)
+    write_parts(s3_client, 2)
+    # written at the same time by a run of another source of the segment
+    s3_client.put_object(Bucket=BUCKET, Key=PREFIX + "input/data_other1.csv.gz", Body=b"x")
+    s3_client.put_object(Bucket=BUCKET, Key=PREFIX + "input/data.json/data1.csv.gz", Body=b"x")
+    result = progress(s3_client, make_run("RUNNING", now - timedelta(minutes=10)), now)
+    assert result["phase"] == "TRANSFORMING"
+    assert result["transformation"]["parts_produced"] == 2
+    assert result["transformation"]["seconds"] == 600.0
+    assert result["transformation"]["rows_produced"] is None
+    assert result["upload"] is None
+
+
+def test_progress_uploading(s3_client):
+    started_on = datetime.now(timezone.utc) - timedelta(minutes=10)
+    keys = write_parts(s3_client, 4)
+    manifest_written = write_manifest(s3_client, keys)
+    tag_uploaded(s3_client, keys[0], 90, manifest_written + timedelta(seconds=5))
+    tag_uploaded(s3_client, keys[1], 95, manifest_written + timedelta(seconds=8))
+    run = make_run("SUCCEEDED", started_on, started_on + timedelta(minutes=5))
+    result = progress(s3_client, run, now=manifest_written + timedelta(seconds=10))
+    assert result["phase"] == "UPLOADING"
+    assert result["transformation"] == {
+        "rows_read": 1000,
+        "parts_produced": 4,
+        "rows_produced": 400,
+        "seconds": 300.0,
+        "rows_per_second": 1.3,
+        "stages": {"read": {"seconds": 2.0, "rows": 1000, "rows_per_second": 500.0}},
+    }
+    assert result["upload"] == {
+        "parts_total": 4,
+        "parts_uploaded": 2,
+        "rows_uploaded": 200,
+        "users_uploaded": 185,
+        "seconds": 10.0,
+        "rows_per_second": 20.0,
+        "eta_seconds": 10.0,
+    }
+
+    tag_uploaded(s3_client, keys[2], 100, manifest_written + timedelta(seconds=15))
+    tag_uploaded(s3_client, keys[3], 100, manifest_written + timedelta(seconds=20))
+    result = progress(s3_client, run)
+    assert result["phase"] == "UPLOADED"
+    # the upload ends with its last part
+    assert result["upload"]["seconds"] == 20.0
+    assert result["upload"]["eta_seconds"] is None
+
+
+def test_progress_errors(s3_client):
+    result = progress(s3_client, make_run("FAILED", datetime.now(timezone.utc) - timedelta(minutes=1)))
+    assert result["phase"] == "TRANSFORMATION_FAILED"
+    assert result["transformation"]["parts_produced"] == 0
+    with pytest.raises(ValueError, match="no transformation run"):
+        read_audience_progress(s3_client, FakeGlue([]), JobRunsCache("job"), BUCKET, "snap", "segment")
+    with pytest.raises(ValueError, match="platform"):
+        read_audience_progress(s3_client, FakeGlue([]), JobRunsCache("job"), BUCKET, "meta", "segment")
+
+
+
+def test_progress_part_uploaded_in_two_attempts(s3_client, monkeypatch):
+    # the uploader records the users of a part resumed from its checkpoint
+    for name, value in (("REFRESH_SECRET_NAME", "Test"), ("CRED_SECRET_NAME", "Test"), ("SOLUTION_ID", "SO0226"),
+                        ("SOLUTION_VERSION", "v1.0.0"), ("AWS_REGION", "us-east-1")):
+        monkeypatch.setenv(name, value)
+    snap_handler = pytest.importorskip("snap.uploader.lambda_handler")
+    monkeypatch.setattr(snap_handler, "s3_client", s3_client)
+    monkeypatch.setattr(snap_handler, "CHECKPOINT_STORE", "s3")
+    monkeypatch.setattr(snap_handler, "USERS_PER_REQUEST", 2)
+    started_on = datetime.now(timezone.utc) - timedelta(minutes=10)
+    keys = write_parts(s3_client, 1)
+    write_manifest(s3_client, keys, rows=5)
+    batches = []
+
+    def add_users(access_token, segment_id, schema, data):
+        if len(batches) == 2:
+            raise snap_handler.RetryableUploadError("throttled")
+        batches.append(data)
+        return {"users": [{"user": {"number_uploaded_users": len(data)}}]}
+
+    monkeypatch.setattr(snap_handler, "add_users", add_users)
+    destination = snap_handler.SnapDestination(BUCKET, "token", "1", "segment")
+    hashes = ["hash_{}".format(i) for i in range(5)]
+    with pytest.raises(snap_handler.RetryableUploadError):
+        destination.upload({"key": keys[0]}, ("EMAIL_SHA256", hashes, snap_handler.get_checkpoint(BUCKET, keys[0])))
+    batches.clear()
+    users_uploaded = destination.upload({"key": keys[0]}, ("EMAIL_SHA256", hashes, snap_handler.get_checkpoint(BUCKET, keys[0])))
+    destination.part_uploaded(BUCKET, {"key": keys[0]}, [users_uploaded])
+
+    run = make_run("SUCCEEDED", started_on, started_on + timedelta(minutes=5))
+    result = progress(s3_client, run)
+    assert result["phase"] == "UPLOADED"
+    assert result["upload"]["users_uploaded"] == 5
@@ -0,0 +1,88 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import io
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from chalicelib import schema_sniffer
+from chalicelib.schema_sniffer import sniff_columns
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    # moto stores the aws-chunked uploads of recent botocore versions as is
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    schema_sniffer._columns_cache.clear()
+    with mock_s3():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket="test_bucket")
+        yield s3_client
+
+
+def test_sniff_json_columns(s3_client, mocker):
+    body = "".join('{"e-mail": "a@b.com", "phone_number": "1", "age": 3}\n' for _ in range(10000)).encode()
+    s3_client.put_object(Bucket="test_bucket", Key="data.json", Body=body)
+    get_object = mocker.spy(s3_client, "get_object")
+    assert sniff_columns(s3_client, "test_bucket", "data.json", "JSON") == ["e-mail", "phone_number", "age"]
+    # only the beginning of the object is read
+    assert get_object.call_args.kwargs["Range"] == "bytes=0-{}".format(schema_sniffer.SNIFF_BYTES - 1)
+
+
+def test_sniff_csv_columns(s3_client):
+    s3_client.put_object(Bucket="test_bucket", Key="data.csv", Body=b'\xef\xbb\xbfe-mail,"phone, number"\r\na@b.com,1\r\n')
+    assert sniff_columns(s3_client, "test_bucket", "data.csv", "CSV") == ["e-mail", "phone, number"]
+
+
+def test_sniff_long_first_line(s3_client, mocker):
+    mocker.patch.object(schema_sniffer, "SNIFF_BYTES", 16)
+    s3_client.put_object(Bucket="test_bucket", Key="data.json", Body=b'{"a_long_column_name": 1, "b": 2}\n{}\n')
+    assert sniff_columns(s3_client, "test_bucket", "data.json", "JSON") == ["a_long_column_name", "b"]
+
+    # single line without a line break
+    s3_client.put_object(Bucket="test_bucket", Key="one.json", Body=b'{"a_long_column_name": 1}')
+    assert sniff_columns(s3_client, "test_bucket", "one.json", "JSON") == ["a_long_column_name"]
+
+    mocker.patch.object(schema_sniffer, "MAX_SNIFF_BYTES", 16)
+    s3_client.put_object(Bucket="test_bucket", Key="long.json", Body=b'{"a_long_column_name": 1, "b": 2}\n')
+    with pytest.raises(ValueError):
+        sniff_columns(s3_client, "test_bucket", "long.json", "JSON")
+
+
+def test_sniff_columns_cache(s3_client, mocker):
+    s3_client.put_object(Bucket="test_bucket", Key="data.json", Body=b'{"a": 1}\n')
+    assert sniff_columns(s3_client, "test_bucket", "data.json", "JSON") == ["a"]
+    get_object = mocker.spy(s3_client, "get_object")
+    assert sniff_columns(s3_client, "test_bucket", "data.json", "JSON") == ["a"]
+    get_object.assert_not_called()
+
+    # a new version of the object has a new ETag
+    s3_client.put_object(Bucket="test_bucket", Key="data.json", Body=b'{"b": 1}\n')
+    assert sniff_columns(s3_client, "test_bucket", "data.json", "JSON") == ["b"]
+
+
+def test_sniff_columns_invalid(s3_client):
+    s3_client.put_object(Bucket="test_bucket", Key="empty.json", Body=b"")
+    s3_client.put_object(Bucket="test_bucket", Key="list.json", Body=b"[1, 2]\n")
+    with pytest.raises(ValueError):
+        sniff_columns(s3_client, "test_bucket", "empty.json", "JSON")
+    with pytest.raises(ValueError):
+        sniff_columns(s3_client, "test_bucket", "list.json", "JSON")
+    with pytest.raises(ValueError):
+        sniff_columns(s3_client, "test_bucket", "list.json", "AVRO")
+    with pytest.raises(ValueError):
+        sniff_columns(s3_client, "test_bucket", "list.json", "PARQUET")
+
+
+def test_sniff_parquet_columns(s3_client, mocker):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    table = pa.table({"e-mail": ["a@b.com"] * 100000, "phone_number": [str(i) for i in range(100000)]})
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    s3_client.put_object(Bucket="test_bucket", Key="data.parquet", Body=buffer.getvalue())
+    get_object = mocker.spy(s3_client, "get_object")
+    assert sniff_columns(s3_client, "test_bucket", "data.parquet", "PARQUET") == ["e-mail", "phone_number"]
+    assert get_object.call_count == 1
@@ -0,0 +1,160 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import bz2
+import gzip
+import json
+import random
+from collections import Counter
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from chalicelib.size_estimator import (
+    DECOMPRESSORS, CompressedLines, HyperLogLog, count_parts, estimate_distinct, estimate_size,
+)
+
+BUCKET = "data"
+ROWS = 20000
+PII_FIELDS = [{"column_name": "email", "pii_type": "EMAIL"}, {"column_name": "phone", "pii_type": "PHONE"}]
+
+
+def make_records(rows=ROWS):
+    rng = random.Random(0)
+    records = []
+    for i in range(rows):
+        # one phone in 4 is missing, the others are shared by 40 users on average
+        phone = "" if i % 4 == 0 else "+1555{:07d}".format(rng.randrange(375))
+        records.append({"email": "user{}@example.com".format(i), "phone": phone, "segment": "a" * rng.randrange(50)})
+    return records
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    # moto stores the aws-chunked uploads of recent botocore versions as is
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    with mock_s3():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+        body = "".join(json.dumps(record) + "\n" for record in make_records())
+        s3_client.put_object(Bucket=BUCKET, Key="input.json", Body=body.encode())
+        # two members, as written by parallel compressors
+        half = len(body) // 2
+        s3_client.put_object(Bucket=BUCKET, Key="input.json.gz", Body=gzip.compress(body[:half].encode()) + gzip.compress(body[half:].encode()))
+        s3_client.put_object(Bucket=BUCKET, Key="input.json.bz2", Body=bz2.compress(body.encode()))
+        s3_client.put_object(Bucket=BUCKET, Key="input.json.zst", Body=b"zstd")
+        s3_client.put_object(Bucket=BUCKET, Key="small.json", Body=b'{"email": "a"}\n{"email": null}\n{"email": "a"}')
+        yield s3_client
+
+
+def test_estimate_size_sample(s3_client):
+    estimate = estimate_size(s3_client, BUCKET, "input.json", PII_FIELDS, "snap", sample_bytes=256 * 1024)
+    assert estimate["method"] == "sample"
+    assert estimate["sampled_bytes"] < 256 * 1024
+    assert estimate["estimated_rows"] == pytest.approx(ROWS, rel=0.05)
+    email = estimate["columns"]["email"]
+    assert email["non_null_rate"] == 1.0
+    assert email["estimated_distinct"] == pytest.approx(ROWS, rel=0.1)
+    phone = estimate["columns"]["phone"]
+    assert phone["non_null_rate"] == pytest.approx(0.75, abs=0.02)
+    # the sample holds most of the phones, they are not extrapolated like unique values
+    assert phone["estimated_distinct"] == pytest.approx(375, rel=0.1)
+    assert estimate["estimated_output_rows"] == pytest.approx(1.75 * ROWS, rel=0.05)
+    assert estimate["estimated_parts"] == 1
+    assert estimate["estimated_upload_seconds"] == pytest.approx(estimate["estimated_output_rows"] / 10000, abs=0.1)
+
+
+def test_estimate_size_scan(s3_client):
+    estimate = estimate_size(s3_client, BUCKET, "input.json", PII_FIELDS, "tiktok", scan=True, upload_rows_per_second=100)
+    assert estimate["method"] == "scan"
+    assert estimate["sampled_rows"] == estimate["estimated_rows"] == ROWS
+    assert estimate["columns"]["email"]["estimated_non_null_rows"] == ROWS
+    assert estimate["columns"]["phone"]["estimated_non_null_rows"] == ROWS * 3 // 4
+    assert estimate["columns"]["email"]["estimated_distinct"] == pytest.approx(ROWS, rel=0.03)
+    assert estimate["columns"]["phone"]["estimated_distinct"] == pytest.approx(375, rel=0.03)
+    # one TikTok part per PII type
+    assert estimate["estimated_parts"] == 2
+    assert estimate["estimated_upload_seconds"] == ROWS * 1.75 / 100
+
+
+def test_estimate_size_compressed(s3_client, monkeypatch):
+    for key in ["input.json.gz", "input.json.bz2"]:
+        estimate = estimate_size(s3_client, BUCKET, key, PII_FIELDS, "tiktok", scan=True)
+        assert estimate["sampled_rows"] == estimate["estimated_rows"] == ROWS
+        assert estimate["columns"]["phone"]["estimated_non_null_rows"] == ROWS * 3 // 4
+
+    # the sample is decompressed from the beginning of the object
+    monkeypatch.setattr("chalicelib.size_estimator.COMPRESSED_CHUNK_BYTES", 4096)
+    estimate = estimate_size(s3_client, BUCKET, "input.json.gz", PII_FIELDS, "snap", sample_bytes=100000)
+    assert estimate["method"] == "sample"
+    assert estimate["sampled_bytes"] < estimate["content_length"]
+    assert estimate["estimated_rows"] == pytest.approx(ROWS, rel=0.2)
+    assert estimate["columns"]["phone"]["non_null_rate"] == pytest.approx(0.75, abs=0.01)
+
+    with pytest.raises(ValueError, match="cannot estimate"):
+        estimate_size(s3_client, BUCKET, "input.json.zst", PII_FIELDS, "snap")
+
+
+def test_estimate_size_compressed_scan_limit(s3_client, monkeypatch):
+    content_length = s3_client.head_object(Bucket=BUCKET, Key="input.json.gz")["ContentLength"]
+    # the compressed object fits in a scan, its decompressed lines do not
+    monkeypatch.setattr("chalicelib.size_estimator.MAX_SCAN_BYTES", content_length * 2)
+    monkeypatch.setattr("chalicelib.size_estimator.COMPRESSED_CHUNK_BYTES", 4096)
+    for key in ["input.json.gz", "input.json.bz2"]:
+        with pytest.raises(ValueError, match="decompresses to more than"):
+            estimate_size(s3_client, BUCKET, key, PII_FIELDS, "snap", scan=True)
+
+
+def test_compressed_lines(s3_client, monkeypatch):
+    monkeypatch.setattr("chalicelib.size_estimator.COMPRESSED_CHUNK_BYTES", 4096)
+    lines = CompressedLines(s3_client, BUCKET, "input.json.gz", DECOMPRESSORS[".gz"], 10000)
+    read = list(lines)
+    # complete lines only, within the limit
+    assert sum(len(line) + 1 for line in read) <= 10000
+    assert all(line.endswith(b"}") for line in read)
+    assert lines.truncated
+    assert 0 < lines.compressed_bytes < 10000
+
+    lines = CompressedLines(s3_client, BUCKET, "input.json.gz", DECOMPRESSORS[".gz"], 100 * 1024**2)
+    assert len(list(lines)) == ROWS
+    assert not lines.truncated
+    assert lines.compressed_bytes == s3_client.head_object(Bucket=BUCKET, Key="input.json.gz")["ContentLength"]
+
+
+def test_estimate_size_small_object(s3_client):
+    # read entirely, the estimates are exact
+    estimate = estimate_size(s3_client, BUCKET, "small.json", PII_FIELDS[:1], "snap")
+    assert estimate["sampled_rows"] == estimate["estimated_rows"] == 3
+    assert estimate["columns"]["email"] == {
+        "pii_type": "EMAIL", "non_null_rate": 0.6667, "estimated_non_null_rows": 2, "estimated_distinct": 1}
+
+
+def test_estimate_size_errors(s3_client):
+    with pytest.raises(ValueError, match="platform"):
+        estimate_size(s3_client, BUCKET, "input.json", PII_FIELDS, "meta")
+    with pytest.raises(ValueError, match="sample_bytes"):
+        estimate_size(s3_client, BUCKET, "input.json", PII_FIELDS, "snap", sample_bytes=0)
+    with pytest.raises(ValueError, match="no complete line"):
+        estimate_size(s3_client, BUCKET, "input.json", PII_FIELDS, "snap", sample_bytes=64)
+
+
+def test_hyperloglog():
+    sketch = HyperLogLog()
+    assert sketch.count() == 0
+    for i in range(100000):
+        sketch.add(str(i % 50000))
+    assert sketch.count() == pytest.approx(50000, rel=0.03)
+
+
+def test_estimate_distinct():
+    # every value of the sample seen once: as many distinct values as rows
+    assert estimate_distinct(100, 1000, Counter(str(i) for i in range(100))) == 1000
+    # every value seen several times: the sample already holds them all
+    assert estimate_distinct(100, 1000, Counter(str(i % 10) for i in range(100))) == 10
+    assert estimate_distinct(100, 100, Counter(str(i) for i in range(100))) == 100
+
+
+def test_count_parts():
+    assert count_parts("snap", {"EMAIL": 150000, "PHONE": 60000}) == 3
+    assert count_parts("tiktok", {"EMAIL": 1000000, "PHONE": 0}) == 2
@@ -9,16 +9,17 @@ os.environ['AMC_ENDPOINT_URL'] = "Test"
 os.environ['AMC_API_ROLE_ARN'] = "Test"
 os.environ['VERSION'] = "v1.0.0"
 os.environ['AMC_GLUE_JOB_NAME'] = "Test"
+os.environ['ARTIFACT_BUCKET_NAME'] = "Test"
+os.environ['BATCH_QUEUE_URL'] = "Test"
 os.environ['AWS_REGION'] = "us-east-1"
 import app
 
 @pytest.mark.filterwarnings("ignore:IAMAuthorizer")
 def test_start_snap_transformation(mocker):
     session_client_mocker = mocker.MagicMock()
-    session_client_mocker.client.return_value = session_client_mocker
     expected_return = {"JobRunId": "test_id"}
     session_client_mocker.start_job_run.return_value = expected_return
-    mocker.patch("app.boto3.session.Session", return_value=session_client_mocker)
+    mocker.patch("chalicelib.snap_api.get_service_client", return_value=session_client_mocker)
 
     with Client(app.app) as client:
         response = client.http.post('/start_snap_transformation?',
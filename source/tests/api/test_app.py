@@ -0,0 +1,245 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import json
+from datetime import datetime, timezone
+
+import boto3
+import pytest
+from chalice.test import Client
+from moto import mock_s3
+
+os.environ['AMC_ENDPOINT_URL'] = "Test"
+os.environ['AMC_API_ROLE_ARN'] = "Test"
+os.environ['VERSION'] = "v1.0.0"
+os.environ['AMC_GLUE_JOB_NAME'] = "Test"
+os.environ['ARTIFACT_BUCKET_NAME'] = "Test"
+os.environ['BATCH_QUEUE_URL'] = "Test"
+os.environ['AWS_REGION'] = "us-east-1"
+import app
+from chalicelib.job_runs import JobRunsCache
+
+
+@pytest.fixture(autouse=True)
+def request_context(mocker):
+    # the test client does not set the IAM identity of the caller
+    mocker.patch("app.log_request_parameters")
+
+
+@pytest.fixture
+def data_bucket(monkeypatch):
+    # moto stores the aws-chunked uploads of recent botocore versions as is
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    with mock_s3():
+        s3 = boto3.client('s3', region_name="us-east-1")
+        s3.create_bucket(Bucket="test_bucket")
+        for key in ["a.json", "b.json", "c.json", "folder/d.json", "folder/e.json"]:
+            s3.put_object(Bucket="test_bucket", Key=key, Body=b"{}")
+        yield "test_bucket"
+
+
+def post_list_bucket(client, **body):
+    response = client.http.post('/list_bucket',
+                                headers={'Content-Type': 'application/json'},
+                                body=json.dumps(body))
+    return response
+
+
+@pytest.mark.filterwarnings("ignore:IAMAuthorizer")
+def test_list_bucket(data_bucket):
+    with Client(app.app) as client:
+        page = post_list_bucket(client, s3bucket=data_bucket).json_body
+    assert [s3object["key"] for s3object in page["objects"]] == ["a.json", "b.json", "c.json", "folder/d.json", "folder/e.json"]
+    assert page["objects"][0]["size"] == 2
+    assert page["prefixes"] == []
+    assert page["next_continuation_token"] is None
+
+
+@pytest.mark.filterwarnings("ignore:IAMAuthorizer")
+def test_list_bucket_pages(data_bucket):
+    keys = []
+    with Client(app.app) as client:
+        page = post_list_bucket(client, s3bucket=data_bucket, max_keys=2).json_body
+        keys += [s3object["key"] for s3object in page["objects"]]
+        while page["next_continuation_token"]:
+            page = post_list_bucket(client, s3bucket=data_bucket, max_keys=2,
+                                    continuation_token=page["next_continuation_token"]).json_body
+            assert len(page["objects"]) <= 2
+            keys += [s3object["key"] for s3object in page["objects"]]
+    assert keys == ["a.json", "b.json", "c.json", "folder/d.json", "folder/e.json"]
+
+
+@pytest.mark.filterwarnings("ignore:IAMAuthorizer")
+def test_list_bucket_folders(data_bucket):
+    with Client(app.app) as client:
+        page = post_list_bucket(client, s3bucket=data_bucket, delimiter="/").json_body
+        assert [s3object["key"] for s3object in page["objects"]] == ["a.json", "b.json", "c.json"]
+        assert page["prefixes"] == ["folder/"]
+
+        page = post_list_bucket(client, s3bucket=data_bucket, prefix="folder/", delimiter="/").json_body
+        assert [s3object["key"] for s3object in page["objects"]] == ["folder/d.json", "folder/e.json"]
+
+
+@pytest.mark.filterwarnings("ignore:IAMAuthorizer")
+def test_list_bucket_max_keys(data_bucket):
+    with Client(app.app) as client:
+        assert post_list_bucket(client, s3bucket=data_bucket, max_keys=0).status_code == 500
+        assert post_list_bucket(client, s3bucket=data_bucket, max_keys=1001).status_code == 500
+
+
+@pytest.fixture
+def data_file(data_bucket):
+    s3 = boto3.client('s3', region_name="us-east-1")
+    body = "".join('{"id": ' + str(i) + '}\n' for i in range(1000)).encode()
+    s3.put_object(Bucket=data_bucket, Key="data.json", Body=body)
+    s3.put_object(Bucket=data_bucket, Key="empty.json", Body=b"")
+    yield data_bucket, "data.json", body
+
+
+def post_read_file(client, **body):
+    return client.http.post('/read_file',
+                            headers={'Content-Type': 'application/json'},
+                            body=json.dumps(body))
+
+
+@pytest.mark.filterwarnings("ignore:IAMAuthorizer")
+def test_read_file(data_file, mocker):
+    bucket, key, body = data_file
+    s3 = boto3.client('s3', region_name="us-east-1")
+    mocker.patch("app.get_service_client", return_value=s3)
+    get_object = mocker.spy(s3, "get_object")
+    with Client(app.app) as client:
+        metadata = post_read_file(client, s3bucket=bucket, s3key=key).json_body
+    assert metadata["HTTPStatusCode"] == 200
+    assert "etag" in metadata["HTTPHeaders"]
+    assert "preview" not in metadata
+    # metadata only, the object is not downloaded
+    get_object.assert_not_called()
+
+
+@pytest.mark.filterwarnings("ignore:IAMAuthorizer")
+def test_read_file_preview(data_file, mocker):
+    bucket, key, _ = data_file
+    s3 = boto3.client('s3', region_name="us-east-1")
+    mocker.patch("app.get_service_client", return_value=s3)
+    get_object = mocker.spy(s3, "get_object")
+    with Client(app.app) as client:
+        metadata = post_read_file(client, s3bucket=bucket, s3key=key, preview_bytes=20).json_body
+        assert metadata["preview"] == '{"id": 0}\n{"id": 1}\n'
+        assert get_object.call_args.kwargs["Range"] == "bytes=0-19"
+
+        metadata = post_read_file(client, s3bucket=bucket, s3key=key, preview_rows=3).json_body
+        assert metadata["preview"] == '{"id": 0}\n{"id": 1}\n{"id": 2}'
+
+        # complete lines only
+        metadata = post_read_file(client, s3bucket=bucket, s3key=key, preview_bytes=25, preview_rows=5).json_body
+        assert metadata["preview"] == '{"id": 0}\n{"id": 1}'
+
+        metadata = post_read_file(client, s3bucket=bucket, s3key="empty.json", preview_rows=3).json_body
+        assert metadata["preview"] == ""
+
+        assert post_read_file(client, s3bucket=bucket, s3key=key, preview_bytes=0).status_code == 500
+        assert post_read_file(client, s3bucket=bucket, s3key=key, preview_bytes=2 * 1024**2).status_code == 500
+
+
+@pytest.mark.filterwarnings("ignore:IAMAuthorizer")
+def test_get_data_columns(data_file):
+    bucket, key, _ = data_file
+    with Client(app.app) as client:
+        response = client.http.post('/get_data_columns',
+                                    headers={'Content-Type': 'application/json'},
+                                    body=json.dumps({"s3bucket": bucket, "s3key": key, "file_format": "JSON"}))
+        assert response.json_body == {"columns": ["id"]}
+
+        response = client.http.post('/get_data_columns',
+                                    headers={'Content-Type': 'application/json'},
+                                    body=json.dumps({"s3bucket": bucket, "s3key": key, "file_format": "AVRO"}))
+        assert response.status_code == 500
+
+
+@pytest.mark.filterwarnings("ignore:IAMAuthorizer")
+def test_get_etl_jobs(mocker):
+    glue_client = mocker.MagicMock()
+    started_on = datetime(2023, 3, 1, 12, 0, tzinfo=timezone.utc)
+    glue_client.get_job_runs.return_value = {"JobRuns": [
+        {"Id": "jr_1", "JobRunState": "RUNNING", "StartedOn": started_on, "Arguments": {"--segment_name": "a"}},
+        {"Id": "jr_2", "JobRunState": "SUCCEEDED", "StartedOn": started_on, "Arguments": {"--segment_name": "b"}},
+    ]}
+    mocker.patch("app.get_service_client", return_value=glue_client)
+    mocker.patch("app.job_runs_cache", JobRunsCache("Test"))
+    with Client(app.app) as client:
+        response = client.http.get('/get_etl_jobs?segment_name=b').json_body
+        assert [run["Id"] for run in response["JobRuns"]] == ["jr_2"]
+        assert response["JobRuns"][0]["SegmentName"] == "b"
+        assert response["JobRuns"][0]["StartedOn"] == "2023-03-01 12:00:00+00:00"
+        assert response["NextToken"] is None
+        assert response["PolledAt"]
+
+        assert client.http.get('/get_etl_jobs?max_results=500').status_code == 500
+
+
+@pytest.mark.filterwarnings("ignore:IAMAuthorizer")
+def test_start_transformations(mocker):
+    entries = [{"sourceBucket": "1", "sourceKey": "a.json", "outputBucket": "3", "piiFields": "[]", "segmentName": "a"},
+               {"sourceBucket": "1", "sourceKey": "b.json", "outputBucket": "3", "piiFields": "[]", "segmentName": "b"}]
+    start_batch = mocker.patch("app.start_batch", return_value=(
+        [{"segmentName": "a", "sourceKey": "a.json", "JobRunId": "jr_1"}], entries[1:], []))
+    client = mocker.MagicMock()
+    mocker.patch("app.get_service_client", return_value=client)
+    with Client(app.app) as test_client:
+        response = test_client.http.post('/start_transformations',
+                                         headers={'Content-Type': 'application/json'},
+                                         body=json.dumps({"entries": entries}))
+        assert response.json_body == {"started": [{"segmentName": "a", "sourceKey": "a.json", "JobRunId": "jr_1"}],
+                                      "queued": entries[1:], "failed": []}
+        start_batch.assert_called_once_with(client, client, "Test", "Test", entries)
+
+        start_batch.side_effect = ValueError("ERROR : invalid batch")
+        response = test_client.http.post('/start_transformations',
+                                         headers={'Content-Type': 'application/json'},
+                                         body=json.dumps({"entries": entries}))
+        assert response.status_code == 500
+
+
+def test_start_queued_transformations(mocker):
+    start_queued = mocker.patch("app.start_queued", return_value=([{"segmentName": "a", "sourceKey": "a.json", "JobRunId": "jr_1"}], []))
+    mocker.patch("app.get_service_client")
+    with Client(app.app) as client:
+        event = client.events.generate_cw_event(
+            source="aws.glue", detail_type="Glue Job State Change", detail={"jobName": "Other", "state": "SUCCEEDED"}, resources=[])
+        client.lambda_.invoke("start_queued_transformations", event)
+        start_queued.assert_not_called()
+
+        event["detail"]["jobName"] = "Test"
+        client.lambda_.invoke("start_queued_transformations", event)
+        start_queued.assert_called_once()
+
+
+@pytest.mark.filterwarnings("ignore:IAMAuthorizer")
+def test_get_audience_progress(mocker):
+    read_audience_progress = mocker.patch("app.read_audience_progress", return_value={"phase": "UPLOADING"})
+    mocker.patch("app.get_service_client")
+    with Client(app.app) as client:
+        response = client.http.get('/get_audience_progress?platform=snap&segment_name=a')
+        assert response.json_body == {"phase": "UPLOADING"}
+        assert read_audience_progress.call_args.args[3:] == ("Test", "snap", "a")
+
+        assert client.http.get('/get_audience_progress?platform=snap').status_code == 500
+
+
+@pytest.mark.filterwarnings("ignore:IAMAuthorizer")
+def test_estimate_audience_size(mocker):
+    estimate_size = mocker.patch("app.estimate_size", return_value={"estimated_rows": 10})
+    s3 = mocker.MagicMock()
+    mocker.patch("app.get_service_client", return_value=s3)
+    pii_fields = [{"column_name": "email", "pii_type": "EMAIL"}]
+    body = {"s3bucket": "data", "s3key": "input.json", "pii_fields": json.dumps(pii_fields), "platform": "snap"}
+    with Client(app.app) as client:
+        response = client.http.post('/estimate_audience_size', headers={'Content-Type': 'application/json'}, body=json.dumps(body))
+        assert response.json_body == {"estimated_rows": 10}
+        estimate_size.assert_called_once_with(s3, "data", "input.json", pii_fields, "snap", 1024 * 1024, False, None)
+
+        body["upload_rows_per_second"] = 0
+        response = client.http.post('/estimate_audience_size', headers={'Content-Type': 'application/json'}, body=json.dumps(body))
+        assert response.status_code == 500
@@ -17,6 +17,7 @@ os.environ["SOLUTION_ID"] = "SO0226"
 os.environ["SOLUTION_VERSION"] = "v1.0.0"
 os.environ["SOLUTION_NAME"] = "audience-uploader-from-aws-clean-rooms"
 os.environ["AWS_REGION"] = "us-east-1"
+os.environ["CHECKPOINT_STORE"] = "memory"
 
 TEST_CREDENTIALS = {"ad_account_id": "test_account_id", "expires_at": "test", "access_token": "test_access_token", "client_id": "test", "client_secret": "test", "refresh_token": "test"}
 TEST_CREDENTIALS_2 = {"ad_account_id": "test_account_id_2"}
@@ -59,4 +60,13 @@ def create_times():
     now = datetime.now()
     expired = now - timedelta(hours=1)
     unexpired = now + timedelta(hours=1)
-    yield expired.strftime("%Y-%m-%d %H:00:00"), unexpired.strftime("%Y-%m-%d %H:00:00")
\ No newline at end of file
+    yield expired.strftime("%Y-%m-%d %H:00:00"), unexpired.strftime("%Y-%m-%d %H:00:00")
+
+
+FAKE_MANIFEST_EVENT = {"Records": [{"body":"""{"detail": {"bucket": {"name": "test_bucket_name"}, "object": {"key": "output/test2/test3/test4_manifest.json"}}}"""}]}
+FAKE_THROTTLED_MANIFEST_EVENT = {"Records": [{
+    "body": """{"detail": {"bucket": {"name": "test_bucket_name"}, "object": {"key": "output/test2/test3/test4_manifest.json"}}}""",
+    "receiptHandle": "test_receipt_handle",
+    "eventSourceARN": "arn:aws:sqs:us-east-1:111111111111:test_queue",
+    "attributes": {"ApproximateReceiveCount": "3"},
+}]}
@@ -0,0 +1,282 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+###############################################################################
+# PURPOSE:
+#   Local stand-in for the partner APIs called by the uploader lambdas, to
+#   benchmark and regression-test batching, concurrency and retries offline:
+#     - Snap Marketing API: list segments, add users to a segment
+#     - TikTok API for Business: upload a custom audience file, create,
+#       update and list custom audiences
+#   Every request waits for a configurable latency, requests beyond the rate
+#   limit are throttled the way each API does it, and errors can be injected
+#   at random or for the next requests.
+#
+# SAMPLE COMMAND-LINE USAGE:
+#
+#    python tests/aws_lambda/mock_partner_api.py --port 8080 --latency 0.2 --rate-limit 20
+#    SNAP_API_URL=http://127.0.0.1:8080 TIKTOK_API_URL=http://127.0.0.1:8080 ...
+#
+###############################################################################
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SNAP_SEGMENTS_PATH = re.compile(r"^/v1/adaccounts/(?P<ad_account_id>[^/]+)/segments$")
+SNAP_USERS_PATH = re.compile(r"^/v1/segments/(?P<segment_id>[^/]+)/users$")
+TIKTOK_PATH = "/open_api/v1.3/dmp/custom_audience/"
+# TikTok answers with HTTP 200 and an error code in the body
+TIKTOK_RATE_LIMIT_CODE = 40100
+TIKTOK_INTERNAL_ERROR_CODE = 50000
+
+
+class MockPartnerApi:
+    """
+    Snap and TikTok API stand-in served on a local port. The state of the server (segments,
+    audiences, uploaded users and files, request counts) can be read by the tests.
+    """
+
+    def __init__(self, latency=0.0, rate_limit=None, error_rate=0.0, retry_after=1, segments=None, seed=0):
+        """
+        :param latency: seconds before each response
+        :param rate_limit: requests per second accepted per platform, None for no limit
+        :param error_rate: share of the requests answered with a server error
+        :param retry_after: Retry-After of the throttled Snap requests, in seconds
+        :param segments: dict of Snap segment name to id
+        """
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.segments = dict(segments or {})
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent_requests = {"snap": deque(), "tiktok": deque()}
+        self.injected_errors = deque()
+        # number of requests per endpoint, and of throttled and failed requests
+        self.requests = Counter()
+        self.throttled = 0
+        self.errors = 0
+        # Snap segment id to the number of users added
+        self.users = Counter()
+        # TikTok file path to (calculate type, number of hashes)
+        self.files = {}
+        # TikTok custom audience id to its name, calculate type and file paths
+        self.audiences = {}
+        self.server = None
+
+    def inject_errors(self, count, status=500, after=0):
+        """
+        Answer count requests with an error: a Snap HTTP status, or throttling when status is 429
+        :param after: number of requests served normally before the errors
+        """
+        with self.lock:
+            self.injected_errors.extend([None] * after + [status] * count)
+
+    def start(self, port=0):
+        """
+        Serve the API in a background thread
+        :return: base URL of the API, for SNAP_API_URL and TIKTOK_API_URL
+        """
+        api = self
+
+        class Handler(MockPartnerApiHandler):
+            pass
+
+        Handler.api = api
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def admit(self, platform, endpoint):
+        """
+        Count a request and decide how to answer it
+        :return: None to serve the request, "throttle", or the HTTP status of a server error
+        """
+        with self.lock:
+            self.requests[endpoint] += 1
+            status = self.injected_errors.popleft() if self.injected_errors else None
+            if status == 429:
+                self.throttled += 1
+                return "throttle"
+            if status is not None:
+                self.errors += 1
+                return status
+            if self.rate_limit:
+                now = time.monotonic()
+                recent = self.recent_requests[platform]
+                while recent and recent[0] <= now - 1:
+                    recent.popleft()
+                if len(recent) >= self.rate_limit:
+                    self.throttled += 1
+                    return "throttle"
+                recent.append(now)
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return 500
+        return None
+
+
+class MockPartnerApiHandler(BaseHTTPRequestHandler):
+    api = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, document, status=200, headers=None):
+        payload = json.dumps(document).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        body = self.read_body()
+        platform = "tiktok" if url.path.startswith(TIKTOK_PATH) else "snap"
+        outcome = self.api.admit(platform, method + " " + url.path)
+        time.sleep(self.api.latency)
+        if platform == "tiktok":
+            if outcome == "throttle":
+                return self.send_json({"code": TIKTOK_RATE_LIMIT_CODE, "message": "Too many requests"})
+            if outcome is not None:
+                return self.send_json({"code": TIKTOK_INTERNAL_ERROR_CODE, "message": "Internal error"})
+            return self.send_json(self.tiktok(method, url, body))
+        if outcome == "throttle":
+            return self.send_json({"request_status": "ERROR", "debug_message": "Too many requests"}, 429, {"Retry-After": str(self.api.retry_after)})
+        if outcome is not None:
+            return self.send_json({"request_status": "ERROR", "debug_message": "Internal error"}, outcome)
+        return self.send_json(*self.snap(method, url, body))
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    ###############################
+    # SNAP
+    ###############################
+
+    def snap(self, method, url, body):
+        api = self.api
+        if method == "GET" and SNAP_SEGMENTS_PATH.match(url.path):
+            segments = [{"segment": {"name": name, "id": segment_id}} for name, segment_id in api.segments.items()]
+            return {"request_status": "SUCCESS", "segments": segments}, 200
+        match = SNAP_USERS_PATH.match(url.path)
+        if method == "POST" and match:
+            users = json.loads(body)["users"][0]
+            with api.lock:
+                api.users[match.group("segment_id")] += len(users["data"])
+            return {
+                "request_status": "SUCCESS",
+                "users": [{"sub_request_status": "SUCCESS", "user": {"number_uploaded_users": len(users["data"])}}],
+            }, 200
+        return {"request_status": "ERROR", "debug_message": "Not found"}, 404
+
+    ###############################
+    # TIKTOK
+    ###############################
+
+    def tiktok_upload(self, body):
+        message = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param("name", header="content-disposition")] = part.get_payload(decode=True)
+        content = fields.get("file") or b""
+        if hashlib.md5(content).hexdigest() != fields.get("file_signature", b"").decode():  # nosec # NOSONAR checksum only
+            return {"code": 40002, "message": "file_signature does not match the file"}
+        file_path = "mock/" + hashlib.sha256(content).hexdigest()
+        with self.api.lock:
+            self.api.files[file_path] = (fields["calculate_type"].decode(), content.count(b"\n"))
+        return {"code": 0, "message": "OK", "data": {"file_path": file_path}}
+
+    def tiktok(self, method, url, body):
+        api = self.api
+        action = url.path[len(TIKTOK_PATH):].strip("/")
+        if method == "POST" and action == "file/upload":
+            return self.tiktok_upload(body)
+        if method == "POST" and action == "create":
+            request = json.loads(body)
+            with api.lock:
+                audience_id = str(len(api.audiences) + 1)
+                api.audiences[audience_id] = {
+                    "name": request["custom_audience_name"],
+                    "calculate_type": request["calculate_type"],
+                    "file_paths": list(request["file_paths"]),
+                }
+            return {"code": 0, "message": "OK", "data": {"custom_audience_id": audience_id}}
+        if method == "POST" and action == "update":
+            request = json.loads(body)
+            with api.lock:
+                if request["custom_audience_id"] not in api.audiences:
+                    return {"code": 40001, "message": "custom audience not found"}
+                api.audiences[request["custom_audience_id"]]["file_paths"].extend(request["file_paths"])
+            return {"code": 0, "message": "OK", "data": {}}
+        if method == "GET" and action == "list":
+            query = parse_qs(url.query)
+            page = int(query.get("page", ["1"])[0])
+            page_size = int(query.get("page_size", ["100"])[0])
+            audiences = [{"audience_id": audience_id, "name": audience["name"]} for audience_id, audience in api.audiences.items()]
+            total_page = max((len(audiences) + page_size - 1) // page_size, 1)
+            return {"code": 0, "message": "OK", "data": {
+                "list": audiences[(page - 1) * page_size:page * page_size],
+                "page_info": {"page": page, "page_size": page_size, "total_number": len(audiences), "total_page": total_page},
+            }}
+        return {"code": 40000, "message": "Not found"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Snap and TikTok APIs")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--rate-limit", type=int, default=None, help="requests per second per platform")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with a server error")
+    parser.add_argument("--segment", action="append", default=[], help="Snap segment as name=id, can be repeated")
+    args = parser.parse_args()
+
+    segments = dict(segment.split("=", 1) for segment in args.segment)
+    api = MockPartnerApi(args.latency, args.rate_limit, args.error_rate, segments=segments)
+    print("Serving the mock partner APIs on " + api.start(args.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()
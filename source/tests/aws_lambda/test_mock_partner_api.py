@@ -0,0 +1,127 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import hashlib
+import io
+
+from lambda_helpers import *
+from mock_partner_api import MockPartnerApi
+import snap.uploader.lambda_handler as snap_handler
+import tiktok.uploader.lambda_handler as tiktok_handler
+from upload_engine.outcome import USERS_UPLOADED_TAG
+
+TIKTOK_CREDENTIALS = {"ACCESS_TOKEN": "test", "ADVERTISER_ID": "test"}
+
+
+@pytest.fixture
+def mock_api():
+    with MockPartnerApi(segments={"test3": "1"}) as api:
+        yield api
+    snap_handler.MemoryCheckpoint.store.clear()
+
+
+def make_snap_parts(mocker, count, rows):
+    objects = {}
+    for i in range(count):
+        lines = "".join("{},hash_{}_{}\n".format("EMAIL_SHA256" if j % 2 else "PHONE_SHA256", i, j) for j in range(rows))
+        objects["output/snap/test3/mock_api" + str(i) + ".csv.gz"] = gzip.compress(("schema,hash\n" + lines).encode())
+    parts = [{"key": key, "rows": rows, "bytes": len(body), "md5": hashlib.md5(body).hexdigest()} for key, body in objects.items()]
+    mocker.patch.object(snap_handler, "read_manifest", return_value={"segment_name": "test3", "total_rows": count * rows, "parts": parts})
+    mocker.patch.object(snap_handler.s3_client, "get_object", side_effect=lambda Bucket, Key: {"Body": io.BytesIO(objects[Key])})
+    snap_handler.MemoryCheckpoint.store.clear()
+
+
+def make_tiktok_parts(mocker, count, rows):
+    objects = {}
+    for i in range(count):
+        objects["output/tiktok/test3/email_sha256/mock_api" + str(i) + ".csv"] = "".join("hash_{}_{}\n".format(i, j) for j in range(rows)).encode()
+    parts = [{"key": key, "rows": rows, "bytes": len(body), "md5": hashlib.md5(body).hexdigest()} for key, body in objects.items()]
+    mocker.patch.object(tiktok_handler, "read_manifest", return_value={"segment_name": "test3", "total_rows": count * rows, "parts": parts})
+    mocker.patch.object(tiktok_handler, "read_part", side_effect=lambda s3_client, bucket, part: objects[part["key"]])
+    mocker.patch.object(tiktok_handler, "get_tiktok_credentials", return_value=TIKTOK_CREDENTIALS)
+
+
+def test_snap_upload_manifest(mock_api, mocker):
+    mocker.patch.object(snap_handler, "SNAP_API_URL", mock_api.url)
+    mocker.patch.object(snap_handler, "USERS_PER_REQUEST", 3)
+    make_snap_parts(mocker, 4, 10)
+    summary = snap_handler.upload_manifest("test_bucket_name", "test_key", TEST_CREDENTIALS, TEST_CREDENTIALS)
+    assert summary == {"segment_name": "test3", "parts_uploaded": 4, "users_uploaded": 40}
+    assert mock_api.users["1"] == 40
+    # 5 users of each schema per part, in batches of 3
+    assert mock_api.requests["POST /v1/segments/1/users"] == 4 * 2 * 2
+
+
+def test_snap_upload_manifest_throttled(mock_api, mocker):
+    mocker.patch.object(snap_handler, "SNAP_API_URL", mock_api.url)
+    mocker.patch.object(snap_handler, "USERS_PER_REQUEST", 3)
+    mocker.patch.object(snap_handler, "MAX_UPLOAD_WORKERS", 1)
+    make_snap_parts(mocker, 2, 10)
+    mock_api.retry_after = 7
+    # the segment lookup and the two batches of the first schema succeed before Snap throttles the uploader
+    mock_api.inject_errors(1, 429, after=3)
+    with pytest.raises(snap_handler.RetryableUploadError) as error:
+        snap_handler.upload_manifest("test_bucket_name", "test_key", TEST_CREDENTIALS, TEST_CREDENTIALS)
+    assert error.value.retry_after == 7
+    assert mock_api.users["1"] == 5
+
+    # the redelivered message resumes from the checkpoints of the first attempt, no user is sent twice
+    summary = snap_handler.upload_manifest("test_bucket_name", "test_key", TEST_CREDENTIALS, TEST_CREDENTIALS)
+    # the users acknowledged by the first attempt are counted too
+    assert summary["users_uploaded"] == 20
+    assert mock_api.users["1"] == 20
+
+
+def test_snap_upload_manifest_part_resumed(mock_api, mocker):
+    mocker.patch.object(snap_handler, "SNAP_API_URL", mock_api.url)
+    mocker.patch.object(snap_handler, "USERS_PER_REQUEST", 3)
+    mocker.patch.object(snap_handler, "CHECKPOINT_STORE", "s3")
+    make_snap_parts(mocker, 1, 10)
+    part = snap_handler.read_manifest(None, "test_bucket_name", "test_key")["parts"][0]
+    tags = {}
+    mocker.patch.object(snap_handler.s3_client, "get_object_tagging", side_effect=lambda Bucket, Key: {
+        "TagSet": [{"Key": k, "Value": v} for k, v in tags.items()]})
+    mocker.patch.object(snap_handler.s3_client, "put_object_tagging", side_effect=lambda Bucket, Key, Tagging: tags.update(
+        {tag["Key"]: tag["Value"] for tag in Tagging["TagSet"]}))
+    # the two batches of the first schema are acknowledged before Snap throttles the uploader
+    mock_api.inject_errors(1, 429, after=2)
+    with pytest.raises(snap_handler.RetryableUploadError):
+        snap_handler.upload_manifest_part("test_bucket_name", part, "test_access_token", "1", "test3")
+    assert USERS_UPLOADED_TAG not in tags
+
+    assert snap_handler.upload_manifest_part("test_bucket_name", part, "test_access_token", "1", "test3") == 10
+    assert tags[USERS_UPLOADED_TAG] == "10"
+    assert mock_api.users["1"] == 10
+
+
+def test_snap_segment_lookup_throttled(mock_api, mocker):
+    mocker.patch.object(snap_handler, "SNAP_API_URL", mock_api.url)
+    mock_api.inject_errors(1, 503)
+    with pytest.raises(snap_handler.RetryableUploadError):
+        snap_handler.get_segment_id_by_name(TEST_CREDENTIALS, TEST_CREDENTIALS, "test3")
+    assert snap_handler.get_segment_id_by_name(TEST_CREDENTIALS, TEST_CREDENTIALS, "test3") == "1"
+
+
+def test_tiktok_upload_manifest(mock_api, mocker):
+    mocker.patch.object(tiktok_handler, "TIKTOK_API_URL", mock_api.url)
+    make_tiktok_parts(mocker, 3, 5)
+    assert tiktok_handler.upload_manifest("test_bucket_name", "test_key") == "Custom Audience test3 is successfully uploaded to TikTok Ads from 3 files!"
+    assert len(mock_api.files) == 3
+    assert list(mock_api.audiences.values()) == [{"name": "test3", "calculate_type": "EMAIL_SHA256", "file_paths": mocker.ANY}]
+    assert sorted(mock_api.audiences["1"]["file_paths"]) == sorted(mock_api.files)
+
+    # a second audience file is appended to the existing audience
+    make_tiktok_parts(mocker, 1, 7)
+    tiktok_handler.upload_manifest("test_bucket_name", "test_key")
+    assert len(mock_api.audiences) == 1
+    assert len(mock_api.audiences["1"]["file_paths"]) == 4
+
+
+def test_tiktok_upload_manifest_rate_limited(mock_api, mocker):
+    mocker.patch.object(tiktok_handler, "TIKTOK_API_URL", mock_api.url)
+    make_tiktok_parts(mocker, 3, 5)
+    mock_api.rate_limit = 2
+    with pytest.raises(tiktok_handler.RetryableUploadError):
+        tiktok_handler.upload_manifest("test_bucket_name", "test_key")
+    assert mock_api.throttled >= 1
@@ -0,0 +1,76 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import threading
+import tracemalloc
+
+import pytest
+
+from upload_engine.profiling import MemoryProfiler, current_rss_bytes, get_memory_profiler
+
+
+def test_current_rss_bytes():
+    assert current_rss_bytes() > 0
+
+
+def test_stage_peaks():
+    profiler = MemoryProfiler(interval=0.01)
+    profiler.start()
+    with profiler.stage("read"):
+        pass
+    with profiler.stage("hash"):
+        pass
+    profiler.stop()
+    assert set(profiler.peaks) == {"read", "hash"}
+    assert profiler.peaks["read"]["peak_rss_bytes"] > 0
+    assert "peak_traced_bytes" not in profiler.peaks["read"]
+
+
+def test_stage_peaks_traced():
+    profiler = MemoryProfiler(trace_allocations=True, interval=0.01)
+    profiler.start()
+    with profiler.stage("small"):
+        small = bytearray(1024)
+    with profiler.stage("large"):
+        large = bytearray(32 * 1024**2)
+        profiler.sample()
+    profiler.stop()
+    assert profiler.peaks["large"]["peak_traced_bytes"] >= 32 * 1024**2
+    assert profiler.peaks["small"]["peak_traced_bytes"] < 32 * 1024**2
+    # the profiler only stops the tracing it started
+    assert not tracemalloc.is_tracing()
+    del small, large
+
+
+def test_overlapping_stages():
+    profiler = MemoryProfiler(trace_allocations=True, interval=0.01)
+    profiler.start()
+    started = threading.Event()
+    release = threading.Event()
+
+    def upload():
+        with profiler.stage("upload"):
+            started.set()
+            release.wait()
+
+    thread = threading.Thread(target=upload)
+    thread.start()
+    started.wait()
+    with profiler.stage("decode"):
+        body = bytearray(32 * 1024**2)
+        profiler.sample()
+    release.set()
+    thread.join()
+    profiler.stop()
+    # a sample counts for every running stage
+    assert profiler.peaks["upload"]["peak_traced_bytes"] >= 32 * 1024**2
+    del body
+
+
+def test_get_memory_profiler():
+    assert get_memory_profiler(None) is None
+    assert not get_memory_profiler("rss").trace_allocations
+    assert get_memory_profiler("tracemalloc").trace_allocations
+    with pytest.raises(ValueError):
+        get_memory_profiler("heap")
+
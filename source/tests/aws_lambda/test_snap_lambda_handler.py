@@ -1,8 +1,10 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
+import hashlib
 from lambda_helpers import *
 from snap.uploader.lambda_handler import *
+from upload_engine.retry import MAX_WORKFLOW_ATTEMPTS
 from aws_xray_sdk.core import xray_recorder
 xray_recorder.configure(context_missing='LOG_ERROR')
 
@@ -34,6 +36,17 @@ def test_refresh_token(mocker):
     assert timedelta(seconds=-EXPECTED_EXPIRY_OFFSET) <= expected_expiry - actual_expiry <= timedelta(seconds=EXPECTED_EXPIRY_OFFSET)
 
 
+def test_refresh_token_expires_in(mocker):
+    content_mock = mocker.MagicMock()
+    content_mock.decode.return_value = """{"access_token": "test", "expires_in": 3600}"""
+    content_mock.read.return_value = content_mock
+    mocker.patch("snap.uploader.lambda_handler.urllib.request.urlopen", return_value = content_mock)
+
+    expected_expiry = (datetime.now() + timedelta(seconds=3600))
+    actual_expiry = datetime.strptime(refresh_token(TEST_CREDENTIALS, TEST_CREDENTIALS)["expires_at"], "%Y-%m-%d %H:%M:%S")
+    assert timedelta(seconds=-EXPECTED_EXPIRY_OFFSET) <= expected_expiry - actual_expiry <= timedelta(seconds=EXPECTED_EXPIRY_OFFSET)
+
+
 def test_add_users(requests_mock):
     requests_mock.post(f"https://adsapi.snapchat.com/v1/segments/{TEST_SEGMENT_ID}/users",
         json=RESPONSE_SUCCESS
@@ -63,6 +76,55 @@ def test_is_token_expired(create_times):
     assert not is_token_expired(unexpired)
 
 
+def test_is_token_expired_ahead(create_times):
+    _, unexpired = create_times
+    assert is_token_expired(unexpired, 2 * 3600)
+    assert is_token_expired("test")
+
+
+def test_token_manager_reuses_valid_token(create_times, mocker):
+    _, unexpired = create_times
+    credentials = dict(TEST_CREDENTIALS, expires_at=unexpired)
+    get_mock = mocker.patch("snap.uploader.lambda_handler.get_snap_credentials", return_value = credentials)
+    refresh_mock = mocker.patch("snap.uploader.lambda_handler.refresh_token")
+    mocker.patch("snap.uploader.lambda_handler.TOKEN_REFRESH_AHEAD_SECONDS", 0)
+    manager = TokenManager("test_secret")
+    assert manager.get_credentials(TEST_CREDENTIALS) == credentials
+    assert manager.get_credentials(TEST_CREDENTIALS) == credentials
+    # the token is kept by the container until it is about to expire
+    get_mock.assert_called_once()
+    refresh_mock.assert_not_called()
+
+
+def test_token_manager_single_flight(create_times, mocker):
+    expired, unexpired = create_times
+    expired_credentials = dict(TEST_CREDENTIALS, expires_at=expired)
+    refreshed_credentials = dict(TEST_CREDENTIALS, access_token="test_access_token_2", expires_at=unexpired)
+    mocker.patch("snap.uploader.lambda_handler.get_snap_credentials", return_value = expired_credentials)
+    mocker.patch("snap.uploader.lambda_handler.TOKEN_REFRESH_AHEAD_SECONDS", 0)
+    mocker.patch("snap.uploader.lambda_handler.time.sleep")
+    refresh_mock = mocker.patch("snap.uploader.lambda_handler.refresh_token", return_value = refreshed_credentials)
+    update_mock = mocker.patch("snap.uploader.lambda_handler.update_snap_credentials")
+    put_mock = mocker.patch("snap.uploader.lambda_handler.secrets_client.put_secret_value")
+    mocker.patch("snap.uploader.lambda_handler.secrets_client.get_secret_value", side_effect = [
+        {"VersionId": "test_version", "SecretString": json.dumps(expired_credentials)},
+        {"VersionId": "test_version", "SecretString": json.dumps(expired_credentials)},
+        {"VersionId": "test_version_2", "SecretString": json.dumps(refreshed_credentials)},
+    ])
+
+    # the first container gets the lock and refreshes the token
+    assert TokenManager("test_secret").get_credentials(TEST_CREDENTIALS) == refreshed_credentials
+    refresh_mock.assert_called_once()
+    update_mock.assert_called_once_with("test_secret", refreshed_credentials)
+    assert put_mock.call_args.kwargs["VersionStages"] == ["REFRESH_LOCK"]
+
+    # the second container writes the same lock version, is rejected and waits for the refreshed token
+    put_mock.side_effect = ClientError({"Error": {"Code": "ResourceExistsException"}}, "PutSecretValue")
+    assert TokenManager("test_secret").get_credentials(TEST_CREDENTIALS) == refreshed_credentials
+    refresh_mock.assert_called_once()
+    assert put_mock.call_args_list[0].kwargs["ClientRequestToken"] == put_mock.call_args_list[1].kwargs["ClientRequestToken"]
+
+
 def test_lambda_handler(mocker):
     data_mock = mocker.MagicMock()
     data_mock.read_csv.return_value = data_mock
@@ -72,6 +134,8 @@ def test_lambda_handler(mocker):
 
     mocker.patch("snap.uploader.lambda_handler.get_snap_credentials", return_value = TEST_CREDENTIALS)
     mocker.patch("snap.uploader.lambda_handler.is_token_expired", return_value = True)
+    mocker.patch("snap.uploader.lambda_handler.secrets_client.get_secret_value", return_value = {"VersionId": "test_version", "SecretString": json.dumps(TEST_CREDENTIALS)})
+    mocker.patch("snap.uploader.lambda_handler.acquire_refresh_lock", return_value = True)
     mocker.patch("snap.uploader.lambda_handler.refresh_token", return_value = TEST_CREDENTIALS)
     mocker.patch("snap.uploader.lambda_handler.update_snap_credentials")
     mocker.patch("snap.uploader.lambda_handler.get_segment_id_by_name", return_value = 1)
@@ -85,4 +149,144 @@ def test_lambda_handler(mocker):
     assert lambda_handler(FAKE_GZ_EVENT, None)["uploader"]["response"] == "no schemas were found"
 
     assert lambda_handler(FAKE_CSV_EVENT, None)["uploader"]["response"] == "not a supported file"
-    
\ No newline at end of file
+    
+
+def test_lambda_handler_manifest(mocker):
+    part = gzip.compress(b"schema,hash\nEMAIL_SHA256,test_hash\nPHONE_SHA256,test_hash_2\n")
+    parts = [{"key": "output/snap/test3/test4" + str(i) + ".csv.gz", "rows": 2, "bytes": len(part), "md5": hashlib.md5(part).hexdigest()} for i in range(3)]
+    mocker.patch("snap.uploader.lambda_handler.read_manifest", return_value={"segment_name": "test3", "total_rows": 6, "parts": parts})
+    mocker.patch("snap.uploader.lambda_handler.get_snap_credentials", return_value = TEST_CREDENTIALS)
+    mocker.patch("snap.uploader.lambda_handler.is_token_expired", return_value = False)
+    segment_mock = mocker.patch("snap.uploader.lambda_handler.get_segment_id_by_name", return_value = 1)
+    body_mock = mocker.MagicMock()
+    body_mock.read.return_value = part
+    mocker.patch("snap.uploader.lambda_handler.s3_client.get_object", return_value = {"Body": body_mock})
+    add_users_mock = mocker.patch("snap.uploader.lambda_handler.add_users", return_value = SUCCESSFUL_UPLOAD_2)
+
+    assert lambda_handler(FAKE_MANIFEST_EVENT, None)["uploader"]["response"] == {"segment_name": "test3", "parts_uploaded": 3, "users_uploaded": 12}
+    # the segment is looked up once for the whole audience, users are added per part and schema
+    segment_mock.assert_called_once()
+    assert add_users_mock.call_count == 6
+
+    parts[1]["md5"] = "0" * 32
+    with pytest.raises(ValueError):
+        lambda_handler(FAKE_MANIFEST_EVENT, None)
+
+
+def test_lambda_handler_starts_upload_workflow(mocker):
+    mocker.patch("snap.uploader.lambda_handler.get_snap_credentials", return_value = TEST_CREDENTIALS)
+    mocker.patch("snap.uploader.lambda_handler.is_token_expired", return_value = False)
+    mocker.patch("snap.uploader.lambda_handler.UPLOAD_STATE_MACHINE_ARN", "test_state_machine_arn")
+    start_mock = mocker.patch("snap.uploader.lambda_handler.stepfunctions_client.start_execution", return_value = {"executionArn": "test_execution_arn"})
+    assert lambda_handler(FAKE_MANIFEST_EVENT, None)["uploader"]["response"] == {"execution_arn": "test_execution_arn"}
+    assert json.loads(start_mock.call_args.kwargs["input"]) == {"bucket": "test_bucket_name", "key": "output/test2/test3/test4_manifest.json", "etag": ""}
+
+
+def test_upload_workflow_steps(mocker):
+    mocker.patch("snap.uploader.lambda_handler.get_snap_credentials", return_value = TEST_CREDENTIALS)
+    mocker.patch("snap.uploader.lambda_handler.is_token_expired", return_value = False)
+    parts = [{"key": "output/snap/test3/test4.csv.gz", "rows": 2, "bytes": 10, "md5": "test_md5"}]
+    mocker.patch("snap.uploader.lambda_handler.read_manifest", return_value={"segment_name": "test3", "total_rows": 2, "parts": parts})
+    mocker.patch("snap.uploader.lambda_handler.get_segment_id_by_name", return_value = 1)
+    plan = plan_handler({"bucket": "test_bucket_name", "key": "output/snap/test3/test4_manifest.json", "etag": "test_etag"}, None)
+    assert plan["plan"] == {
+        "bucket": "test_bucket_name", "manifest_key": "output/snap/test3/test4_manifest.json", "manifest_etag": "test_etag",
+        "segment_name": "test3", "segment_id": 1,
+    }
+    # the Map state carries ranges of part indexes only
+    assert plan["parts"] == [[0, 1]]
+
+    part_mock = mocker.patch("snap.uploader.lambda_handler.read_manifest_part", return_value = parts[0])
+
+    upload_mock = mocker.patch("snap.uploader.lambda_handler.upload_manifest_part", return_value = 2)
+    outcome = upload_part_handler({"plan": plan["plan"], "parts": [0, 1]}, None)
+    assert outcome["status"] == "UPLOADED"
+    result = outcome["result"]
+    assert result == [{"rows": 2, "users_uploaded": 2}]
+    assert part_mock.call_args.args[1:] == ("test_bucket_name", "output/snap/test3/test4_manifest.json", "test_etag", 0)
+    assert upload_mock.call_args.args == ("test_bucket_name", parts[0], "test_access_token", 1, "test3")
+
+    # a throttled part waits for the Retry-After hint before the next attempt, until the last attempt
+    upload_mock.side_effect = RetryableUploadError("throttled", retry_after=7)
+    outcome = upload_part_handler({"plan": plan["plan"], "parts": [0, 1], "attempt": 2}, None)
+    assert outcome == {"status": "RETRY", "retry_after_seconds": 7, "attempt": 3, "results": []}
+    with pytest.raises(RetryableUploadError):
+        upload_part_handler({"plan": plan["plan"], "parts": [0, 1], "attempt": MAX_WORKFLOW_ATTEMPTS}, None)
+
+    summary = aggregate_handler(dict(plan, results=[result, result]), None)
+    assert summary == {"status": "SUCCEEDED", "segment_name": "test3", "parts_uploaded": 2, "rows": 4, "users_uploaded": 4}
+
+    mocker.patch("snap.uploader.lambda_handler.get_segment_id_by_name", return_value = 0)
+    with pytest.raises(ValueError):
+        plan_handler({"bucket": "test_bucket_name", "key": "output/snap/test3/test4_manifest.json"}, None)
+
+
+def test_add_users_throttled(requests_mock):
+    requests_mock.post(f"https://adsapi.snapchat.com/v1/segments/{TEST_SEGMENT_ID}/users", status_code=429)
+    with pytest.raises(RetryableUploadError):
+        add_users("", TEST_SEGMENT_ID, "", "")
+
+
+def test_lambda_handler_throttled(mocker):
+    mocker.patch("snap.uploader.lambda_handler.get_snap_credentials", return_value = TEST_CREDENTIALS)
+    mocker.patch("snap.uploader.lambda_handler.is_token_expired", return_value = False)
+    mocker.patch("snap.uploader.lambda_handler.upload_manifest", side_effect = RetryableUploadError("throttled", retry_after=7))
+    mocker.patch("snap.uploader.lambda_handler.sqs_client.get_queue_url", return_value = {"QueueUrl": "test_queue_url"})
+    visibility_mock = mocker.patch("snap.uploader.lambda_handler.sqs_client.change_message_visibility")
+    with pytest.raises(RetryableUploadError):
+        lambda_handler(FAKE_THROTTLED_MANIFEST_EVENT, None)
+    visibility_mock.assert_called_once_with(QueueUrl="test_queue_url", ReceiptHandle="test_receipt_handle", VisibilityTimeout=7)
+
+
+def test_add_part_users_resumes_from_checkpoint(mocker):
+    mocker.patch("snap.uploader.lambda_handler.USERS_PER_REQUEST", 2)
+    add_users_mock = mocker.patch("snap.uploader.lambda_handler.add_users", return_value = SUCCESSFUL_UPLOAD_2)
+    part = io.StringIO("schema,hash\n" + "".join("EMAIL_SHA256,hash_{}\n".format(i) for i in range(5)) + "PHONE_SHA256,hash_5\n")
+    checkpoint = MemoryCheckpoint("test_bucket_name", "test_resume_key")
+    # the first two batches of emails were acknowledged by a previous attempt
+    checkpoint.save("EMAIL_SHA256", 1, 4)
+
+    _, users_uploaded = add_part_users(part, "test_access_token", 1, "test3", "test_resume_key", checkpoint)
+    assert [call.args[2:] for call in add_users_mock.call_args_list] == [("EMAIL_SHA256", [["hash_4"]]), ("PHONE_SHA256", [["hash_5"]])]
+    # the users of the acknowledged batches are counted too
+    assert users_uploaded == 8
+    assert MemoryCheckpoint("test_bucket_name", "test_resume_key").get("EMAIL_SHA256") == (2, 6)
+    assert checkpoint.get("PHONE_SHA256") == (0, 2)
+
+
+def test_s3_tag_checkpoint(mocker):
+    tagging_mock = mocker.patch("snap.uploader.lambda_handler.s3_client.get_object_tagging", return_value = {"TagSet": [{"Key": "owner", "Value": "test"}, {"Key": CHECKPOINT_TAG_PREFIX + "EMAIL_SHA256", "Value": "3:400000"}]})
+    put_tagging_mock = mocker.patch("snap.uploader.lambda_handler.s3_client.put_object_tagging")
+    checkpoint = S3TagCheckpoint("test_bucket_name", "test_key")
+    tagging_mock.assert_called_once_with(Bucket="test_bucket_name", Key="test_key")
+    assert checkpoint.get("EMAIL_SHA256") == (3, 400000)
+    assert checkpoint.get("PHONE_SHA256") == (-1, 0)
+
+    checkpoint.save("PHONE_SHA256", 0, 100000)
+    # existing tags are kept
+    assert put_tagging_mock.call_args.kwargs["Tagging"]["TagSet"] == [
+        {"Key": "owner", "Value": "test"},
+        {"Key": CHECKPOINT_TAG_PREFIX + "EMAIL_SHA256", "Value": "3:400000"},
+        {"Key": CHECKPOINT_TAG_PREFIX + "PHONE_SHA256", "Value": "0:100000"},
+    ]
+
+
+def test_s3_tag_checkpoint_concurrent_saves(mocker):
+    mocker.patch("snap.uploader.lambda_handler.s3_client.get_object_tagging", return_value = {"TagSet": []})
+    tag_sets = []
+
+    def put_object_tagging(Bucket, Key, Tagging):
+        # the schemas of a part save their checkpoint from several threads
+        time.sleep(0.01)
+        tag_sets.append({tag["Key"]: tag["Value"] for tag in Tagging["TagSet"]})
+
+    mocker.patch("snap.uploader.lambda_handler.s3_client.put_object_tagging", side_effect = put_object_tagging)
+    checkpoint = S3TagCheckpoint("test_bucket_name", "test_key")
+    threads = [threading.Thread(target=checkpoint.save, args=(schema, 0, 1)) for schema in SCHEMA_OPTIONS]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # each save sees the saves before it, the last tag set holds every schema
+    assert [len(tag_set) for tag_set in tag_sets] == [1, 2, 3]
+    assert tag_sets[-1] == {CHECKPOINT_TAG_PREFIX + schema: "0:1" for schema in SCHEMA_OPTIONS}
@@ -4,6 +4,7 @@
 from lambda_helpers import *
 import tiktok.uploader.lambda_handler
 from tiktok.uploader.lambda_handler import *
+from upload_engine.retry import MIN_RETRY_DELAY_SECONDS
 from aws_xray_sdk.core import xray_recorder
 xray_recorder.configure(context_missing='LOG_ERROR')
 
@@ -64,3 +65,68 @@ def test_lambda_handler_happy_path(mocker):
     mocker.patch("tiktok.uploader.lambda_handler.check_custom_audience_exist", return_value=None)
     mocker.patch("tiktok.uploader.lambda_handler.create_custom_audience_data", return_value={"code": 0})
     assert lambda_handler(FAKE_CSV_EVENT, None) == {"statusCode": 200, "body": '"Custom Audience test3 is successfully created to TikTok Ads!"'}
+
+
+def test_lambda_handler_manifest(mocker):
+    parts = [
+        {"key": "output/tiktok/test3/email_sha256/test41.csv", "rows": 2, "bytes": 130, "md5": "md5_1", "schema": "EMAIL_SHA256"},
+        {"key": "output/tiktok/test3/email_sha256/test42.csv", "rows": 2, "bytes": 130, "md5": "md5_2", "schema": "EMAIL_SHA256"},
+        {"key": "output/tiktok/test3/phone_sha256/test4.csv", "rows": 2, "bytes": 130, "md5": "md5_3", "schema": "PHONE_SHA256"},
+    ]
+    mocker.patch("tiktok.uploader.lambda_handler.read_manifest", return_value={"segment_name": "test3", "total_rows": 6, "parts": parts})
+    mocker.patch("tiktok.uploader.lambda_handler.get_tiktok_credentials", return_value={"ACCESS_TOKEN": "test", "ADVERTISER_ID": "test"})
+    mocker.patch("tiktok.uploader.lambda_handler.read_part", side_effect=lambda s3_client, bucket, part: part["key"].encode())
+    upload_mock = mocker.patch("tiktok.uploader.lambda_handler.upload_custom_audience_file", side_effect=lambda file_name, body, *_: {"code": 0, "data": {"file_path": body.decode()}})
+    mocker.patch("tiktok.uploader.lambda_handler.check_custom_audience_exist", return_value=None)
+    create_mock = mocker.patch("tiktok.uploader.lambda_handler.create_custom_audience_data", return_value={"code": 0, "data": {"custom_audience_id": "test_audience_id"}})
+    update_mock = mocker.patch("tiktok.uploader.lambda_handler.update_custom_audience_data", return_value={"code": 0})
+
+    assert lambda_handler(FAKE_MANIFEST_EVENT, None) == {"statusCode": 200, "body": '"Custom Audience test3 is successfully uploaded to TikTok Ads from 3 files!"'}
+    assert upload_mock.call_count == 3
+    # one create with both email parts, then one append of the phone part to the new audience
+    assert create_mock.call_args.args[1:3] == ([parts[0]["key"], parts[1]["key"]], "EMAIL_SHA256")
+    assert update_mock.call_args.args[:2] == ("test_audience_id", [parts[2]["key"]])
+
+    upload_mock.side_effect = None
+    upload_mock.return_value = {"code": 40001, "message": "test_error"}
+    assert lambda_handler(FAKE_MANIFEST_EVENT, None)["statusCode"] == 400
+
+
+def test_upload_workflow_steps(mocker):
+    parts = [
+        {"key": "output/tiktok/test3/email_sha256/test4.csv", "rows": 2, "bytes": 130, "md5": "md5_1", "schema": "EMAIL_SHA256"},
+        {"key": "output/tiktok/test3/phone_sha256/test4.csv", "rows": 3, "bytes": 195, "md5": "md5_2", "schema": "PHONE_SHA256"},
+    ]
+    mocker.patch("tiktok.uploader.lambda_handler.read_manifest", return_value={"segment_name": "test3", "total_rows": 5, "parts": parts})
+    plan = plan_handler({"bucket": "test_bucket_name", "key": "output/tiktok/test3/test4_manifest.json"}, None)
+    assert plan["plan"] == {
+        "bucket": "test_bucket_name", "manifest_key": "output/tiktok/test3/test4_manifest.json", "manifest_etag": None, "segment_name": "test3",
+    }
+    assert plan["parts"] == [[0, 1], [1, 2]]
+
+    mocker.patch("tiktok.uploader.lambda_handler.get_tiktok_credentials", return_value={"ACCESS_TOKEN": "test", "ADVERTISER_ID": "test"})
+    mocker.patch("tiktok.uploader.lambda_handler.read_part", side_effect=lambda s3_client, bucket, part: part["key"].encode())
+    mocker.patch("tiktok.uploader.lambda_handler.upload_custom_audience_file", side_effect=lambda file_name, body, *_: {"code": 0, "data": {"file_path": body.decode()}})
+    mocker.patch("tiktok.uploader.lambda_handler.read_manifest_part", side_effect=lambda s3_client, bucket, key, etag, index: parts[index])
+    results = [upload_part_handler({"plan": plan["plan"], "parts": part_range}, None)["result"] for part_range in plan["parts"]]
+    assert results[1] == [{"rows": 3, "calculate_type": "PHONE_SHA256", "file_path": parts[1]["key"]}]
+
+    mocker.patch("tiktok.uploader.lambda_handler.check_custom_audience_exist", return_value={"audience_id": "test_audience_id"})
+    update_mock = mocker.patch("tiktok.uploader.lambda_handler.update_custom_audience_data", return_value={"code": 0})
+    summary = aggregate_handler(dict(plan, results=results), None)
+    assert summary == {"status": "SUCCEEDED", "segment_name": "test3", "parts_uploaded": 2, "rows": 5}
+    assert update_mock.call_count == 2
+
+    update_mock.return_value = {"code": 40100, "message": "Too many requests"}
+    with pytest.raises(RetryableUploadError):
+        aggregate_handler(dict(plan, results=results), None)
+
+
+def test_lambda_handler_throttled(mocker):
+    mocker.patch("tiktok.uploader.lambda_handler.upload_manifest", side_effect=RetryableUploadError("throttled"))
+    mocker.patch("tiktok.uploader.lambda_handler.sqs_client.get_queue_url", return_value={"QueueUrl": "test_queue_url"})
+    visibility_mock = mocker.patch("tiktok.uploader.lambda_handler.sqs_client.change_message_visibility")
+    with pytest.raises(RetryableUploadError):
+        lambda_handler(FAKE_THROTTLED_MANIFEST_EVENT, None)
+    # third receive of the message without any progress
+    visibility_mock.assert_called_once_with(QueueUrl="test_queue_url", ReceiptHandle="test_receipt_handle", VisibilityTimeout=MIN_RETRY_DELAY_SECONDS * 4)
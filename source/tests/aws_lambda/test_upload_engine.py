@@ -0,0 +1,245 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import io
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from upload_engine.destination import AudienceDestination, iter_batches
+from upload_engine.engine import UploadEngine
+from upload_engine.manifest import MAX_MAP_ITERATIONS, plan_part_ranges, read_manifest_part, read_part, start_upload_workflow
+from upload_engine.outcome import UPLOADED_AT_TAG, USERS_UPLOADED_TAG, record_part_outcome
+from upload_engine.profiling import MemoryProfiler
+from upload_engine.retry import (
+    MAX_RETRY_DELAY_SECONDS, MAX_WORKFLOW_ATTEMPTS, MIN_REMAINING_MILLIS, MIN_RETRY_DELAY_SECONDS, RetryableUploadError,
+    get_retry_delay, parse_retry_after, run_workflow_attempt, run_workflow_range, schedule_retry,
+)
+
+
+class FakeDestination(AudienceDestination):
+    platform = "test"
+
+    def __init__(self, delay=0.0, fail_key=None):
+        self.delay = delay
+        self.fail_key = fail_key
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.uploaded = {}
+
+    def read_part(self, bucket_name, part):
+        time.sleep(self.delay)
+        return bucket_name + "/" + part["key"]
+
+    def decode_part(self, part, body):
+        return [body + "#" + str(i) for i in range(part["requests"])]
+
+    def upload(self, part, request):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        if part["key"] == self.fail_key:
+            raise ValueError("ERROR : test")
+        return request
+
+    def part_uploaded(self, bucket_name, part, results):
+        self.uploaded[part["key"]] = len(results)
+
+
+def make_parts(count, requests=2):
+    return [{"key": "part" + str(i), "requests": requests} for i in range(count)]
+
+
+def test_upload_parts():
+    destination = FakeDestination()
+    results = UploadEngine(destination).upload_parts("test_bucket", make_parts(3))
+    # results are returned in the order of the parts and of their requests
+    assert results == [["test_bucket/part{}#0".format(i), "test_bucket/part{}#1".format(i)] for i in range(3)]
+    assert destination.uploaded == {"part0": 2, "part1": 2, "part2": 2}
+
+
+def test_upload_parts_concurrency():
+    destination = FakeDestination(delay=0.05)
+    engine = UploadEngine(destination, max_parts=2, max_requests=3)
+    start = time.perf_counter()
+    engine.upload_parts("test_bucket", make_parts(6))
+    elapsed = time.perf_counter() - start
+    assert destination.max_in_flight == 3
+    assert engine.parts_uploaded == 6
+    # every read and upload is timed, decoding and recording are instantaneous
+    assert set(engine.stage_seconds) == {"read", "decode", "upload", "record"}
+    assert engine.stage_seconds["upload"] >= 12 * 0.05
+    # 6 sequential reads and 12 sequential uploads would take 0.9s
+    assert elapsed < 0.6
+
+
+def test_upload_parts_failure():
+    destination = FakeDestination(fail_key="part2")
+    engine = UploadEngine(destination, max_parts=1, max_requests=1)
+    with pytest.raises(ValueError):
+        engine.upload_parts("test_bucket", make_parts(4))
+    assert engine.parts_uploaded == 2
+    assert set(destination.uploaded) == {"part0", "part1"}
+
+
+def test_upload_parts_failure_in_flight():
+    # the stages abandoned after the failure never replace its error
+    for _ in range(20):
+        with pytest.raises(ValueError, match="ERROR : test"):
+            UploadEngine(FakeDestination(fail_key="part1"), max_parts=4, max_requests=1).upload_parts(
+                "test_bucket", make_parts(8, requests=4))
+
+
+def test_upload_parts_profiler():
+    profiler = MemoryProfiler(interval=0.01)
+    engine = UploadEngine(FakeDestination(delay=0.02), profiler=profiler)
+    engine.upload_parts("test_bucket", make_parts(2))
+    assert set(profiler.peaks) == {"read", "decode", "upload", "record"}
+    assert profiler.peaks["upload"]["peak_rss_bytes"] > 0
+
+
+def test_iter_batches():
+    assert list(iter_batches(["a", "b", "c", "d", "e"], 2)) == [(0, ["a", "b"]), (1, ["c", "d"]), (2, ["e"])]
+    assert list(iter_batches([], 2)) == []
+
+
+def test_record_part_outcome(mocker):
+    s3_client = mocker.MagicMock()
+    s3_client.get_object_tagging.return_value = {"TagSet": [{"Key": "uploaded-batch-EMAIL_SHA256", "Value": "3"}]}
+    record_part_outcome(s3_client, "test_bucket", "part0", 42)
+    s3_client.get_object_tagging.assert_called_once_with(Bucket="test_bucket", Key="part0")
+    tags = {tag["Key"]: tag["Value"] for tag in s3_client.put_object_tagging.call_args.kwargs["Tagging"]["TagSet"]}
+    assert tags["uploaded-batch-EMAIL_SHA256"] == "3"
+    assert tags[USERS_UPLOADED_TAG] == "42"
+    assert UPLOADED_AT_TAG in tags
+
+    # the users are uploaded, a failure to tag the part is not an upload failure
+    s3_client.put_object_tagging.side_effect = ValueError("ERROR : test")
+    record_part_outcome(s3_client, "test_bucket", "part0", 42)
+
+
+def test_abstract_destination():
+    with pytest.raises(TypeError):
+        AudienceDestination()
+
+
+def test_plan_part_ranges():
+    assert plan_part_ranges(0) == []
+    assert plan_part_ranges(3) == [[0, 1], [1, 2], [2, 3]]
+    # an audience of thousands of parts is uploaded in a bounded number of Map iterations
+    ranges = plan_part_ranges(2001)
+    assert len(ranges) <= MAX_MAP_ITERATIONS
+    assert ranges[0] == [0, 11]
+    assert [index for start, stop in ranges for index in range(start, stop)] == list(range(2001))
+
+
+def test_read_part(mocker):
+    s3_client = mocker.MagicMock()
+    s3_client.get_object.return_value = {"Body": io.BytesIO(b"test_hash\n")}
+    part = {"key": "output/tiktok/test3/email_sha256/test4.csv", "md5": hashlib.md5(b"test_hash\n").hexdigest()}
+    assert read_part(s3_client, "test_bucket_name", part) == b"test_hash\n"
+    s3_client.get_object.assert_called_once_with(Bucket="test_bucket_name", Key=part["key"])
+
+    s3_client.get_object.return_value = {"Body": io.BytesIO(b"test_hash_2\n")}
+    with pytest.raises(ValueError):
+        read_part(s3_client, "test_bucket_name", part)
+
+
+def test_read_manifest_part(mocker):
+    s3_client = mocker.MagicMock()
+    s3_client.get_object.side_effect = lambda **request: {"Body": io.BytesIO(json.dumps({"parts": [{"key": "part0"}, {"key": "part1"}]}).encode())}
+    assert read_manifest_part(s3_client, "test_bucket", "test_manifest.json", "test_etag", 1) == {"key": "part1"}
+    assert read_manifest_part(s3_client, "test_bucket", "test_manifest.json", "test_etag", 0) == {"key": "part0"}
+    # the manifest is read once for every part of the planned version
+    s3_client.get_object.assert_called_once_with(Bucket="test_bucket", Key="test_manifest.json", IfMatch="test_etag")
+
+
+def test_start_upload_workflow(mocker):
+    stepfunctions_client = mocker.MagicMock()
+    stepfunctions_client.exceptions.ExecutionAlreadyExists = KeyError
+    stepfunctions_client.start_execution.return_value = {"executionArn": "test_execution_arn"}
+    response = start_upload_workflow(stepfunctions_client, "test_state_machine_arn", "test_bucket", "test_manifest.json", "test_etag")
+    assert response == {"execution_arn": "test_execution_arn"}
+    request = stepfunctions_client.start_execution.call_args.kwargs
+    assert json.loads(request["input"]) == {"bucket": "test_bucket", "key": "test_manifest.json", "etag": "test_etag"}
+
+    # a redelivered message starts the same execution
+    stepfunctions_client.start_execution.side_effect = KeyError
+    response = start_upload_workflow(stepfunctions_client, "test_state_machine_arn", "test_bucket", "test_manifest.json", "test_etag")
+    assert response == {"execution_name": request["name"]}
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("120") == 120
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("not a date") is None
+    retry_at = (datetime.now(timezone.utc) + timedelta(seconds=60)).strftime("%a, %d %b %Y %H:%M:%S GMT")
+    assert 50 <= parse_retry_after(retry_at) <= 60
+
+
+def test_get_retry_delay():
+    assert get_retry_delay(RetryableUploadError("throttled", retry_after=5), 3) == 5
+    assert get_retry_delay(RetryableUploadError("throttled"), 1) == MIN_RETRY_DELAY_SECONDS
+    assert get_retry_delay(RetryableUploadError("throttled"), 3) == MIN_RETRY_DELAY_SECONDS * 4
+    assert get_retry_delay(RetryableUploadError("throttled"), 20) == MAX_RETRY_DELAY_SECONDS
+    error = RetryableUploadError("throttled")
+    error.parts_uploaded = 2
+    assert get_retry_delay(error, 5) == MIN_RETRY_DELAY_SECONDS
+
+
+def test_schedule_retry(mocker):
+    sqs_client = mocker.MagicMock()
+    sqs_client.get_queue_url.return_value = {"QueueUrl": "test_queue_url"}
+    record = {"eventSourceARN": "arn:aws:sqs:us-east-1:123456789012:test_queue", "receiptHandle": "test_receipt_handle"}
+    schedule_retry(sqs_client, record, 60)
+    sqs_client.get_queue_url.assert_called_once_with(QueueName="test_queue", QueueOwnerAWSAccountId="123456789012")
+    sqs_client.change_message_visibility.assert_called_once_with(
+        QueueUrl="test_queue_url", ReceiptHandle="test_receipt_handle", VisibilityTimeout=60)
+
+    # the message is still retried after the visibility timeout
+    schedule_retry(sqs_client, {}, 60)
+    assert sqs_client.change_message_visibility.call_count == 1
+
+
+def test_run_workflow_attempt():
+    assert run_workflow_attempt(lambda: 42, 1) == {"status": "UPLOADED", "result": 42}
+
+    def throttled():
+        raise RetryableUploadError("throttled")
+
+    assert run_workflow_attempt(throttled, 2) == {"status": "RETRY", "retry_after_seconds": MIN_RETRY_DELAY_SECONDS * 2, "attempt": 3}
+    with pytest.raises(RetryableUploadError):
+        run_workflow_attempt(throttled, MAX_WORKFLOW_ATTEMPTS)
+    with pytest.raises(ValueError):
+        run_workflow_attempt(lambda: int("not a number"), 1)
+
+
+def test_run_workflow_range():
+    uploaded = []
+
+    def upload_part(index):
+        if index == 2 and 2 not in uploaded:
+            uploaded.append(index)
+            raise RetryableUploadError("throttled", retry_after=5)
+        return index * 10
+
+    # the parts uploaded before a throttled one are kept, the next attempt resumes at the throttled part
+    outcome = run_workflow_range(upload_part, [0, 4], 1, [])
+    assert outcome == {"status": "RETRY", "retry_after_seconds": 5, "attempt": 2, "results": [0, 10]}
+    assert run_workflow_range(upload_part, [0, 4], outcome["attempt"], outcome["results"]) == {"status": "UPLOADED", "result": [0, 10, 20, 30]}
+
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return MIN_REMAINING_MILLIS - 1
+
+    # a lambda running out of time uploads at least one part, then leaves the rest of the range to the next invocation
+    outcome = run_workflow_range(lambda index: index, [4, 8], 1, [], Context())
+    assert outcome == {"status": "RETRY", "retry_after_seconds": 0, "attempt": 1, "results": [4]}
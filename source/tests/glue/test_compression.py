@@ -0,0 +1,66 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import bz2
+import gzip
+import json
+import struct
+
+import pytest
+
+from etl_helpers.compression import CODECS, decompress, get_codec, strip_codec_extension
+
+LINES = "".join(json.dumps({"email": "user{}@example.com".format(i), "phone": str(i)}) + "\n" for i in range(5000)).encode()
+GZIP, BZIP2, ZSTD = CODECS
+
+
+def split(data, members=4):
+    size = len(data) // members + 1
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_get_codec():
+    assert get_codec("input/data.json.gz") is GZIP
+    assert get_codec("input/data.json.GZIP") is GZIP
+    assert get_codec("input/data.json.bz2") is BZIP2
+    assert get_codec("input/data.json.zst") is ZSTD
+    assert get_codec("input/data.json") is None
+    assert strip_codec_extension("input/data.json.gz") == "input/data.json"
+    assert strip_codec_extension("input/data.json.ZST") == "input/data.json"
+    assert strip_codec_extension("input/data.json") == "input/data.json"
+
+
+@pytest.mark.parametrize("codec, compress", [(GZIP, gzip.compress), (BZIP2, bz2.compress)])
+def test_decompress_members(codec, compress):
+    assert decompress(codec, compress(LINES)) == LINES
+    # concatenated members, as written by parallel compressors
+    assert decompress(codec, b"".join(compress(member) for member in split(LINES))) == LINES
+    assert decompress(codec, b"".join(compress(member) for member in split(LINES)), max_workers=1) == LINES
+
+
+def test_decompress_false_start():
+    # a member header within the data of the first member
+    first = gzip.compress(b"\x1f\x8b\x08\x00" * 1000, compresslevel=0)
+    second = gzip.compress(LINES)
+    assert decompress(GZIP, first + second) == b"\x1f\x8b\x08\x00" * 1000 + LINES
+
+
+def test_decompress_padding():
+    assert decompress(GZIP, gzip.compress(LINES) + b"\x00" * 64) == LINES
+
+
+def test_decompress_errors():
+    data = b"".join(gzip.compress(member) for member in split(LINES))
+    with pytest.raises(ValueError, match="corrupt or truncated"):
+        decompress(GZIP, data[:-10])
+    with pytest.raises(ValueError, match="not gzip compressed"):
+        decompress(GZIP, LINES)
+
+
+def test_decompress_zstd():
+    zstandard = pytest.importorskip("zstandard")
+    compressor = zstandard.ZstdCompressor()
+    frames = [compressor.compress(member) for member in split(LINES)]
+    # a skippable frame between the data frames
+    skippable = struct.pack("<II", 0x184D2A5E, 4) + b"skip"
+    assert decompress(ZSTD, frames[0] + skippable + b"".join(frames[1:])) == LINES
@@ -0,0 +1,52 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import gzip
+
+import pandas as pd
+import pytest
+
+from etl_helpers.destinations import SnapDestination, TikTokDestination, get_destination
+
+HASHED_COLUMNS = {
+    "EMAIL_SHA256": pd.Series(["e1", "e2", "e3"]),
+    "PHONE_SHA256": pd.Series(["p1", "p2"]),
+    "GAID_SHA256": pd.Series([], dtype=object),
+}
+
+
+def test_get_destination():
+    assert isinstance(get_destination("snap"), SnapDestination)
+    assert isinstance(get_destination("tiktok"), TikTokDestination)
+    with pytest.raises(ValueError):
+        get_destination("test")
+
+
+def test_validate_pii_fields():
+    SnapDestination().validate_pii_fields([{"column_name": "maid", "pii_type": "MOBILE_AD_ID"}])
+    with pytest.raises(ValueError):
+        TikTokDestination().validate_pii_fields([{"column_name": "maid", "pii_type": "MOBILE_AD_ID"}])
+    # several columns of a PII type, but each column once
+    SnapDestination().validate_pii_fields([{"column_name": "email", "pii_type": "EMAIL"}, {"column_name": "work_email", "pii_type": "EMAIL"}])
+    with pytest.raises(ValueError, match="more than once"):
+        SnapDestination().validate_pii_fields([{"column_name": "email", "pii_type": "EMAIL"}, {"column_name": "email", "pii_type": "PHONE"}])
+
+
+def test_snap_parts(mocker):
+    mocker.patch.object(SnapDestination, "max_part_rows", 2)
+    parts = list(SnapDestination().iter_parts(HASHED_COLUMNS, "test_segment", "dir/test"))
+    assert [(key, rows, schema) for key, _, rows, schema in parts] == [
+        ("output/snap/test_segment/dir/test1.csv.gz", 2, None),
+        ("output/snap/test_segment/dir/test2.csv.gz", 2, None),
+        ("output/snap/test_segment/dir/test3.csv.gz", 1, None),
+    ]
+    assert gzip.decompress(parts[1][1]) == b"schema,hash\nEMAIL_SHA256,e3\nPHONE_SHA256,p1\n"
+
+
+def test_tiktok_parts():
+    parts = list(TikTokDestination().iter_parts(HASHED_COLUMNS, "test_segment", "dir/test"))
+    # empty columns are skipped
+    assert [(key, body, rows, schema) for key, body, rows, schema in parts] == [
+        ("output/tiktok/test_segment/email_sha256/dir/test.csv", b"e1\ne2\ne3\n", 3, "EMAIL_SHA256"),
+        ("output/tiktok/test_segment/phone_sha256/dir/test.csv", b"p1\np2\n", 2, "PHONE_SHA256"),
+    ]
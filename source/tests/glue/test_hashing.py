@@ -0,0 +1,75 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+
+import pandas as pd
+import pytest
+
+from etl_helpers import hashing
+from etl_helpers.hashing import hash_pii_columns, is_sha256_hex, sha256_hex, validate_pre_hashed
+from etl_helpers.normalization import is_pre_hashed, normalize_pii_columns
+
+EMAIL_HASH = hashlib.sha256(b"john@example.com").hexdigest()
+
+
+def test_is_pre_hashed():
+    assert is_pre_hashed({"pre_hashed": True})
+    assert is_pre_hashed({"pre_hashed": "true"})
+    assert not is_pre_hashed({"pre_hashed": False})
+    assert not is_pre_hashed({"pre_hashed": "false"})
+    assert not is_pre_hashed({})
+
+
+def test_sha256_hex():
+    values = pd.Series(["john@example.com"], index=[7])
+    result = sha256_hex(values)
+    assert result.tolist() == [EMAIL_HASH]
+    assert result.index.tolist() == [7]
+
+
+def test_is_sha256_hex(mocker):
+    mocker.patch.object(hashing, "VECTORIZED_CHUNK_ROWS", 2)
+    values = pd.Series([EMAIL_HASH, EMAIL_HASH.upper(), EMAIL_HASH[:-1], EMAIL_HASH + "0", "g" * 64, "short"])
+    assert is_sha256_hex(values).tolist() == [True, False, False, False, False, False]
+    assert is_sha256_hex(pd.Series([], dtype=object)).tolist() == []
+
+
+def test_validate_pre_hashed():
+    values = pd.Series([EMAIL_HASH])
+    assert validate_pre_hashed(values, "email") is values
+    with pytest.raises(ValueError):
+        validate_pre_hashed(pd.Series([EMAIL_HASH, "john@example.com"]), "email")
+
+
+def test_hash_pii_columns_with_pre_hashed_column():
+    df = pd.DataFrame({
+        "email": ["john@example.com", None],
+        "hashed_phone": [" " + EMAIL_HASH.upper() + " ", ""],
+    })
+    pii_fields = [
+        {"column_name": "email", "pii_type": "EMAIL"},
+        {"column_name": "hashed_phone", "pii_type": "PHONE", "pre_hashed": True},
+    ]
+    pii_columns, dropped_counts = normalize_pii_columns(df, pii_fields)
+    hashed_columns = hash_pii_columns(pii_columns, pii_fields)
+    assert hashed_columns["EMAIL_SHA256"].tolist() == [EMAIL_HASH]
+    assert hashed_columns["PHONE_SHA256"].tolist() == [EMAIL_HASH]
+    assert dropped_counts == {"email": 1, "hashed_phone": 1}
+
+
+def test_hash_pii_columns_same_pii_type():
+    df = pd.DataFrame({
+        "email": ["john@example.com", None],
+        "work_email": ["jane@example.com", "john@example.com"],
+    })
+    pii_fields = [
+        {"column_name": "email", "pii_type": "EMAIL"},
+        {"column_name": "work_email", "pii_type": "EMAIL"},
+    ]
+    pii_columns, _ = normalize_pii_columns(df, pii_fields)
+    hashed_columns = hash_pii_columns(pii_columns, pii_fields)
+    # the values of both columns are kept, in the order of pii_fields
+    assert list(hashed_columns) == ["EMAIL_SHA256"]
+    assert hashed_columns["EMAIL_SHA256"].tolist() == [
+        EMAIL_HASH, hashlib.sha256(b"jane@example.com").hexdigest(), EMAIL_HASH]
@@ -0,0 +1,51 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+
+from etl_helpers.manifest import build_manifest, manifest_key, md5_hex, write_manifest
+from etl_helpers.stats import RunStatistics
+
+
+def make_run_stats():
+    run_stats = RunStatistics("test_job", "jr_1", "tiktok", "test_segment", "s3://test_bucket/test.json")
+    run_stats.add_part("s3://out/output/tiktok/test_segment/email_sha256/test1.csv", 10, 650, md5_hex(b"a"), "EMAIL_SHA256")
+    run_stats.add_part("s3://out/output/tiktok/test_segment/email_sha256/test2.csv", 5, 325, md5_hex(b"b"), "EMAIL_SHA256")
+    return run_stats
+
+
+def test_md5_hex():
+    assert md5_hex(b"hash\n") == hashlib.md5(b"hash\n").hexdigest()
+
+
+def test_manifest_key():
+    assert manifest_key("snap", "test_segment", "dir/test") == "output/snap/test_segment/dir/test_manifest.json"
+
+
+def test_build_manifest():
+    manifest = build_manifest(make_run_stats(), "out")
+    assert manifest["platform"] == "tiktok"
+    assert manifest["segment_name"] == "test_segment"
+    assert manifest["total_rows"] == 15
+    assert manifest["parts"][0] == {
+        "key": "output/tiktok/test_segment/email_sha256/test1.csv",
+        "rows": 10,
+        "bytes": 650,
+        "md5": md5_hex(b"a"),
+        "schema": "EMAIL_SHA256",
+    }
+
+
+def test_build_manifest_without_schema():
+    run_stats = RunStatistics("test_job", "jr_1", "snap", "test_segment", "s3://test_bucket/test.json")
+    run_stats.add_part("s3://out/output/snap/test_segment/test1.csv.gz", 10, 100, md5_hex(b"a"))
+    assert "schema" not in build_manifest(run_stats, "out")["parts"][0]
+
+
+def test_write_manifest(mocker):
+    s3_client = mocker.MagicMock()
+    write_manifest(make_run_stats(), s3_client, "out", "output/tiktok/test_segment/test_manifest.json")
+    kwargs = s3_client.put_object.call_args.kwargs
+    assert kwargs["Key"] == "output/tiktok/test_segment/test_manifest.json"
+    assert len(json.loads(kwargs["Body"])["parts"]) == 2
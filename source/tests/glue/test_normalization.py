@@ -0,0 +1,81 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import pandas as pd
+import pytest
+
+from etl_helpers import normalization
+from etl_helpers.normalization import normalize_column, normalize_pii_columns, get_normalization_rules, drop_empty_values
+
+
+def test_normalize_phone():
+    values = pd.Series(["+1 (555) 012-3456", "0044 20 7946 0958", "  ０１２３  ", "no digits", "000"])
+    assert normalize_column(values, "PHONE").tolist() == ["15550123456", "442079460958", "123", "", ""]
+
+
+def test_normalize_phone_wide_values(mocker):
+    mocker.patch.object(normalization, "MAX_VECTORIZED_WIDTH", 4)
+    values = pd.Series(["+1 (555) 012-3456", "007"])
+    assert normalize_column(values, "PHONE").tolist() == ["15550123456", "7"]
+
+
+def test_normalize_phone_chunks(mocker):
+    mocker.patch.object(normalization, "VECTORIZED_CHUNK_ROWS", 2)
+    values = pd.Series(["01", "2-2", "(3)", "04", "5"], index=[10, 11, 12, 13, 14])
+    result = normalize_column(values, "PHONE")
+    assert result.tolist() == ["1", "22", "3", "4", "5"]
+    assert result.index.tolist() == [10, 11, 12, 13, 14]
+
+
+def test_normalize_email():
+    values = pd.Series([" John.Doe@Example.com ", "ｊｏｈｎ@example.com"])
+    assert normalize_column(values, "EMAIL").tolist() == ["John.Doe@Example.com", "john@example.com"]
+
+
+@pytest.mark.parametrize("pii_type", ["MOBILE_AD_ID", "GAID", "IDFA"])
+def test_normalize_mobile_ids(pii_type):
+    values = pd.Series([" 6D92078A-8246-4BA4-AE5B-76104861E7DC "])
+    assert normalize_column(values, pii_type).tolist() == ["6d92078a-8246-4ba4-ae5b-76104861e7dc"]
+
+
+def test_normalize_non_string_values():
+    values = pd.Series([5550123456, 15550123456])
+    assert normalize_column(values, "PHONE").tolist() == ["5550123456", "15550123456"]
+
+
+def test_get_normalization_rules():
+    assert get_normalization_rules("GAID") == get_normalization_rules("IDFA")
+    with pytest.raises(ValueError):
+        get_normalization_rules("SSN")
+
+
+def test_drop_empty_values():
+    values = pd.Series(["+1 555", None, float("nan"), "", "   ", "n/a", "0"], index=range(7))
+    result = drop_empty_values(values, "PHONE")
+    assert result.tolist() == ["1555"]
+    assert result.index.tolist() == [0]
+    assert drop_empty_values(pd.Series([None, None]), "EMAIL").empty
+
+
+def test_normalize_numeric_phone():
+    # a numeric column with a null is read as float64
+    values = pd.Series([15551234567, None, 442079460958]).astype("float64")
+    assert drop_empty_values(values, "PHONE").tolist() == ["15551234567", "442079460958"]
+    assert normalize_column(pd.Series([15551234567]), "PHONE").tolist() == ["15551234567"]
+    # leading zeros kept by the strings read with dtype=False
+    assert normalize_column(pd.Series(["0015551234567", 15551234567]), "PHONE").tolist() == ["15551234567", "15551234567"]
+
+
+def test_normalize_pii_columns():
+    df = pd.DataFrame({
+        "email": ["A@b.com ", None, "c@d.com"],
+        "phone": ["+1 555", None, None],
+        "name": ["not pii", "not pii", "not pii"],
+        "age": [42, 43, 44],
+    })
+    pii_fields = [{"column_name": "email", "pii_type": "EMAIL"}, {"column_name": "phone", "pii_type": "PHONE"}]
+    columns, dropped_counts = normalize_pii_columns(df, pii_fields)
+    assert list(columns) == ["email", "phone"]
+    assert columns["email"].tolist() == ["A@b.com", "c@d.com"]
+    assert columns["phone"].tolist() == ["1555"]
+    assert dropped_counts == {"email": 1, "phone": 2}
@@ -0,0 +1,57 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import io
+
+import pandas as pd
+
+from etl_helpers.output import count_parts, iter_long_format_csv, count_hash_list_parts, iter_hash_list_csv, HASH_LINE_BYTES
+
+HASHED_COLUMNS = {
+    "EMAIL_SHA256": ["e1", "e2", "e3"],
+    "PHONE_SHA256": ["p1", "p2"],
+}
+
+
+def test_count_parts():
+    assert count_parts(HASHED_COLUMNS, 2) == 3
+    assert count_parts(HASHED_COLUMNS, 5) == 1
+    assert count_parts({"EMAIL_SHA256": []}, 5) == 0
+
+
+def test_iter_long_format_csv_matches_melt():
+    df = pd.DataFrame({"EMAIL_SHA256": ["e1", "e2"], "PHONE_SHA256": ["p1", "p2"]})
+    parts = list(iter_long_format_csv({column: df[column].tolist() for column in df.columns}, 5))
+    assert len(parts) == 1
+    written = pd.read_csv(io.StringIO(parts[0]))
+    expected = df.melt().rename(columns={"variable": "schema", "value": "hash"})
+    assert written.values.tolist() == expected.values.tolist()
+    assert written.columns.tolist() == ["schema", "hash"]
+
+
+def test_iter_long_format_csv_parts():
+    parts = list(iter_long_format_csv(HASHED_COLUMNS, 2))
+    assert parts == [
+        "schema,hash\nEMAIL_SHA256,e1\nEMAIL_SHA256,e2\n",
+        "schema,hash\nEMAIL_SHA256,e3\nPHONE_SHA256,p1\n",
+        "schema,hash\nPHONE_SHA256,p2\n",
+    ]
+
+
+def test_iter_long_format_csv_empty():
+    assert list(iter_long_format_csv({"EMAIL_SHA256": []}, 2)) == []
+
+
+def test_count_hash_list_parts():
+    assert count_hash_list_parts(0, 650) == 0
+    assert count_hash_list_parts(10, 650) == 1
+    assert count_hash_list_parts(11, 650) == 2
+
+
+def test_iter_hash_list_csv():
+    values = ["a" * 64] * 5
+    parts = list(iter_hash_list_csv(values, 3 * HASH_LINE_BYTES))
+    assert [part.count("\n") for part in parts] == [3, 2]
+    assert all(len(part.encode()) <= 3 * HASH_LINE_BYTES for part in parts)
+    assert "".join(parts) == "\n".join(values) + "\n"
+    assert list(iter_hash_list_csv([], HASH_LINE_BYTES)) == []
@@ -0,0 +1,148 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+
+import pandas as pd
+import pytest
+from botocore.exceptions import ClientError
+
+from etl_helpers.pushdown import (
+    FULL_READ, SELECT_READ, build_select_expression, project_columns, read_pii_columns, scan_ranges, select_columns,
+)
+
+COLUMNS = ["email", "phone"]
+RECORDS = [
+    {"email": "a@example.com", "phone": "+15550001", "name": "a" * 100},
+    {"email": None, "phone": None, "name": "b" * 100},
+    {"phone": "+15550003", "name": "c" * 100},
+    {"name": "d" * 100},
+    {"email": "e@example.com", "name": "e" * 100},
+]
+
+
+class FakeS3:
+    """
+    S3 Select of the projection and null filtering of build_select_expression, on the records
+    starting in the scan range, its end included
+    """
+
+    def __init__(self, records):
+        self.body = "".join(json.dumps(record) + "\n" for record in records).encode()
+        self.requests = []
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.body)}
+
+    def select_object_content(self, **request):
+        self.requests.append(request)
+        scan_range = request.get("ScanRange", {"Start": 0, "End": len(self.body) - 1})
+        start, end = scan_range["Start"], scan_range["End"]
+        lines = []
+        offset = 0
+        for line in self.body.splitlines(keepends=True):
+            if start <= offset <= end:
+                record = json.loads(line)
+                selected = {column: record[column] for column in COLUMNS if record.get(column) is not None}
+                if selected:
+                    lines.append(json.dumps(selected) + "\n")
+            offset += len(line)
+        payload = "".join(lines).encode()
+        # the records are split over several events
+        events = [{"Records": {"Payload": payload[:10]}}, {"Records": {"Payload": payload[10:]}}]
+        events.append({"Stats": {"Details": {"BytesScanned": end - start, "BytesReturned": len(payload)}}})
+        return {"Payload": iter(events)}
+
+
+class NoSelectS3(FakeS3):
+    def __init__(self, records, code="NotImplemented"):
+        super().__init__(records)
+        self.code = code
+
+    def select_object_content(self, **request):
+        raise ClientError({"Error": {"Code": self.code, "Message": "S3 Select"}}, "SelectObjectContent")
+
+
+def test_build_select_expression():
+    assert build_select_expression(["email", 'my "phone"']) == (
+        'SELECT s."email", s."my ""phone""" FROM S3Object s WHERE s."email" IS NOT NULL OR s."my ""phone""" IS NOT NULL')
+
+
+def test_scan_ranges():
+    assert scan_ranges(10, 4) == [(0, 3), (4, 7), (8, 9)]
+    assert scan_ranges(8, 4) == [(0, 3), (4, 7)]
+    assert scan_ranges(0, 4) == []
+
+
+def test_select_columns():
+    s3_client = FakeS3(RECORDS)
+    df, bytes_returned = select_columns(s3_client, "bucket", "input.json", COLUMNS, scan_range_bytes=150)
+    assert len(s3_client.requests) == 5
+    assert s3_client.requests[0]["InputSerialization"] == {"JSON": {"Type": "LINES"}, "CompressionType": "NONE"}
+    assert list(df.columns) == COLUMNS
+    # the values keep their JSON type
+    assert df["email"].fillna("").tolist() == ["a@example.com", "", "e@example.com"]
+    assert df["phone"].fillna("").tolist() == ["+15550001", "+15550003", ""]
+    assert bytes_returned < len(s3_client.body) / 4
+
+
+def test_select_columns_range_boundary():
+    # every record starts on a range boundary, each one is returned once
+    s3_client = FakeS3(RECORDS[:1] * 4)
+    line_bytes = len(s3_client.body) // 4
+    df, _ = select_columns(s3_client, "bucket", "input.json", COLUMNS, scan_range_bytes=line_bytes)
+    assert [request["ScanRange"] for request in s3_client.requests] == [
+        {"Start": i * line_bytes, "End": (i + 1) * line_bytes - 1} for i in range(4)]
+    assert len(df) == 4
+
+
+def test_select_columns_no_value():
+    df, _ = select_columns(FakeS3(RECORDS[3:4]), "bucket", "input.json", COLUMNS)
+    assert list(df.columns) == COLUMNS
+    assert df.empty
+
+
+def test_read_pii_columns_fallback():
+    s3_client = FakeS3(RECORDS)
+    df, read_method, bytes_returned = read_pii_columns(s3_client, "bucket", "input.json", COLUMNS, lambda: pd.DataFrame(RECORDS))
+    assert read_method == SELECT_READ
+    assert bytes_returned > 0
+
+    full_df, read_method, bytes_returned = read_pii_columns(
+        NoSelectS3(RECORDS), "bucket", "input.json", COLUMNS, lambda: pd.DataFrame(RECORDS))
+    assert read_method == FULL_READ
+    assert bytes_returned is None
+    # the same rows and columns either way
+    pd.testing.assert_frame_equal(full_df.fillna("").astype(str), df.fillna("").astype(str))
+
+
+def test_read_pii_columns_error():
+    # only an S3 Select not implemented falls back to the full read
+    with pytest.raises(ClientError):
+        read_pii_columns(NoSelectS3(RECORDS, "AccessDenied"), "bucket", "input.json", COLUMNS, lambda: pd.DataFrame(RECORDS))
+
+
+def test_read_pii_columns_compressed():
+    s3_client = FakeS3(RECORDS)
+    df, read_method, _ = read_pii_columns(s3_client, "bucket", "input.json.gz", COLUMNS, None, compression="gzip")
+    assert read_method == SELECT_READ
+    assert len(df) == 3
+    # a single request, scan ranges are only supported on uncompressed objects
+    assert len(s3_client.requests) == 1
+    assert "ScanRange" not in s3_client.requests[0]
+    assert s3_client.requests[0]["InputSerialization"]["CompressionType"] == "GZIP"
+
+    df, read_method, _ = read_pii_columns(
+        s3_client, "bucket", "input.json.zst", COLUMNS, lambda: pd.DataFrame(RECORDS), compression="zstd")
+    assert read_method == FULL_READ
+    assert len(df) == 3
+    assert len(s3_client.requests) == 1
+
+
+def test_project_columns():
+    df = project_columns(pd.DataFrame([{"email": "a", "other": 1}, {"other": 2}]), COLUMNS)
+    assert list(df.columns) == COLUMNS
+    assert df["email"].tolist() == ["a"]
+    assert df["phone"].isna().all()
+    with pytest.raises(KeyError):
+        df["other"]
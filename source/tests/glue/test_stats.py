@@ -0,0 +1,81 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+
+import pytest
+
+from upload_engine.profiling import MemoryProfiler
+from etl_helpers.stats import RunStatistics, write_run_statistics, METRICS_NAMESPACE
+
+
+@pytest.fixture
+def run_stats():
+    run_stats = RunStatistics("test_job", "jr_1", "snap", "test_segment", "s3://test_bucket/test.json")
+    with run_stats.stage("read") as stage:
+        stage.rows = 10
+    run_stats.rows_read = 10
+    run_stats.add_column({"column_name": "email", "pii_type": "EMAIL"}, 2)
+    run_stats.add_column({"column_name": "phone", "pii_type": "PHONE", "pre_hashed": True}, 3)
+    run_stats.rows_hashed = {"EMAIL_SHA256": 8, "PHONE_SHA256": 7}
+    run_stats.add_part("s3://out/part1.csv.gz", 10, 100)
+    run_stats.add_part("s3://out/part2.csv.gz", 5, 50)
+    yield run_stats
+
+
+def test_stage_timing(run_stats):
+    with run_stats.stage("hash") as stage:
+        stage.rows = 15
+    with pytest.raises(ValueError):
+        with run_stats.stage("write"):
+            raise ValueError("stage failed")
+    assert set(run_stats.stages) == {"read", "hash", "write"}
+    assert run_stats.stages["write"].seconds > 0
+    assert run_stats.stages["hash"].rows == 15
+
+
+def test_to_dict(run_stats):
+    stats = json.loads(run_stats.to_json())
+    assert stats["job_run_id"] == "jr_1"
+    assert stats["rows_read"] == 10
+    assert stats["rows_dropped"] == 5
+    assert stats["columns"]["phone"] == {"pii_type": "PHONE", "pre_hashed": True, "rows_dropped": 3}
+    assert stats["rows_hashed"] == {"EMAIL_SHA256": 8, "PHONE_SHA256": 7}
+    assert stats["parts_written"] == 2
+    assert stats["bytes_written"] == 150
+    assert set(stats["stages"]["read"]) == {"seconds", "rows", "rows_per_second"}
+
+
+def test_metric_data(run_stats):
+    metric_data = run_stats.metric_data()
+    by_name = {(metric["MetricName"], len(metric["Dimensions"])): metric for metric in metric_data}
+    assert by_name[("RowsHashed", 1)]["Value"] == 15
+    assert by_name[("BytesWritten", 1)]["Unit"] == "Bytes"
+    assert by_name[("StageDuration", 2)]["Dimensions"][1] == {"Name": "Stage", "Value": "read"}
+
+
+def test_stage_memory():
+    profiler = MemoryProfiler()
+    run_stats = RunStatistics("test_job", "jr_1", "snap", "test_segment", "s3://test_bucket/test.json", profiler)
+    profiler.start()
+    with run_stats.stage("read") as stage:
+        stage.rows = 10
+    profiler.stop()
+    stats = run_stats.to_dict()
+    assert stats["stages"]["read"]["peak_rss_bytes"] > 0
+    assert "peak_traced_bytes" not in stats["stages"]["read"]
+    metrics = {metric["MetricName"]: metric for metric in run_stats.metric_data()}
+    assert metrics["StagePeakMemory"]["Unit"] == "Bytes"
+
+
+def test_write_run_statistics(run_stats, mocker):
+    s3_client = mocker.MagicMock()
+    cloudwatch_client = mocker.MagicMock()
+    write_run_statistics(run_stats, s3_client, cloudwatch_client, "out", "stats/snap/test_segment/test.json")
+    s3_client.put_object.assert_called_once()
+    assert s3_client.put_object.call_args.kwargs["Key"] == "stats/snap/test_segment/test.json"
+    assert cloudwatch_client.put_metric_data.call_args.kwargs["Namespace"] == METRICS_NAMESPACE
+
+    # metrics publishing failures do not fail the job
+    cloudwatch_client.put_metric_data.side_effect = Exception("throttled")
+    write_run_statistics(run_stats, s3_client, cloudwatch_client, "out", "stats/snap/test_segment/test.json")
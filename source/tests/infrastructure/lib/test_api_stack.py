@@ -40,7 +40,7 @@ def synth_nested_template():
 # IAM Role creation
 def test_iam_role_creation(synth_nested_template):
     template = synth_nested_template
-    template.resource_count_is("AWS::IAM::Role", 1)
+    template.resource_count_is("AWS::IAM::Role", 2)
 
     template.has_resource_properties(
         "AWS::IAM::Role",
@@ -81,16 +81,48 @@ def test_iam_role_creation(synth_nested_template):
                                     "Fn::Sub": Match.any_value()
                                 }
                             },
+                            {
+                                "Effect": "Allow",
+                                "Action": [
+                                    "s3:GetObject",
+                                    "s3:GetObjectTagging"
+                                ],
+                                "Resource": {
+                                    "Fn::Sub": Match.any_value()
+                                }
+                            },
+                            {
+                                "Effect": "Allow",
+                                "Action": [
+                                    "s3:ListBucket"
+                                ],
+                                "Resource": {
+                                    "Fn::Sub": Match.any_value()
+                                }
+                            },
                             {
                                 "Effect": "Allow",
                                 "Action": [
                                     "glue:StartJobRun",
-                                    "glue:GetJobRuns"
+                                    "glue:GetJobRuns",
+                                    "glue:GetJob"
                                 ],
                                 "Resource": {
                                     "Fn::Sub": Match.any_value()
                                 }
                             },
+                            {
+                                "Effect": "Allow",
+                                "Action": [
+                                    "sqs:SendMessage",
+                                    "sqs:ReceiveMessage",
+                                    "sqs:DeleteMessage",
+                                    "sqs:ChangeMessageVisibility"
+                                ],
+                                "Resource": {
+                                    "Fn::GetAtt": ["BatchQueue", "Arn"]
+                                }
+                            },
                             {
                                 "Action": [
                                     "logs:CreateLogGroup",
@@ -124,7 +156,7 @@ def test_iam_role_creation(synth_nested_template):
 # Serverless Function
 def test_serverless_function_creation(synth_nested_template):
     template = synth_nested_template
-    template.resource_count_is("AWS::Serverless::Function", 1)
+    template.resource_count_is("AWS::Serverless::Function", 2)
 
     bucket = Capture()
     key_id = Capture()
@@ -151,6 +183,12 @@ def test_serverless_function_creation(synth_nested_template):
                     "AMC_API_ROLE_ARN": Match.any_value(),
                     "AMC_GLUE_JOB_NAME": {
                         "Ref": Match.any_value()
+                    },
+                    "ARTIFACT_BUCKET_NAME": {
+                        "Ref": "ArtifactBucketName"
+                    },
+                    "BATCH_QUEUE_URL": {
+                        "Ref": "BatchQueue"
                     }
                 }
             },
@@ -187,6 +225,59 @@ def test_serverless_function_creation(synth_nested_template):
         }
     )
 
+# Queue of the batches of transformations, started when runs of the Glue job finish
+def test_batch_queue_creation(synth_nested_template):
+    template = synth_nested_template
+    template.resource_count_is("AWS::SQS::Queue", 2)
+    template.has_resource_properties(
+        "AWS::SQS::Queue",
+        {
+            "FifoQueue": True,
+            "SqsManagedSseEnabled": True,
+            "RedrivePolicy": {
+                "deadLetterTargetArn": {
+                    "Fn::GetAtt": ["BatchDeadLetterQueue", "Arn"]
+                },
+                "maxReceiveCount": 5
+            }
+        }
+    )
+
+    template.has_resource_properties(
+        "AWS::Serverless::Function",
+        {
+            "Handler": "app.start_queued_transformations",
+            "Environment": {
+                "Variables": {
+                    "BATCH_QUEUE_URL": {
+                        "Ref": "BatchQueue"
+                    }
+                }
+            },
+            "Events": {
+                "StartQueuedTransformationsEvent": {
+                    "Type": "CloudWatchEvent",
+                    "Properties": {
+                        "Pattern": {
+                            "source": ["aws.glue"],
+                            "detail-type": ["Glue Job State Change"],
+                            "detail": {
+                                "state": ["SUCCEEDED", "FAILED", "TIMEOUT", "STOPPED"],
+                                "jobName": [{"Ref": Match.any_value()}]
+                            }
+                        }
+                    }
+                }
+            },
+            "Role": {
+                "Fn::GetAtt": [
+                    "StartQueuedTransformationsRole",
+                    "Arn"
+                ]
+            }
+        }
+    )
+
 # Serverless Api
 def test_serverless_api_creation(synth_nested_template):
     template = synth_nested_template
@@ -321,8 +412,8 @@ def test_serverless_api_creation(synth_nested_template):
                 "contentHandling": "CONVERT_TO_TEXT",
                 "type": "aws_proxy"
                 },
-                "summary": "Retrieves metadata for all runs of a given Glue ETL job definition.",
-                "description": "Returns:\n\n.. code-block:: python\n\n    {'JobRuns': [...]}",
+                "summary": "Retrieves metadata for the runs of a given Glue ETL job definition, newest first,",
+                "description": "one page at a time.\n\nQuery string parameters (all optional):\n\n.. code-block:: python\n\n    {\n        \"max_results\": integer (from 1 to 200, default 200),\n        \"next_token\": string (NextToken of the previous page),\n        \"segment_name\": string,\n        \"state\": string (comma-separated JobRunState values, e.g. RUNNING,FAILED),\n        \"started_after\": string (ISO 8601 timestamp),\n        \"started_before\": string (ISO 8601 timestamp),\n        \"since\": string (ISO 8601 timestamp, e.g. the PolledAt of the previous poll,\n                         to only get the runs started or updated since)\n    }\n\nReturns:\n\n.. code-block:: python\n\n    {'JobRuns': [...], 'NextToken': string, 'PolledAt': string}",
                 "security": [
                 {
                 "sigv4": []
@@ -109,8 +109,16 @@ def test_glue_job_creation(synth_nested_template):
             "DefaultArguments": {
                 "--job-bookmark-option": "job-bookmark-enable",
                 "--job-language": "python",
-                "--extra-py-files": "s3://aws-data-wrangler-public-artifacts/releases/2.14.0/awswrangler-2.14.0-py3-none-any.whl",
-                "--additional-python-modules": "awswrangler==2.14.0",
+                "--extra-py-files": {
+                    "Fn::Join": [
+                        ",",
+                        [
+                            "s3://aws-data-wrangler-public-artifacts/releases/2.14.0/awswrangler-2.14.0-py3-none-any.whl",
+                            Match.any_value(),  # "s3://${ArtifactBucketName}/etl_helpers.zip"
+                        ],
+                    ]
+                },
+                "--additional-python-modules": "awswrangler==2.14.0,zstandard==0.21.0",
                 "--source_bucket": {"Fn::Sub": Match.any_value()},  # "${DataBucketName}"
                 "--output_bucket": {"Fn::Sub": Match.any_value()},  # "${ArtifactBucketName}"
                 "--source_key": "",
@@ -36,12 +36,12 @@ def synth_nested_template():
 # Segment Uploader code test
 def test_nested_stack_lambda_creation(synth_nested_template):
     template = synth_nested_template
-    template.resource_count_is("AWS::Lambda::Function", 2)
+    template.resource_count_is("AWS::Lambda::Function", 5)
 
     snap_uploader_segment_role = Capture()
     solutions_layer = Capture()
 
-    # users to segment - the other one is MetricsFunction
+    # users to segment - the others are the upload workflow steps and MetricsFunction
     template.has_resource_properties(
         "AWS::Lambda::Function",
         {
@@ -139,10 +139,10 @@ def test_resource_sqs_queue(synth_nested_template):
 
 # make sure the IAM policy is created properly
 # this policy is to decrypt the queue messages
-# make sure that the policy only shows up once
+# the other policies are the upload workflow step and state machine policies
 def test_iam_policy_creation(synth_nested_template):
     template = synth_nested_template
-    template.resource_count_is("AWS::IAM::Policy", 1)
+    template.resource_count_is("AWS::IAM::Policy", 5)
 
     key_id = Capture()
     dlq_id = Capture()
@@ -195,6 +195,7 @@ def test_iam_policy_creation(synth_nested_template):
                         "Action": [
                             "S3:ListBucket",
                             "S3:GetObjectTagging",
+                            "S3:PutObjectTagging",
                             "S3:GetObject",
                             "S3:PutBucketNotification"
                         ],
@@ -238,6 +239,13 @@ def test_iam_policy_creation(synth_nested_template):
                             "Ref": Match.any_value()
                         }
                     },
+                    {
+                        "Action": "states:StartExecution",
+                        "Effect": "Allow",
+                        "Resource": {
+                            "Ref": Match.any_value()
+                        }
+                    },
                     {
                         "Action": [
                             "sqs:ReceiveMessage",
@@ -345,3 +353,42 @@ def test_lambda_event_source_creation(synth_nested_template):
         template.to_json()["Resources"][snap_uploader_segment.as_string()]["Type"]
         == "AWS::Lambda::Function"
     )
+
+
+# assert the upload workflow creation
+def test_upload_workflow_creation(synth_nested_template):
+    template = synth_nested_template
+    template.resource_count_is("AWS::StepFunctions::StateMachine", 1)
+
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "Handler": "lambda_handler.upload_part_handler",
+            "Timeout": 900,
+        }
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "Environment": {
+                "Variables": {
+                    "UPLOAD_STATE_MACHINE_ARN": {"Ref": Match.any_value()}
+                }
+            },
+            "Handler": "lambda_handler.lambda_handler",
+        }
+    )
+
+    state_machine = list(template.find_resources("AWS::StepFunctions::StateMachine").values())[0]
+    definition = "".join(part for part in state_machine["Properties"]["DefinitionString"]["Fn::Join"][1] if isinstance(part, str))
+    assert '"Type":"Map"' in definition
+    assert '"MaxConcurrency":4' in definition
+    assert '"ErrorEquals":["RetryableUploadError"]' in definition
+    # throttled parts wait for the delay returned by the upload part lambda
+    assert '"Type":"Wait","SecondsPath":"$.outcome.retry_after_seconds"' in definition
+    assert '"StringEquals":"RETRY"' in definition
+    # the parts are not passed to the aggregate step
+    assert '"Parameters":{"plan.$":"$.plan","results.$":"$.results"}' in definition
+    # each Map iteration uploads a range of parts, the next attempt of a throttled range resumes at the throttled part
+    assert '"Parameters":{"plan.$":"$.plan","parts.$":"$$.Map.Item.Value"}' in definition
+    assert '"Parameters":{"plan.$":"$.plan","parts.$":"$.parts","attempt.$":"$.outcome.attempt","results.$":"$.outcome.results"}' in definition
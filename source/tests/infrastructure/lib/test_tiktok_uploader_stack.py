@@ -169,7 +169,7 @@ def test_sqs_lambda_creation(template):
     sqs_role_policy_name = Capture()
     sqs_role_name = Capture()
 
-    template.resource_count_is("AWS::IAM::Policy", 1)
+    template.resource_count_is("AWS::IAM::Policy", 5)
     template.has_resource_properties(
         "AWS::IAM::Policy",
         {
@@ -216,6 +216,7 @@ def test_sqs_lambda_creation(template):
                         "Action": [
                             "S3:ListBucket",
                             "S3:GetObjectTagging",
+                            "S3:PutObjectTagging",
                             "S3:GetObject",
                             "S3:PutBucketNotification"
                         ],
@@ -243,6 +244,13 @@ def test_sqs_lambda_creation(template):
                         "Effect": "Allow",
                         "Resource": Match.any_value()
                     },
+                    {
+                        "Action": "states:StartExecution",
+                        "Effect": "Allow",
+                        "Resource": {
+                            "Ref": Match.any_value()
+                        }
+                    },
                     {
                         "Action": [
                             "sqs:ReceiveMessage",
@@ -268,7 +276,7 @@ def test_sqs_lambda_creation(template):
         },
     )
 
-    template.resource_count_is("AWS::IAM::Role", 2)
+    template.resource_count_is("AWS::IAM::Role", 6)
     template.has_resource_properties(
         "AWS::IAM::Role",
         {
@@ -336,7 +344,7 @@ def test_sqs_lambda_creation(template):
         },
     )
 
-    template.resource_count_is("AWS::Lambda::Function", 2)
+    template.resource_count_is("AWS::Lambda::Function", 5)
     template.has_resource_properties(
         "AWS::Lambda::Function",
         {
@@ -396,7 +404,7 @@ def test_metrics_lambda_creation(template):
     )
     assert s3_key.as_string().endswith(".zip")
 
-    template.resource_count_is("AWS::IAM::Role", 2)
+    template.resource_count_is("AWS::IAM::Role", 6)
     template.has_resource_properties(
         "AWS::IAM::Role",
         {
@@ -453,7 +461,7 @@ def test_metrics_lambda_creation(template):
 
     metrics_role_name = Capture()
 
-    template.resource_count_is("AWS::Lambda::Function", 2)
+    template.resource_count_is("AWS::Lambda::Function", 5)
     template.has_resource_properties(
         "AWS::Lambda::Function",
         {
@@ -482,3 +490,21 @@ def test_metrics_lambda_creation(template):
         }
     )
     assert metrics_role_name.as_string().startswith("MetricsMetricsFunctionRole")
+
+
+def test_upload_workflow_creation(template):
+    template.resource_count_is("AWS::StepFunctions::StateMachine", 1)
+    for handler in ["plan_handler", "upload_part_handler", "aggregate_handler"]:
+        template.has_resource_properties(
+            "AWS::Lambda::Function",
+            {
+                "Handler": "lambda_handler." + handler,
+                "Environment": {
+                    "Variables": {
+                        "CRED_SECRET_NAME": Match.any_value(),
+                        "SOLUTION_ID": Match.any_value(),
+                        "SOLUTION_VERSION": Match.any_value()
+                    }
+                },
+            },
+        )
@@ -86,9 +86,10 @@ def test_kms_key_creation(synth_nested_template):
 # assert queue creation
 def test_sqs_queue_creation(synth_nested_template):
     template = synth_nested_template
-    template.resource_count_is("AWS::SQS::Queue", 1)
+    template.resource_count_is("AWS::SQS::Queue", 2)  # queue and dead letter queue
 
     kms_key_id = Capture()
+    dead_letter_queue_id = Capture()
     template.has_resource_properties(
         "AWS::SQS::Queue",
         {
@@ -99,10 +100,25 @@ def test_sqs_queue_creation(synth_nested_template):
                     "Arn"
                 ]
             },
+            "RedrivePolicy": {
+                "deadLetterTargetArn": {
+                    "Fn::GetAtt": [
+                        dead_letter_queue_id,
+                        "Arn"
+                    ]
+                },
+                "maxReceiveCount": 10
+            },
             "VisibilityTimeout": 5400
         }
     )
 
+    # make sure the dead letter queue keeps failed messages for inspection
+    assert (
+        template.to_json()["Resources"][dead_letter_queue_id.as_string()]["Properties"]["MessageRetentionPeriod"]
+        == 1209600
+    )
+
     # make sure the key was created with the correct name
     assert (
         template.to_json()["Resources"][kms_key_id.as_string()]["Type"]
@@ -180,6 +196,13 @@ def test_event_rule_creation(synth_nested_template):
                                 "prefix": "uploader-etl-artifacts"
                             }
                         ]
+                    },
+                    "object": {
+                        "key": [
+                            {
+                                "suffix": "_manifest.json"
+                            }
+                        ]
                     }
                 },
                 "detail-type": [